@@ -1,10 +1,12 @@
 import click
 from home_messages_db import HomeMessagesDB
 import pandas as pd
+from instrumentation import profile_options
 from datetime import timedelta
 
 @click.command()
 @click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@profile_options
 def analyze_occupancy(dburl):
     """Identify time intervals when nobody is at home based on low SmartThings activity."""
     db = HomeMessagesDB(dburl)
@@ -14,8 +16,10 @@ def analyze_occupancy(dburl):
         smartthings_data = db.query_smartthings()
 
         # Convert to DataFrame
-        df = pd.DataFrame([(s.epoch, s.capability, s.attribute, s.value) for s in smartthings_data],
-                         columns=['epoch', 'capability', 'attribute', 'value'])
+        with db.profiler.stage('to_dataframe') as stage:
+            df = pd.DataFrame([(s.epoch, s.capability, s.attribute, s.value) for s in smartthings_data],
+                             columns=['epoch', 'capability', 'attribute', 'value'])
+            stage.add_rows(len(df))
 
         # Filter relevant capabilities (e.g., switch, motion)
         activity_df = df[df['capability'].isin(['switch', 'motionSensor'])]
@@ -32,7 +36,8 @@ def analyze_occupancy(dburl):
         unoccupied_intervals['end_time'] = pd.to_datetime(unoccupied_intervals['next_epoch'], unit='s', utc=True)
 
         # Save results
-        unoccupied_intervals[['start_time', 'end_time', 'gap']].to_csv('unoccupied_intervals.csv', index=False)
+        with db.profiler.stage('write_csv'):
+            unoccupied_intervals[['start_time', 'end_time', 'gap']].to_csv('unoccupied_intervals.csv', index=False)
         click.echo("Unoccupied intervals saved to 'unoccupied_intervals.csv'")
 
     except Exception as e:
@@ -0,0 +1,263 @@
+import contextlib
+import glob
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from queue import Empty
+import click
+from instrumentation import get_profiler, profile_options
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+# Analyses run by the suite: (name, module, extra CLI arguments)
+ANALYSES = [
+    ('analyze_usage', 'analyze_usage', []),
+    ('analyze_usage_pandas', 'analyze_usage', ['--backend', 'pandas']),
+    ('analyze_usage_store', 'analyze_usage', ['--backend', 'store']),
+    ('analyze_occupancy', 'analyze_occupancy', []),
+    ('build_features', 'build_features', []),
+    ('stats_runner', 'stats_runner', ['--test', 'anova', '-c', 't1_kwh', '-c', 'weekday',
+                                      '--by', 'month', '--bootstrap', '100']),
+]
+
+# Startup runs of the smarthome CLI besides `<subcommand> --help`: (name, arguments);
+# {db} and {dburl} are the benchmark database
+STARTUP_COMMANDS = [
+    ('db list-tables', ['db', '--db', '{db}', 'list-tables']),
+    ('db stats', ['db', '--db', '{db}', 'stats']),
+    ('create-db (current schema)', ['create-db', '-d', '{dburl}']),
+]
+
+
+# PART-1 - Stage bodies (run in a fresh interpreter each)
+def _run_cli(module_name, args):
+    module = importlib.import_module(module_name)
+    command = getattr(module, module_name)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        command.main(args, standalone_mode=False)
+
+
+def _stage_ingest(dburl, loader, files):
+    _run_cli(loader, ['-d', dburl, *files])
+
+
+def _stage_weather(dburl, start, months, seed):
+    from home_messages_db import HomeMessagesDB
+    from synthetic_data import generate_weather_rows
+    db = HomeMessagesDB(dburl)
+    try:
+        return db.bulk_insert_weather(generate_weather_rows(start, months, seed))
+    finally:
+        db.close()
+
+
+def _stage_query(dburl, method):
+    from home_messages_db import HomeMessagesDB
+    db = HomeMessagesDB(dburl)
+    try:
+        return len(getattr(db, method)())
+    finally:
+        db.close()
+
+
+def _stage_analysis(dburl, module_name, extra, workdir):
+    # Analyses write their CSVs to the working directory
+    os.chdir(workdir)
+    _run_cli(module_name, ['-d', dburl, *extra])
+
+
+def _measure(target, args, queue):
+    """Child entry point: run one stage and report wall time and peak RSS."""
+    started = time.perf_counter()
+    try:
+        rows = target(*args)
+        result = {'seconds': time.perf_counter() - started, 'rows': rows}
+    except Exception as e:
+        result = {'seconds': time.perf_counter() - started, 'error': f"{type(e).__name__}: {e}"}
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+    queue.put(result)
+
+
+def run_stage(group, name, target, *args):
+    """Run a stage in a spawned process so time and peak memory are isolated per stage.
+
+    A child that dies without reporting (e.g. killed for running out of memory) fails the stage.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(target, args, queue))
+    started = time.perf_counter()
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            if process.is_alive():
+                continue
+        # The child has exited; its result may still be in the pipe
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            result = {'seconds': time.perf_counter() - started,
+                      'error': f"stage process exited with code {process.exitcode} without a result"}
+        break
+    process.join()
+    return {'group': group, 'stage': name, **result}
+
+
+# PART-2 - Suite
+def run_suite(data_dir, workdir, start, months, seed):
+    """Run ingestion, query and analysis stages against a fresh database in workdir."""
+    dburl = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    results = []
+
+    def files(source, pattern):
+        return sorted(glob.glob(os.path.join(data_dir, source, pattern)))
+
+    for loader, source, pattern in [('p1e', 'P1e', 'P1e-*.csv*'), ('p1g', 'P1g', 'P1g-*.csv*'),
+                                    ('smartthings', 'smartthings', 'smartthings.*.tsv*')]:
+        results.append(run_stage('ingest', loader, _stage_ingest, dburl, loader, files(source, pattern)))
+    results.append(run_stage('ingest', 'weather', _stage_weather, dburl, start, months, seed))
+
+    from home_messages_db import HomeMessagesDB
+    for method in sorted(name for name in dir(HomeMessagesDB) if name.startswith('query_')):
+        results.append(run_stage('query', method, _stage_query, dburl, method))
+
+    for name, module_name, extra in ANALYSES:
+        results.append(run_stage('analysis', name, _stage_analysis, dburl, module_name, extra, workdir))
+    return results
+
+
+def run_startup(workdir, repeat):
+    """Time interpreter start to exit of every smarthome subcommand (best of `repeat` runs).
+
+    Startup is what a user waits for before any work happens: imports, CLI parsing and the
+    schema check. Each subcommand is run with --help, plus the light commands in STARTUP_COMMANDS.
+    """
+    from smarthome import SUBCOMMANDS
+    db = os.path.join(workdir, 'bench.db')
+    dburl = f"sqlite:///{db}"
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'smarthome.py')
+    # The schema must exist, so the db commands measure the fast path
+    subprocess.run([sys.executable, cli, 'create-db', '-d', dburl], capture_output=True, check=True)
+
+    runs = [(f"{name} --help", [name, '--help']) for name in SUBCOMMANDS]
+    runs += [(name, [arg.format(db=db, dburl=dburl) for arg in args]) for name, args in STARTUP_COMMANDS]
+    results = []
+    for name, args in runs:
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, cli, *args], capture_output=True, text=True)
+            times.append(time.perf_counter() - started)
+        result = {'group': 'startup', 'stage': name, 'seconds': min(times), 'median_seconds': statistics.median(times)}
+        if completed.returncode:
+            result['error'] = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else \
+                f"exit status {completed.returncode}"
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (stage, old, new, ratio) for stages that got slower than the tolerance allows."""
+    old = {(r['group'], r['stage']): r for r in baseline['stages']}
+    regressions = []
+    for r in results:
+        previous = old.get((r['group'], r['stage']))
+        if previous and 'error' not in r and previous.get('seconds'):
+            ratio = r['seconds'] / previous['seconds']
+            if ratio > 1 + tolerance:
+                regressions.append((f"{r['group']}/{r['stage']}", previous['seconds'], r['seconds'], ratio))
+    return regressions
+
+
+@click.command()
+@click.option('--data', 'data_dir', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Existing synthetic data directory (default: generate into a temp dir).')
+@click.option('--scale', type=int, default=1, show_default=True, help='Volume factor when generating.')
+@click.option('--months', type=int, default=32, show_default=True)
+@click.option('--devices', type=int, default=30, show_default=True)
+@click.option('--start', default='2022-06-01', show_default=True)
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('-o', '--output', default=None,
+              help='Result JSON (default: benchmarks/bench-<timestamp>-x<scale>.json).')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True), default=None,
+              help='Earlier result JSON to compare against.')
+@click.option('--tolerance', type=float, default=0.2, show_default=True,
+              help='Allowed slowdown before a stage is reported as a regression.')
+@click.option('--startup-only', is_flag=True, help='Only time the startup of the smarthome subcommands.')
+@click.option('--startup-repeat', type=int, default=5, show_default=True,
+              help='Runs per subcommand for the startup times (the best run counts).')
+@profile_options
+def benchmark(data_dir, scale, months, devices, start, seed, output, baseline_path, tolerance, startup_only,
+              startup_repeat):
+    """Time ingestion, every query_* method, each analysis and the CLI startup on synthetic data.
+
+    Usage:
+        benchmark.py --scale 10
+        benchmark.py --data data/synthetic --compare benchmarks/bench-20250101-120000-x1.json
+        benchmark.py --startup-only
+    """
+    from synthetic_data import generate_dataset
+
+    counts = None
+    with tempfile.TemporaryDirectory(prefix='smarthome-bench-') as workdir:
+        results = []
+        if not startup_only:
+            if data_dir is None:
+                data_dir = os.path.join(workdir, 'data')
+                click.echo(f"Generating {months} months x {devices} devices at scale {scale}...")
+                counts = generate_dataset(data_dir, start, months, devices, scale, seed)
+
+            with get_profiler().stage('run_suite'):
+                results = run_suite(data_dir, workdir, start, months, seed)
+
+        with get_profiler().stage('run_startup'):
+            results += run_startup(workdir, startup_repeat)
+
+    for r in results:
+        if r['group'] == 'startup':
+            status = r.get('error') or f"{r['seconds'] * 1000:8.0f}ms (median {r['median_seconds'] * 1000:.0f}ms)"
+        else:
+            status = r.get('error') or f"{r['seconds']:8.2f}s  peak {r.get('peak_rss_mb', float('nan')):7.1f} MB"
+        click.echo(f"{r['group']:>8} {r['stage']:<28} {status}")
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'scale': scale, 'months': months, 'devices': devices, 'seed': seed,
+        'generated_rows': counts,
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'stages': results,
+    }
+    if output is None:
+        os.makedirs('benchmarks', exist_ok=True)
+        output = os.path.join('benchmarks', f"bench-{datetime.now():%Y%m%d-%H%M%S}-x{scale}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    click.echo(f"Results saved to '{output}'")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for stage, old, new, ratio in regressions:
+            click.echo(f"REGRESSION {stage}: {old:.2f}s -> {new:.2f}s ({ratio:.2f}x)", err=True)
+        if not regressions:
+            click.echo(f"No regressions against '{baseline_path}'.")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,28 @@
+import click
+from home_messages_db import HomeMessagesDB
+from instrumentation import profile_options
+
+@click.command()
+@click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@click.option('--since', 'since_epoch', type=int, default=None,
+              help='Rebuild from this epoch (seconds) instead of resuming at the last built hour.')
+@profile_options
+def build_features(dburl, since_epoch):
+    """Build the hourly feature grid (meter deltas, weather, SmartThings event counts).
+
+    Usage:
+        build_features.py -d sqlite:///smarthome.db [--since EPOCH]
+    """
+    db = HomeMessagesDB(dburl)
+
+    try:
+        written = db.build_hourly_features(since_epoch=since_epoch)
+        click.echo(f"Wrote {written} hourly feature rows.")
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    build_features()
@@ -0,0 +1,162 @@
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from home_messages_db import CalendarHour
+
+LOCAL_TZ = 'Europe/Amsterdam'
+
+# Low tariff (T1, "dal") runs from 23:00 to 07:00 local time on working days and all day
+# on weekends and public holidays; the rest is normal tariff (T2).
+LOW_TARIFF_START = 23
+LOW_TARIFF_END = 7
+
+CALENDAR_COLUMNS = ['local_date', 'local_hour', 'weekday', 'iso_year', 'iso_week',
+                    'is_dst', 'is_holiday', 'tariff']
+
+
+def _easter_sunday(year):
+    """Return Easter Sunday for a year (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def dutch_holidays(year):
+    """Return the Dutch public holidays of a year as a set of dates."""
+    easter = _easter_sunday(year)
+    # King's Day moves to the 26th when the 27th is a Sunday
+    kings_day = date(year, 4, 27)
+    if kings_day.weekday() == 6:
+        kings_day = date(year, 4, 26)
+    holidays = {
+        date(year, 1, 1),                # New Year's Day
+        easter,                          # Easter Sunday
+        easter + timedelta(days=1),      # Easter Monday
+        kings_day,                       # King's Day
+        easter + timedelta(days=39),     # Ascension Day
+        easter + timedelta(days=49),     # Whit Sunday
+        easter + timedelta(days=50),     # Whit Monday
+        date(year, 12, 25),              # Christmas Day
+        date(year, 12, 26),              # Boxing Day
+    }
+    # Liberation Day is a national day off every fifth year
+    if year % 5 == 0:
+        holidays.add(date(year, 5, 5))
+    return holidays
+
+
+def calendar_frame(start_hour, end_hour):
+    """Compute the calendar rows for the epoch hours start_hour..end_hour (inclusive)."""
+    hours = np.arange(start_hour, end_hour + 1, dtype='int64')
+    utc = pd.to_datetime(hours * 3600, unit='s', utc=True)
+    local = utc.tz_convert(LOCAL_TZ)
+
+    # Offset from UTC is +2h in summer time and +1h in winter time
+    offset = (local.tz_localize(None) - utc.tz_localize(None)).total_seconds()
+    iso = local.isocalendar()
+    local_dates = local.date
+    holidays = set()
+    for year in range(local.year.min(), local.year.max() + 1):
+        holidays |= dutch_holidays(year)
+
+    df = pd.DataFrame({
+        'epoch_hour': hours,
+        'local_date': [d.isoformat() for d in local_dates],
+        'local_hour': local.hour,
+        'weekday': local.weekday,
+        'iso_year': iso['year'].to_numpy(),
+        'iso_week': iso['week'].to_numpy(),
+        'is_dst': np.asarray(offset) == 7200,
+        'is_holiday': [d in holidays for d in local_dates],
+    })
+    low = ((df['local_hour'] >= LOW_TARIFF_START) | (df['local_hour'] < LOW_TARIFF_END)
+           | (df['weekday'] >= 5) | df['is_holiday'])
+    df['tariff'] = np.where(low, 'T1', 'T2')
+    return df
+
+
+def build_calendar(db, start_epoch, end_epoch):
+    """Make sure the calendar covers [start_epoch, end_epoch]; returns the number of hours added.
+
+    Only the hours before the first and after the last stored hour are computed.
+    """
+    start_hour, end_hour = start_epoch // 3600, end_epoch // 3600
+    first, last = db.session.query(func.min(CalendarHour.epoch_hour),
+                                   func.max(CalendarHour.epoch_hour)).one()
+    if first is None:
+        missing = [(start_hour, end_hour)]
+    else:
+        missing = [(start_hour, first - 1), (last + 1, end_hour)]
+
+    added = 0
+    try:
+        for lo, hi in missing:
+            if lo > hi:
+                continue
+            df = calendar_frame(lo, hi)
+            db.session.bulk_insert_mappings(CalendarHour, df.to_dict('records'))
+            added += len(df)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return added
+
+
+class CalendarLookup:
+    """Calendar columns as numpy arrays, indexed by epoch hour minus the first hour.
+
+    Bucketing is then a plain array lookup, e.g. ``lookup.local_hour_of(epochs)``,
+    instead of a timezone conversion per row.
+    """
+
+    def __init__(self, df):
+        self.first_hour = int(df['epoch_hour'].iloc[0]) if len(df) else 0
+        self.last_hour = self.first_hour + len(df) - 1
+        self.columns = {col: df[col].to_numpy() for col in CALENDAR_COLUMNS}
+
+    def lookup(self, epochs, column):
+        """Return the calendar column for an array of epochs (seconds).
+
+        Raises ValueError for epochs outside the loaded hours (load_calendar for a wider range).
+        """
+        epochs = np.asarray(epochs, dtype='int64')
+        index = epochs // 3600 - self.first_hour
+        # A negative index would silently wrap around to the end of the calendar
+        if index.size and (index.min() < 0 or index.max() > self.last_hour - self.first_hour):
+            raise ValueError(f"Epochs {epochs.min()}..{epochs.max()} are outside the calendar, which covers "
+                             f"{self.first_hour * 3600}..{self.last_hour * 3600 + 3599}")
+        return self.columns[column][index]
+
+    def local_hour_of(self, epochs):
+        return self.lookup(epochs, 'local_hour')
+
+    def local_date_of(self, epochs):
+        return self.lookup(epochs, 'local_date')
+
+    def weekday_of(self, epochs):
+        return self.lookup(epochs, 'weekday')
+
+    def tariff_of(self, epochs):
+        return self.lookup(epochs, 'tariff')
+
+
+def load_calendar(db, start_epoch, end_epoch):
+    """Build the calendar for the range if needed and return it as a CalendarLookup."""
+    build_calendar(db, start_epoch, end_epoch)
+    fields = [getattr(CalendarHour, col) for col in CALENDAR_COLUMNS]
+    rows = db.session.query(CalendarHour.epoch_hour, *fields).filter(
+        CalendarHour.epoch_hour >= start_epoch // 3600,
+        CalendarHour.epoch_hour <= end_epoch // 3600,
+    ).order_by(CalendarHour.epoch_hour).all()
+    df = pd.DataFrame(rows, columns=['epoch_hour'] + CALENDAR_COLUMNS)
+    return CalendarLookup(df)
@@ -0,0 +1,36 @@
+import time
+import click
+from home_messages_db import HomeMessagesDB
+from instrumentation import profile_options
+
+@click.command()
+@click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@click.option('--older-than-days', type=int, default=90, show_default=True,
+              help='Retention horizon: compact messages older than this many days.')
+@click.option('--before', 'before_epoch', type=int, default=None,
+              help='Compact messages before this epoch (seconds) instead of --older-than-days.')
+@profile_options
+def compact(dburl, older_than_days, before_epoch):
+    """Fold historical SmartThings messages into runs of identical values (smartthings_runs).
+
+    Messages are kept as-is inside the retention horizon. Older ones become runs with a
+    first and last epoch and a message count; every value change starts a new run.
+
+    Usage:
+        compact.py -d sqlite:///smarthome.db [--older-than-days 90 | --before EPOCH]
+    """
+    if before_epoch is None:
+        before_epoch = int(time.time()) - older_than_days * 86400
+    db = HomeMessagesDB(dburl)
+
+    try:
+        removed, added = db.compact_smartthings(before_epoch)
+        click.echo(f"Compacted {removed} SmartThings messages into runs ({added:+d} run rows).")
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    compact()
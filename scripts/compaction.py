@@ -0,0 +1,155 @@
+"""Run-length compaction of historical SmartThings messages into smartthings_runs.
+
+Every message older than the horizon is folded into a run of consecutive messages with the
+same (device, capability, attribute, value) within one UTC hour; a value change always starts
+a new run, so the state history is kept exactly. Runs keep the first and last epoch and the
+message count, and never cross an hour, so message counts per hour (or day) stay exact.
+
+Messages that arrive later inside an existing run with the run's value are duplicates of
+compacted history and are skipped by the loaders. A late message with another value is kept
+(it becomes a run of its own on the next compaction, overlapping the longer run).
+"""
+import pandas as pd
+from sqlalchemy import text
+
+SERIES = ['device_id', 'capability', 'attribute']
+
+# Runs as message rows: the first message of every run and the last one of longer runs.
+# n_messages splits the run's message count over the two rows (the last one counts once), so
+# SUM(n_messages) per hour equals the message count before compaction; stored messages count 1.
+RUN_EVENTS_SQL = (
+    "SELECT device_id, start_epoch AS epoch, capability, attribute, value, unit,"
+    " CASE WHEN n_messages > 1 AND end_epoch > start_epoch THEN n_messages - 1 ELSE n_messages END"
+    " AS n_messages FROM smartthings_runs"
+    " UNION ALL SELECT device_id, end_epoch, capability, attribute, value, unit, 1 FROM smartthings_runs"
+    " WHERE n_messages > 1 AND end_epoch > start_epoch"
+)
+
+
+def _value_key(values):
+    # Values compare as text, with missing values as their own key
+    return values.astype(object).where(values.notna(), '\0').astype(str)
+
+
+def inside_runs(db, messages):
+    """Return a boolean Series: True for messages (device_id, epoch, capability, attribute, value)
+    inside a run with the same value. Messages with another value are never dropped."""
+    if messages.empty:
+        return pd.Series(False, index=messages.index)
+    runs = pd.DataFrame(db.session.execute(text(
+        "SELECT device_id, capability, attribute, value, start_epoch, end_epoch FROM smartthings_runs "
+        "WHERE end_epoch >= :lo AND start_epoch <= :hi"
+    ), {'lo': int(messages['epoch'].min()), 'hi': int(messages['epoch'].max())}).all(),
+        columns=SERIES + ['value', 'start_epoch', 'end_epoch'])
+    if runs.empty:
+        return pd.Series(False, index=messages.index)
+
+    left = messages[SERIES + ['epoch']].astype({'device_id': 'int64', 'epoch': 'int64'})
+    left['value'] = _value_key(messages['value'])
+    left = left.reset_index().sort_values('epoch')
+    runs = runs.astype({'device_id': 'int64', 'start_epoch': 'int64'}).sort_values('start_epoch')
+    runs['value'] = _value_key(runs['value'])
+    # The last run of the same series and value starting at or before each message (runs with
+    # the same value never overlap)
+    matched = pd.merge_asof(left, runs, left_on='epoch', right_on='start_epoch', by=SERIES + ['value'])
+    inside = (matched['epoch'] <= matched['end_epoch']).to_numpy()
+    return pd.Series(inside, index=matched['index']).reindex(messages.index)
+
+
+def _affected_runs(db, series_first):
+    """Load the runs that may merge with new messages: per series, from the last run starting
+    at or before its first message onwards."""
+    frames = []
+    for (device_id, capability, attribute), first in series_first.items():
+        rows = db.session.execute(text(
+            "SELECT run_id, device_id, capability, attribute, value, unit, start_epoch, end_epoch, n_messages "
+            "FROM smartthings_runs WHERE device_id = :device_id AND capability = :capability "
+            "AND attribute = :attribute AND start_epoch >= COALESCE(("
+            " SELECT MAX(start_epoch) FROM smartthings_runs WHERE device_id = :device_id"
+            " AND capability = :capability AND attribute = :attribute AND start_epoch <= :first), :first)"
+        ), {'device_id': int(device_id), 'capability': capability, 'attribute': attribute,
+            'first': int(first)}).all()
+        if rows:
+            frames.append(pd.DataFrame(rows, columns=['run_id'] + SERIES + [
+                'value', 'unit', 'start_epoch', 'end_epoch', 'n_messages']))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def fold_runs(items):
+    """Merge consecutive items (sorted per series by start_epoch) that have the same value and UTC hour."""
+    items = items.sort_values(SERIES + ['start_epoch'], kind='stable').reset_index(drop=True)
+    keys = items[SERIES + ['value']].fillna({'value': '\0'})
+    keys['hour'] = items['start_epoch'] // 3600
+    new_run = (keys != keys.shift()).any(axis=1)
+    items['run'] = new_run.cumsum()
+    return items.groupby('run', sort=False).agg(
+        device_id=('device_id', 'first'), capability=('capability', 'first'),
+        attribute=('attribute', 'first'), value=('value', 'first'), unit=('unit', 'first'),
+        start_epoch=('start_epoch', 'min'), end_epoch=('end_epoch', 'max'),
+        n_messages=('n_messages', 'sum'),
+    ).reset_index(drop=True)
+
+
+def compact_smartthings(db, before_epoch):
+    """Fold the messages older than before_epoch into runs; returns (messages_removed, runs_written).
+
+    Existing runs are extended where the value did not change. The caller commits.
+    """
+    from home_messages_db import FeatureBuildMark, MessageCount, SmartThingsRun, TableStat
+    profiler = db.profiler
+    with profiler.stage('compact_read') as stage:
+        messages = pd.DataFrame(db.session.execute(text(
+            "SELECT device_id, capability, attribute, epoch, value, unit FROM smartthings_messages "
+            "WHERE epoch < :before"
+        ), {'before': before_epoch}).all(), columns=SERIES + ['epoch', 'value', 'unit'])
+        stage.add_rows(len(messages))
+    if messages.empty:
+        return 0, 0
+
+    with profiler.stage('compact_fold') as stage:
+        # Messages already represented by a run were counted before; drop them from the counts
+        duplicate = inside_runs(db, messages)
+        duplicates = messages[duplicate]
+        messages = messages[~duplicate]
+        runs = _affected_runs(db, messages.groupby(SERIES)['epoch'].min())
+        items = messages.assign(start_epoch=messages['epoch'], end_epoch=messages['epoch'], n_messages=1)
+        items = items.drop(columns='epoch')
+        if len(runs):
+            items = pd.concat([runs.drop(columns='run_id'), items], ignore_index=True)
+        folded = fold_runs(items)
+        stage.add_rows(len(folded))
+
+    with profiler.stage('compact_write') as stage:
+        if len(runs):
+            db.session.execute(text("DELETE FROM smartthings_runs WHERE run_id IN (%s)"
+                                    % ', '.join(str(int(run_id)) for run_id in runs['run_id'])))
+        removed = db.session.execute(text("DELETE FROM smartthings_messages WHERE epoch < :before"),
+                                     {'before': before_epoch}).rowcount
+        db.session.bulk_insert_mappings(
+            SmartThingsRun, folded.astype(object).where(folded.notna(), None).to_dict('records'))
+        stage.add_rows(len(folded))
+
+    # Keep table_stats in step: fewer message rows, runs replaced, duplicates no longer counted
+    with profiler.stage('compact_table_stats'):
+        db.session.flush()
+        for table, sql in [('smartthings_messages', "SELECT COUNT(*), MIN(epoch), MAX(epoch) FROM smartthings_messages"),
+                           ('smartthings_runs', "SELECT COUNT(*), MIN(start_epoch), MAX(end_epoch) FROM smartthings_runs")]:
+            stat = db.session.get(TableStat, table)
+            if stat is None:
+                stat = TableStat(table_name=table, row_count=0)
+                db.session.add(stat)
+            stat.row_count, stat.min_epoch, stat.max_epoch = db.session.execute(text(sql)).one()
+            stat.version = stat.changed_version = (stat.version or 0) + 1
+        for (device_id, capability), n in duplicates.groupby(['device_id', 'capability']).size().items():
+            counter = db.session.get(MessageCount, (int(device_id), capability))
+            if counter is not None:
+                counter.message_count -= int(n)
+        # Tables created before AUTOINCREMENT reuse the ids of the deleted rows: keep the feature
+        # build mark at or below the highest id left, so later messages still count as new
+        mark = db.session.get(FeatureBuildMark, 'smartthings_messages')
+        if mark is not None:
+            highest = db.session.execute(text("SELECT COALESCE(MAX(message_id), 0) FROM smartthings_messages")).scalar()
+            mark.max_row_id = min(mark.max_row_id, highest)
+    return removed, len(folded) - len(runs)
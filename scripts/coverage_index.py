@@ -0,0 +1,123 @@
+"""Coverage index: merged epoch intervals where each data source has readings.
+
+The SQL only uses named parameters, so the same functions run on a SQLAlchemy session
+(HomeMessagesDB) and on a raw sqlite3 connection (db_manager.py); `execute(sql, params)`
+must return an iterable of rows for SELECT statements.
+"""
+from collections import defaultdict
+
+# Readings further apart than this (seconds) leave a gap between two intervals.
+# Meters read every 15 minutes / hourly and weather is hourly; SmartThings devices are
+# bursty, so only quiet periods of several hours count as missing data.
+MERGE_TOLERANCE = {
+    'electricity_usage': 1200,
+    'gas_usage': 5400,
+    'weather': 5400,
+    'smartthings_messages': 6 * 3600,
+}
+
+# device_id of the whole-source intervals (SmartThings also gets per-device intervals)
+ALL_DEVICES = 0
+
+_OVERLAPPING = ("source = :source AND device_id = :device_id "
+                "AND end_epoch >= :lo AND start_epoch <= :hi")
+
+
+def epoch_runs(epochs, tolerance):
+    """Merge epochs into [start, end] runs, splitting where consecutive epochs differ by more than tolerance."""
+    runs = []
+    for epoch in sorted(set(int(e) for e in epochs)):
+        if runs and epoch - runs[-1][1] <= tolerance:
+            runs[-1][1] = epoch
+        else:
+            runs.append([epoch, epoch])
+    return runs
+
+
+def merge_runs(runs, tolerance):
+    """Merge sorted [start, end] runs that overlap or are at most tolerance apart."""
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] <= tolerance:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def update_coverage(execute, source, epochs, device_id=ALL_DEVICES, intervals=()):
+    """Merge the epochs of newly inserted rows (and covered [start, end] intervals) into the
+    stored intervals; the caller commits."""
+    tolerance = MERGE_TOLERANCE[source]
+    runs = merge_runs(sorted(epoch_runs(epochs, tolerance) + [list(i) for i in intervals]), tolerance)
+    if not runs:
+        return
+    params = {'source': source, 'device_id': device_id,
+              'lo': runs[0][0] - tolerance, 'hi': runs[-1][1] + tolerance}
+    existing = [[start, end] for start, end in execute(
+        f"SELECT start_epoch, end_epoch FROM coverage_intervals WHERE {_OVERLAPPING}", params)]
+    merged = merge_runs(sorted(existing + runs), tolerance)
+    if merged == sorted(existing):
+        return
+    execute(f"DELETE FROM coverage_intervals WHERE {_OVERLAPPING}", params)
+    for start, end in merged:
+        execute("INSERT INTO coverage_intervals (source, device_id, start_epoch, end_epoch) "
+                "VALUES (:source, :device_id, :start, :end)",
+                {'source': source, 'device_id': device_id, 'start': start, 'end': end})
+
+
+def record_coverage(execute, source, epochs, device_ids=None):
+    """Update the whole-source intervals and, with device_ids (one per epoch), the per-device ones."""
+    if source not in MERGE_TOLERANCE:
+        return
+    update_coverage(execute, source, epochs)
+    if device_ids is not None:
+        per_device = defaultdict(list)
+        for device_id, epoch in zip(device_ids, epochs):
+            per_device[int(device_id)].append(epoch)
+        for device_id, device_epochs in per_device.items():
+            update_coverage(execute, source, device_epochs, device_id)
+
+
+def rebuild_coverage(execute, source):
+    """Recompute the intervals of a source from its table (for databases filled before the index)."""
+    execute("DELETE FROM coverage_intervals WHERE source = :source", {'source': source})
+    if source == 'smartthings_messages':
+        rows = list(execute("SELECT device_id, epoch FROM smartthings_messages", {}))
+        record_coverage(execute, source, [epoch for _, epoch in rows], [device_id for device_id, _ in rows])
+        # Compacted runs count as covered from their first to their last message
+        runs = list(execute("SELECT device_id, start_epoch, end_epoch FROM smartthings_runs", {}))
+        update_coverage(execute, source, [], intervals=[(start, end) for _, start, end in runs])
+        per_device = defaultdict(list)
+        for device_id, start, end in runs:
+            per_device[device_id].append((start, end))
+        for device_id, device_runs in per_device.items():
+            update_coverage(execute, source, [], device_id, device_runs)
+    else:
+        record_coverage(execute, source, [epoch for epoch, in execute(f"SELECT epoch FROM {source}", {})])
+
+
+def load_coverage(execute, source, start_epoch=None, end_epoch=None, device_id=ALL_DEVICES):
+    """Return the stored (start, end) intervals of a source overlapping [start_epoch, end_epoch]."""
+    params = {'source': source, 'device_id': device_id,
+              'lo': -2**62 if start_epoch is None else start_epoch,
+              'hi': 2**62 if end_epoch is None else end_epoch}
+    return [(start, end) for start, end in execute(
+        f"SELECT start_epoch, end_epoch FROM coverage_intervals WHERE {_OVERLAPPING} "
+        "ORDER BY start_epoch", params)]
+
+
+def find_gaps(intervals, start_epoch=None, end_epoch=None, min_gap=0):
+    """Return the (last_epoch_before, first_epoch_after) gaps between sorted intervals longer than min_gap.
+
+    With start_epoch/end_epoch, missing data at the edges of the range is reported as well.
+    """
+    gaps = []
+    previous_end = start_epoch
+    for start, end in intervals:
+        if previous_end is not None and start - previous_end > min_gap:
+            gaps.append((previous_end, start))
+        previous_end = end if previous_end is None else max(previous_end, end)
+    if end_epoch is not None and previous_end is not None and end_epoch - previous_end > min_gap:
+        gaps.append((previous_end, end_epoch))
+    return gaps
@@ -1,13 +1,22 @@
 # create_db.py
+import click
 from home_messages_db import HomeMessagesDB
 
 
-def create_database():
-    db = HomeMessagesDB('sqlite:///smarthome.db')
-    print("Wow...Database created successfully:---> smarthome.db")
+def create_database(dburl='sqlite:///smarthome.db'):
+    db = HomeMessagesDB(dburl)
+    click.echo(f"Wow...Database created successfully:---> {dburl}")
     db.close()
 
 
+@click.command()
+@click.option('-d', '--dburl', default='sqlite:///smarthome.db', show_default=True,
+              help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+def create_db(dburl):
+    """Create the database with all tables (tables that already exist are kept)."""
+    click.echo("Creating database...")
+    create_database(dburl)
+
+
 if __name__ == "__main__":
-    print("Creating database...")
-    create_database()
+    create_db()
@@ -1,155 +1,467 @@
 import click
 import sqlite3
-import gzip
 import os
-import pandas as pd
+import time
+from datetime import datetime, timezone
+from coverage_index import (ALL_DEVICES, find_gaps, load_coverage, MERGE_TOLERANCE, rebuild_coverage,
+                            record_coverage)
+from instrumentation import connect_sqlite, get_profiler, profile_options
+from schema_version import schema_is_current, STATS_TABLES
 
 # Assume a database connection helper
 def get_db_connection(db_path='smarthome.db'):
-    return sqlite3.connect(db_path)
-
-# Create tables if they don't exist
-def initialize_tables(conn):
-    cursor = conn.cursor()
-    # Create tables based on your existing structure (adjust column names as needed)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS electricity_usage (
-            epoch INTEGER PRIMARY KEY,
-            t1_kwh REAL,
-            t2_kwh REAL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gas_usage (
-            epoch INTEGER PRIMARY KEY,
-            gas_m3 REAL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather (
-            epoch INTEGER PRIMARY KEY,
-            temperature REAL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS smartthings_messages (
-            epoch INTEGER,
-            device_id TEXT,
-            capability TEXT,
-            value TEXT,
-            PRIMARY KEY (epoch, device_id, capability)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_id TEXT PRIMARY KEY,
-            name TEXT
-        )
-    ''')
-    conn.commit()
+    return connect_sqlite(db_path)
+
+# Create tables if they don't exist, using the same schema as the HomeMessagesDB models
+def initialize_tables(db_path):
+    # Most commands only read; SQLAlchemy and the models are loaded only to create or upgrade the schema
+    conn = sqlite3.connect(db_path)
+    try:
+        if schema_is_current(conn.execute):
+            return
+    finally:
+        conn.close()
+
+    from sqlalchemy import create_engine, inspect
+    from home_messages_db import Base, add_missing_columns
+    from schema_version import record_schema_version
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        inspector = inspect(engine)
+        if inspector.has_table('smartthings_messages') and 'attribute' not in {
+                col['name'] for col in inspector.get_columns('smartthings_messages')}:
+            raise click.ClickException(
+                f"{db_path} uses the old db_manager schema (no smartthings attribute/unit). "
+                "Recreate it with create_db.py and reload the data.")
+        Base.metadata.create_all(engine)
+        add_missing_columns(engine)
+        with engine.begin() as conn:
+            record_schema_version(conn.exec_driver_sql)
+    finally:
+        engine.dispose()
+
+# Canonical insert layout per table: required columns, optional columns, conflict key and types
+TABLE_SPECS = {
+    'electricity_usage': {
+        'required': ['epoch', 't1_kwh', 't2_kwh'], 'optional': [], 'key': ['epoch'],
+        'types': {'epoch': int, 't1_kwh': float, 't2_kwh': float},
+    },
+    'gas_usage': {
+        'required': ['epoch', 'gas_m3'], 'optional': [], 'key': ['epoch'],
+        'types': {'epoch': int, 'gas_m3': float},
+    },
+    'weather': {
+        'required': ['epoch', 'temperature'],
+        'optional': ['humidity', 'precipitation', 'wind_speed', 'pressure'], 'key': ['epoch'],
+        'types': {'epoch': int, 'temperature': float, 'humidity': float, 'precipitation': float,
+                  'wind_speed': float, 'pressure': float},
+    },
+    'smartthings_messages': {
+        'required': ['device_id', 'epoch', 'capability', 'attribute', 'value'], 'optional': ['unit'],
+        'key': ['device_id', 'epoch', 'capability', 'attribute'],
+        'types': {'device_id': int, 'epoch': int, 'capability': str, 'attribute': str,
+                  'value': str, 'unit': str},
+    },
+    'devices': {
+        'required': ['device_id', 'name'], 'optional': ['loc', 'level'], 'key': ['device_id'],
+        'types': {'device_id': int, 'name': str, 'loc': str, 'level': str},
+    },
+}
+
+def detect_table(columns):
+    """Return the table whose required columns are all present in the file header."""
+    for table, spec in TABLE_SPECS.items():
+        if set(spec['required']).issubset(columns):
+            return table
+    return None
+
+def insert_sql(table, columns, on_conflict):
+    """Build the INSERT statement: skip existing keys, or update them in place (upsert)."""
+    spec = TABLE_SPECS[table]
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT"
+    updates = [col for col in columns if col not in spec['key']]
+    if on_conflict == 'upsert' and updates:
+        assignments = ', '.join(f"{col} = excluded.{col}" for col in updates)
+        return f"{sql} ({', '.join(spec['key'])}) DO UPDATE SET {assignments}"
+    return f"{sql} DO NOTHING"
+
+def typed_rows(chunk, columns, types):
+    """Convert a chunk to a list of tuples of plain Python values (None for missing)."""
+    values = []
+    for col in columns:
+        series = chunk[col]
+        if types[col] is int and series.notna().all():
+            values.append(series.astype('int64').tolist())
+        elif types[col] is int:
+            # Missing values make pandas read the column as float; NOT NULL columns then reject the row
+            values.append(series.astype('Int64').astype(object).where(series.notna(), None).tolist())
+        elif types[col] is float:
+            series = series.astype('float64')
+            values.append(series.astype(object).where(series.notna(), None).tolist())
+        else:
+            # Text columns are read as str, so only missing values need converting
+            values.append(series.astype(object).where(series.notna(), None).tolist())
+    return list(zip(*values))
+
+def record_ingest(conn, table, rowid_before, updated=False):
+    """Fold the rows inserted after rowid_before into table_stats and the coverage index,
+    in the caller's transaction.
+
+    SQLite gives new rows ids above the current maximum, so new rows are exactly those above
+    rowid_before; rows updated in place by an upsert keep their id and are not counted.
+    Devices are inserted with explicit ids and are recounted instead (the table is tiny).
+    Every call bumps the table's version; updated marks it as an in-place change as well.
+    Call it only for chunks that wrote rows.
+    """
+    now = int(time.time())
+    versions = ("version = table_stats.version + 1, changed_version = "
+                "CASE WHEN excluded.changed_version > 0 THEN table_stats.version + 1 ELSE table_stats.changed_version END")
+    if table == 'devices':
+        conn.execute(
+            "INSERT INTO table_stats (table_name, row_count, last_ingest_epoch, version, changed_version) "
+            "SELECT 'devices', COUNT(*), ?, 1, ? FROM devices WHERE true "
+            "ON CONFLICT(table_name) DO UPDATE SET row_count = excluded.row_count, "
+            f"last_ingest_epoch = excluded.last_ingest_epoch, {versions}", (now, int(updated)))
+        return
+    conn.execute(
+        f"INSERT INTO table_stats (table_name, row_count, min_epoch, max_epoch, last_ingest_epoch, version, changed_version) "
+        f"SELECT ?, COUNT(*), MIN(epoch), MAX(epoch), ?, 1, ? FROM {table} WHERE rowid > ? "
+        "ON CONFLICT(table_name) DO UPDATE SET "
+        "row_count = table_stats.row_count + excluded.row_count, "
+        "min_epoch = COALESCE(MIN(table_stats.min_epoch, excluded.min_epoch), table_stats.min_epoch, excluded.min_epoch), "
+        "max_epoch = COALESCE(MAX(table_stats.max_epoch, excluded.max_epoch), table_stats.max_epoch, excluded.max_epoch), "
+        f"last_ingest_epoch = excluded.last_ingest_epoch, {versions}", (table, now, int(updated), rowid_before))
+    if table == 'smartthings_messages':
+        conn.execute(
+            "INSERT INTO smartthings_message_counts (device_id, capability, message_count) "
+            "SELECT device_id, capability, COUNT(*) FROM smartthings_messages WHERE rowid > ? "
+            "GROUP BY device_id, capability "
+            "ON CONFLICT(device_id, capability) DO UPDATE SET "
+            "message_count = smartthings_message_counts.message_count + excluded.message_count",
+            (rowid_before,))
+        rows = conn.execute('SELECT epoch, device_id FROM smartthings_messages WHERE rowid > ?',
+                            (rowid_before,)).fetchall()
+        record_coverage(conn.execute, table, [epoch for epoch, _ in rows], [device_id for _, device_id in rows])
+    else:
+        epochs = [epoch for epoch, in conn.execute(f'SELECT epoch FROM {table} WHERE rowid > ?', (rowid_before,))]
+        record_coverage(conn.execute, table, epochs)
+
+def renamed_devices(conn, rows, columns):
+    """Return (device_id, name, existing device_id) for device rows whose name belongs to another device.
+
+    Upserts match devices on device_id and names are unique, so these rows cannot be written.
+    """
+    id_index, name_index = columns.index('device_id'), columns.index('name')
+    existing = dict(conn.execute('SELECT name, device_id FROM devices'))
+    return [(row[id_index], row[name_index], existing[row[name_index]]) for row in rows
+            if row[name_index] in existing and existing[row[name_index]] != row[id_index]]
+
+def drop_compacted(conn, rowid_before):
+    """Delete the new SmartThings rows that fall inside a compacted run with the same value; returns how many."""
+    return conn.execute(
+        "DELETE FROM smartthings_messages WHERE rowid > ? AND EXISTS ("
+        " SELECT 1 FROM smartthings_runs r WHERE r.device_id = smartthings_messages.device_id"
+        " AND r.capability = smartthings_messages.capability AND r.attribute = smartthings_messages.attribute"
+        " AND r.value IS smartthings_messages.value"
+        " AND smartthings_messages.epoch BETWEEN r.start_epoch AND r.end_epoch)", (rowid_before,)).rowcount
+
+def actual_stats(conn):
+    """Recompute the catalog with full scans: ({table: (rows, min, max)}, {(device, capability): n})."""
+    tables = {}
+    for table in STATS_TABLES:
+        if table == 'devices':
+            tables[table] = (conn.execute('SELECT COUNT(*) FROM devices').fetchone()[0], None, None)
+        elif table == 'smartthings_runs':
+            tables[table] = tuple(conn.execute(
+                'SELECT COUNT(*), MIN(start_epoch), MAX(end_epoch) FROM smartthings_runs').fetchone())
+        else:
+            tables[table] = tuple(conn.execute(f'SELECT COUNT(*), MIN(epoch), MAX(epoch) FROM {table}').fetchone())
+    # Compacted messages still count
+    messages = {(device_id, capability): n for device_id, capability, n in conn.execute(
+        'SELECT device_id, capability, SUM(n) FROM ('
+        ' SELECT device_id, capability, 1 AS n FROM smartthings_messages'
+        ' UNION ALL SELECT device_id, capability, n_messages FROM smartthings_runs'
+        ') GROUP BY device_id, capability')}
+    return tables, messages
+
+def format_epoch(epoch):
+    if epoch is None:
+        return '-'
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
 
 # Command group for the tool
 @click.group()
-def cli():
+@click.option('--db', 'db_path', default='smarthome.db', show_default=True, help='Path of the SQLite database.')
+@profile_options
+@click.pass_context
+def cli(ctx, db_path):
     """Smart Home Database Manager
 
     A tool to manage the smart home database, supporting data insertion, querying,
     and database details for the Nordwijk project.
     """
-    conn = get_db_connection()
-    initialize_tables(conn)
-    conn.close()
+    ctx.obj = {'db_path': db_path}
+    initialize_tables(db_path)
 
 # Command to insert data
 @cli.command()
 @click.argument('file_path', type=click.Path(exists=True))
-@click.option('--compressed', is_flag=True, help='Handle the input file as a compressed .gz file.')
-def insert(file_path, compressed):
+@click.option('--compressed', is_flag=True, help='Kept for compatibility; .gz files are detected by extension.')
+@click.option('--on-conflict', type=click.Choice(['ignore', 'upsert']), default='ignore', show_default=True,
+              help='ignore: keep existing rows; upsert: update existing rows in place.')
+@click.option('--chunksize', type=int, default=50000, show_default=True, help='Rows per read/insert batch.')
+@click.pass_obj
+def insert(obj, file_path, compressed, on_conflict, chunksize):
     """Insert data into the smart home database from a file.
 
     FILE_PATH: Path to the data file (CSV or compressed .gz file). The file should
     have columns matching one of the tables (e.g., epoch, t1_kwh, t2_kwh for
-    electricity_usage).
+    electricity_usage). Large files are streamed in chunks.
     """
+    if not file_path.endswith(('.csv', '.gz')):
+        raise click.BadParameter('File must be a .csv or .gz file.')
+
+    import pandas as pd
+    from timeseries_store import refresh_store
+    from usage_aggregates import METERS
+
+    conn = get_db_connection(obj['db_path'])
+    rows_committed = 0
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        profiler = get_profiler()
+        started = time.perf_counter()
 
-        # Handle compressed files if specified
-        if compressed and file_path.endswith('.gz'):
-            with gzip.open(file_path, 'rt') as f:
-                df = pd.read_csv(f)
-        elif file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            raise click.BadParameter('File must be a .csv or .gz file.')
-
-        # Determine table based on columns (simplified logic)
-        if {'epoch', 't1_kwh', 't2_kwh'}.issubset(df.columns):
-            table = 'electricity_usage'
-            cursor.executemany(
-                f'INSERT OR REPLACE INTO {table} (epoch, t1_kwh, t2_kwh) VALUES (?, ?, ?)',
-                df[['epoch', 't1_kwh', 't2_kwh']].values
-            )
-        elif {'epoch', 'gas_m3'}.issubset(df.columns):
-            table = 'gas_usage'
-            cursor.executemany(
-                f'INSERT OR REPLACE INTO {table} (epoch, gas_m3) VALUES (?, ?)',
-                df[['epoch', 'gas_m3']].values
-            )
-        elif {'epoch', 'temperature'}.issubset(df.columns):
-            table = 'weather'
-            cursor.executemany(
-                f'INSERT OR REPLACE INTO {table} (epoch, temperature) VALUES (?, ?)',
-                df[['epoch', 'temperature']].values
-            )
-        elif {'epoch', 'device_id', 'capability', 'value'}.issubset(df.columns):
-            table = 'smartthings_messages'
-            cursor.executemany(
-                f'INSERT OR REPLACE INTO {table} (epoch, device_id, capability, value) VALUES (?, ?, ?, ?)',
-                df[['epoch', 'device_id', 'capability', 'value']].values
-            )
-        elif {'device_id', 'name'}.issubset(df.columns):
-            table = 'devices'
-            cursor.executemany(
-                f'INSERT OR REPLACE INTO {table} (device_id, name) VALUES (?, ?)',
-                df[['device_id', 'name']].values
-            )
-        else:
+        # Determine table based on the header
+        header = pd.read_csv(file_path, nrows=0).columns
+        table = detect_table(header)
+        if table is None:
             raise click.BadParameter('File columns do not match any known table structure.')
+        spec = TABLE_SPECS[table]
+        columns = spec['required'] + [col for col in spec['optional'] if col in header]
+        sql = insert_sql(table, columns, on_conflict)
 
-        conn.commit()
-        click.echo(f"Data inserted successfully into {table} from {file_path}")
+        rows_read = rows_written = 0
+        text_columns = {col: str for col in columns if spec['types'][col] is str}
+        reader = pd.read_csv(file_path, usecols=columns, dtype=text_columns, chunksize=chunksize)
+        while True:
+            with profiler.stage('read_csv') as stage:
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                stage.add_rows(len(chunk))
+            with profiler.stage('convert') as stage:
+                rows = typed_rows(chunk, columns, spec['types'])
+                stage.add_rows(len(rows))
+            if table == 'devices' and on_conflict == 'upsert':
+                conflicts = renamed_devices(conn, rows, columns)
+                if conflicts:
+                    raise click.ClickException(
+                        "Cannot upsert devices whose name belongs to another device_id "
+                        "(device_id, name, existing device_id): "
+                        + ', '.join(map(str, conflicts[:10])) + f" ({rows_committed} rows committed before)")
+            with profiler.stage('executemany') as stage:
+                changes = conn.total_changes
+                rowid_before = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+                conn.executemany(sql, rows)
+                chunk_written = conn.total_changes - changes
+                if table == 'smartthings_messages':
+                    chunk_written -= drop_compacted(conn, rowid_before)
+                rows_written += chunk_written
+                stage.add_rows(len(rows))
+            # A chunk that wrote nothing (all rows existed) leaves the catalog and its versions alone
+            if chunk_written:
+                with profiler.stage('table_stats'):
+                    record_ingest(conn, table, rowid_before, updated=on_conflict == 'upsert')
+            with profiler.stage('commit'):
+                conn.commit()
+            rows_read += len(rows)
+            rows_committed = rows_read
+
+        # Bring an existing time-series store up to date; upserts are recorded as in-place
+        # changes in table_stats, so the store is rewritten after them
+        for source, (meter_table, _) in METERS.items():
+            if meter_table == table and rows_written:
+                with profiler.stage('timeseries_refresh'):
+                    refresh_store(conn.execute, obj['db_path'], source, create=False)
+
+        seconds = time.perf_counter() - started
+        verb = 'inserted or updated' if on_conflict == 'upsert' else 'inserted'
+        click.echo(f"Data {verb} into {table} from {file_path}")
+        click.echo(f"  rows read: {rows_read}, {verb}: {rows_written}"
+                   + ('' if on_conflict == 'upsert' else f", skipped (existing): {rows_read - rows_written}"))
+        click.echo(f"  {seconds:.2f}s, {rows_read / seconds if seconds else 0:.0f} rows/s, "
+                   f"{os.path.getsize(file_path) / 2**20 / seconds if seconds else 0:.1f} MB/s (on disk)")
+    # Every chunk is committed on its own, so a failure keeps the chunks before it; rerunning
+    # the file skips the rows that are already there
     except sqlite3.Error as e:
-        click.echo(f"Database error: {e}", err=True)
+        conn.rollback()
+        raise click.ClickException(f"Database error: {e} ({rows_committed} rows of {file_path} committed before)")
+    except click.ClickException:
+        conn.rollback()
+        raise
     except Exception as e:
-        click.echo(f"Error: {e}", err=True)
+        conn.rollback()
+        raise click.ClickException(f"{type(e).__name__}: {e} ({rows_committed} rows of {file_path} committed before)")
     finally:
         conn.close()
 
 # Command to count entries
 @cli.command()
-def count():
+@click.pass_obj
+def count(obj):
     """Display the number of entries currently in the database for each table."""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(obj['db_path'])
         cursor = conn.cursor()
         tables = ['electricity_usage', 'gas_usage', 'weather', 'smartthings_messages', 'devices']
         for table in tables:
-            cursor.execute(f'SELECT COUNT(*) FROM {table}')
-            count = cursor.fetchone()[0]
+            with get_profiler().stage(f'count_{table}') as stage:
+                cursor.execute(f'SELECT COUNT(*) FROM {table}')
+                count = cursor.fetchone()[0]
+                stage.add_rows(count)
             click.echo(f"Number of entries in {table}: {count}")
     except sqlite3.Error as e:
         click.echo(f"Database error: {e}", err=True)
     finally:
         conn.close()
 
+# Command to show the table statistics catalog
+@cli.command()
+@click.option('--verify', is_flag=True, help='Recompute the statistics with full scans and report drift.')
+@click.option('--repair', is_flag=True, help='Rewrite the catalog and the coverage index from the data tables '
+                                             '(e.g. for databases filled before they existed, or after writes '
+                                             'outside the loaders) and rebuild the time-series stores.')
+@click.pass_obj
+def stats(obj, verify, repair):
+    """Display row counts, time coverage and message counts from the table_stats catalog.
+
+    The catalog is maintained by every loader, so this does not scan the data tables
+    (unlike count) unless --verify or --repair is given.
+    """
+    conn = get_db_connection(obj['db_path'])
+    try:
+        profiler = get_profiler()
+        with profiler.stage('read_catalog'):
+            catalog = {row[0]: row[1:] for row in conn.execute(
+                'SELECT table_name, row_count, min_epoch, max_epoch, last_ingest_epoch FROM table_stats')}
+            messages = {(device_id, capability): n for device_id, capability, n in conn.execute(
+                'SELECT device_id, capability, message_count FROM smartthings_message_counts')}
+            names = dict(conn.execute('SELECT device_id, name FROM devices'))
+
+        click.echo(f"{'table':<22}{'rows':>12}  {'first (UTC)':<17} {'last (UTC)':<17} {'last ingest (UTC)':<17}")
+        for table in STATS_TABLES:
+            rows, first, last, ingested = catalog.get(table, (0, None, None, None))
+            click.echo(f"{table:<22}{rows:>12}  {format_epoch(first):<17} {format_epoch(last):<17} "
+                       f"{format_epoch(ingested):<17}")
+        if messages:
+            click.echo("SmartThings messages per device and capability:")
+            for (device_id, capability), n in sorted(messages.items()):
+                click.echo(f"  ---> {names.get(device_id, device_id)} / {capability}: {n}")
+
+        if not (verify or repair):
+            return
+        with profiler.stage('recompute') as stage:
+            actual_tables, actual_messages = actual_stats(conn)
+            stage.add_rows(sum(rows for rows, _, _ in actual_tables.values()))
+
+        drift = 0
+        for table, (rows, first, last) in actual_tables.items():
+            stored = tuple(catalog.get(table, (0, None, None, None))[:3])
+            if stored != (rows, first, last):
+                drift += 1
+                click.echo(f"DRIFT {table}: catalog {stored}, actual {(rows, first, last)}", err=True)
+        for key in sorted(set(messages) | set(actual_messages)):
+            if messages.get(key, 0) != actual_messages.get(key, 0):
+                drift += 1
+                click.echo(f"DRIFT messages {key}: catalog {messages.get(key, 0)}, "
+                           f"actual {actual_messages.get(key, 0)}", err=True)
+        if not drift:
+            click.echo("Catalog matches the data tables.")
+
+        if repair and drift:
+            with profiler.stage('repair_catalog'):
+                for table, (rows, first, last) in actual_tables.items():
+                    conn.execute(
+                        "INSERT INTO table_stats (table_name, row_count, min_epoch, max_epoch, version, changed_version) "
+                        "VALUES (?, ?, ?, ?, 1, 1) ON CONFLICT(table_name) DO UPDATE SET row_count = excluded.row_count, "
+                        "min_epoch = excluded.min_epoch, max_epoch = excluded.max_epoch, "
+                        "version = table_stats.version + 1",
+                        (table, rows, first, last))
+                conn.execute('DELETE FROM smartthings_message_counts')
+                conn.executemany(
+                    'INSERT INTO smartthings_message_counts (device_id, capability, message_count) VALUES (?, ?, ?)',
+                    [(device_id, capability, n) for (device_id, capability), n in actual_messages.items()])
+                conn.commit()
+            click.echo(f"Repaired {drift} catalog entr{'y' if drift == 1 else 'ies'}.")
+        if repair:
+            from timeseries_store import refresh_store
+            from usage_aggregates import METERS
+            with profiler.stage('rebuild_coverage'):
+                for source in MERGE_TOLERANCE:
+                    rebuild_coverage(conn.execute, source)
+                conn.commit()
+            click.echo("Rebuilt the coverage index.")
+            # Writes outside the loaders may have changed rows in place: mark every table as
+            # changed, so cached reports and time-series stores are rebuilt, and rebuild the stores
+            with profiler.stage('rebuild_timeseries'):
+                conn.execute("UPDATE table_stats SET version = version + 1, changed_version = version + 1")
+                conn.commit()
+                rebuilt = [source for source in METERS
+                           if refresh_store(conn.execute, obj['db_path'], source, create=False) is not None]
+            if rebuilt:
+                click.echo(f"Rebuilt the time-series stores: {', '.join(rebuilt)}.")
+    except sqlite3.Error as e:
+        conn.rollback()
+        click.echo(f"Database error: {e}", err=True)
+    finally:
+        conn.close()
+
+# Command to list gaps in the coverage index
+@cli.command()
+@click.argument('source', type=click.Choice(list(MERGE_TOLERANCE)))
+@click.option('--threshold-ms', type=int, default=None,
+              help='Only list gaps longer than this (default: the merge tolerance of the source).')
+@click.option('--start', 'start_date', type=click.DateTime(['%Y-%m-%d']), default=None, help='First day (UTC).')
+@click.option('--end', 'end_date', type=click.DateTime(['%Y-%m-%d']), default=None, help='Last day (UTC).')
+@click.option('--device', 'device_id', type=int, default=None, help='One SmartThings device_id.')
+@click.pass_obj
+def gaps(obj, source, threshold_ms, start_date, end_date, device_id):
+    """List the periods where SOURCE has no data, from the coverage index.
+
+    Gaps shorter than the merge tolerance of a source (1200 s electricity, 5400 s gas and
+    weather, 6 h SmartThings) are not indexed, so smaller thresholds are raised to it.
+    With --start/--end, missing data at the edges of the range is listed as well.
+    """
+    tolerance = MERGE_TOLERANCE[source]
+    min_gap = tolerance if threshold_ms is None else max(threshold_ms / 1000, tolerance)
+    start_epoch = None if start_date is None else int(start_date.replace(tzinfo=timezone.utc).timestamp())
+    end_epoch = None if end_date is None else int(end_date.replace(tzinfo=timezone.utc).timestamp()) + 86399
+
+    conn = get_db_connection(obj['db_path'])
+    try:
+        with get_profiler().stage('coverage') as stage:
+            intervals = load_coverage(conn.execute, source, start_epoch, end_epoch,
+                                      ALL_DEVICES if device_id is None else device_id)
+            stage.add_rows(len(intervals))
+        found = find_gaps(intervals, start_epoch, end_epoch, min_gap)
+        for gap_start, gap_end in found:
+            click.echo(f"  ---> {format_epoch(gap_start)} .. {format_epoch(gap_end)} "
+                       f"({(gap_end - gap_start) / 3600:.1f} h)")
+        click.echo(f"{len(found)} gap(s) longer than {min_gap:.0f} s in {source} "
+                   f"({len(intervals)} covered interval(s)).")
+    except sqlite3.Error as e:
+        click.echo(f"Database error: {e}", err=True)
+    finally:
+        conn.close()
+
 # Command to list tables
 @cli.command()
-def list_tables():
+@click.pass_obj
+def list_tables(obj):
     """List all tables in the database."""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(obj['db_path'])
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = [row[0] for row in cursor.fetchall()]
@@ -164,13 +476,14 @@ def list_tables():
 # Command to show table schema
 @cli.command()
 @click.argument('table_name', type=str)
-def schema(table_name):
+@click.pass_obj
+def schema(obj, table_name):
     """Display the schema (column names and types) of a specified table.
 
     TABLE_NAME: Name of the table to inspect (e.g., electricity_usage).
     """
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(obj['db_path'])
         cursor = conn.cursor()
         cursor.execute(f"PRAGMA table_info({table_name})")
         columns = cursor.fetchall()
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, text
+from home_messages_db import (ElectricityUsage, GasUsage, Weather, SmartThingsMessage, HourlyFeature,
+                              HourlyCapabilityCount, FeatureBuildMark)
+from compaction import RUN_EVENTS_SQL
+
+# Columns of the hourly grid, in matrix order (event counts are appended per capability)
+METER_COLUMNS = ['t1_kwh', 't2_kwh', 'gas_m3']
+WEATHER_COLUMNS = ['temperature', 'humidity', 'precipitation', 'wind_speed', 'pressure']
+FEATURE_COLUMNS = METER_COLUMNS + WEATHER_COLUMNS
+
+# Source tables and their row ids: rows above the id stored at the last build were loaded since.
+# Compacted runs are not tracked, compaction keeps the event counts of the hours it folds.
+BUILD_SOURCES = {
+    'electricity_usage': (ElectricityUsage, ElectricityUsage.reading_id),
+    'gas_usage': (GasUsage, GasUsage.reading_id),
+    'weather': (Weather, Weather.weather_id),
+    'smartthings_messages': (SmartThingsMessage, SmartThingsMessage.message_id),
+}
+
+
+def _meter_deltas(db, model, columns, start_hour):
+    """Return per-hour usage deltas of a cumulative meter from start_hour onwards.
+
+    The delta of an hour is the last reading in that hour minus the last reading of the
+    previous hour that has data (the same as diff() on the raw series). Negative deltas
+    are meter resets and become NaN.
+    """
+    fields = [getattr(model, col) for col in columns]
+    rows = db.session.query(model.epoch, *fields).filter(
+        model.epoch >= start_hour * 3600).order_by(model.epoch).all()
+    if not rows:
+        return pd.DataFrame(columns=columns, dtype='float64')
+
+    # Anchor the first hour on the last reading before the build window
+    anchor = db.session.query(model.epoch, *fields).filter(
+        model.epoch < start_hour * 3600).order_by(model.epoch.desc()).first()
+
+    df = pd.DataFrame(rows, columns=['epoch'] + columns)
+    df['hour'] = df['epoch'] // 3600
+    hourly = df.groupby('hour')[columns].last()
+    if anchor is not None:
+        hourly.loc[anchor.epoch // 3600] = [getattr(anchor, col) for col in columns]
+        hourly = hourly.sort_index()
+
+    deltas = hourly.diff()
+    deltas = deltas.mask(deltas < 0)
+    if anchor is None:
+        # No earlier reading: the first hour has no usable delta
+        deltas.iloc[0] = np.nan
+    return deltas[deltas.index >= start_hour]
+
+
+def _weather_hours(db, start_hour):
+    """Return the weather columns averaged per hour from start_hour onwards."""
+    fields = [getattr(Weather, col) for col in WEATHER_COLUMNS]
+    rows = db.session.query(Weather.epoch, *fields).filter(
+        Weather.epoch >= start_hour * 3600).all()
+    df = pd.DataFrame(rows, columns=['epoch'] + WEATHER_COLUMNS)
+    df['hour'] = df['epoch'] // 3600
+    return df.groupby('hour')[WEATHER_COLUMNS].mean()
+
+
+def _capability_counts(db, start_hour):
+    """Count SmartThings events per hour and capability inside the database.
+
+    Compacted runs count all their messages in the hour they fall in (see compaction.py).
+    """
+    rows = db.session.execute(text(
+        "SELECT epoch / 3600 AS epoch_hour, capability, SUM(n_messages) AS events FROM ("
+        " SELECT epoch, capability, 1 AS n_messages FROM smartthings_messages"
+        f" UNION ALL SELECT epoch, capability, n_messages FROM ({RUN_EVENTS_SQL})"
+        ") WHERE epoch >= :start "
+        "GROUP BY epoch_hour, capability"
+    ), {'start': start_hour * 3600}).all()
+    return pd.DataFrame(rows, columns=['epoch_hour', 'capability', 'events'])
+
+
+def _source_hour_range(db):
+    """Return the (first, last) epoch hour over all sources, or None for an empty database."""
+    bounds = db.session.execute(text(
+        "SELECT MIN(lo), MAX(hi) FROM ("
+        " SELECT MIN(epoch) AS lo, MAX(epoch) AS hi FROM electricity_usage"
+        " UNION ALL SELECT MIN(epoch), MAX(epoch) FROM gas_usage"
+        " UNION ALL SELECT MIN(epoch), MAX(epoch) FROM weather"
+        " UNION ALL SELECT MIN(epoch), MAX(epoch) FROM smartthings_messages"
+        " UNION ALL SELECT MIN(start_epoch), MAX(end_epoch) FROM smartthings_runs)"
+    )).one()
+    if bounds[0] is None:
+        return None
+    return bounds[0] // 3600, bounds[1] // 3600
+
+
+def _earliest_new_hour(db):
+    """Return the first epoch hour of the rows loaded since the last build, or None."""
+    earliest = None
+    for table, (model, row_id) in BUILD_SOURCES.items():
+        mark = db.session.get(FeatureBuildMark, table)
+        if mark is None:
+            continue
+        epoch = db.session.query(func.min(model.epoch)).filter(row_id > mark.max_row_id).scalar()
+        if epoch is not None:
+            earliest = epoch // 3600 if earliest is None else min(earliest, epoch // 3600)
+    return earliest
+
+
+def build_hourly_features(db, since_epoch=None):
+    """Build or extend the hourly feature tables and return the number of hours written.
+
+    Without since_epoch the build resumes at the last stored hour (which may have been
+    partial), or earlier when rows loaded since the last build are older than that
+    (backfills, late files). Pass since_epoch to rebuild from an earlier point, e.g. after
+    correcting readings in place.
+    """
+    source_range = _source_hour_range(db)
+    if source_range is None:
+        return 0
+    first_hour, last_hour = source_range
+    # Taken before reading the sources, so rows loaded during the build are picked up next time
+    row_ids = {table: db.session.query(func.max(row_id)).scalar() or 0
+               for table, (_, row_id) in BUILD_SOURCES.items()}
+
+    if since_epoch is not None:
+        start_hour = max(since_epoch // 3600, first_hour)
+    else:
+        last_built = db.session.query(HourlyFeature.epoch_hour).order_by(
+            HourlyFeature.epoch_hour.desc()).first()
+        start_hour = last_built.epoch_hour if last_built else first_hour
+        earliest_new = _earliest_new_hour(db) if last_built else None
+        if earliest_new is not None:
+            start_hour = max(min(start_hour, earliest_new), first_hour)
+    if start_hour > last_hour:
+        return 0
+
+    # Resample every source onto the common hourly grid
+    grid = pd.DataFrame(index=pd.RangeIndex(start_hour, last_hour + 1, name='epoch_hour'))
+    grid = grid.join(_meter_deltas(db, ElectricityUsage, ['t1_kwh', 't2_kwh'], start_hour))
+    grid = grid.join(_meter_deltas(db, GasUsage, ['gas_m3'], start_hour))
+    grid = grid.join(_weather_hours(db, start_hour))
+    counts = _capability_counts(db, start_hour)
+
+    feature_rows = [
+        {'epoch_hour': int(hour), **{col: (None if pd.isna(val) else float(val))
+                                     for col, val in zip(FEATURE_COLUMNS, values)}}
+        for hour, values in zip(grid.index, grid[FEATURE_COLUMNS].itertuples(index=False))
+    ]
+    count_rows = [
+        {'epoch_hour': int(row.epoch_hour), 'capability': row.capability, 'events': int(row.events)}
+        for row in counts.itertuples(index=False)
+    ]
+
+    # Replace the rebuilt hours in one transaction
+    try:
+        db.session.query(HourlyFeature).filter(HourlyFeature.epoch_hour >= start_hour).delete()
+        db.session.query(HourlyCapabilityCount).filter(
+            HourlyCapabilityCount.epoch_hour >= start_hour).delete()
+        db.session.bulk_insert_mappings(HourlyFeature, feature_rows)
+        db.session.bulk_insert_mappings(HourlyCapabilityCount, count_rows)
+        for table, max_row_id in row_ids.items():
+            db.session.merge(FeatureBuildMark(table_name=table, max_row_id=int(max_row_id)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(feature_rows)
+
+
+def load_feature_matrix(db, start_epoch=None, end_epoch=None):
+    """Return the stored hourly features as a float32 DataFrame indexed by epoch hour.
+
+    Columns are the meter deltas, the weather columns and one events_<capability>
+    column per SmartThings capability (0 where nothing happened in that hour).
+    """
+    query = db.session.query(HourlyFeature.epoch_hour,
+                             *[getattr(HourlyFeature, col) for col in FEATURE_COLUMNS])
+    counts_query = db.session.query(HourlyCapabilityCount.epoch_hour,
+                                    HourlyCapabilityCount.capability,
+                                    HourlyCapabilityCount.events)
+    if start_epoch is not None:
+        query = query.filter(HourlyFeature.epoch_hour >= start_epoch // 3600)
+        counts_query = counts_query.filter(HourlyCapabilityCount.epoch_hour >= start_epoch // 3600)
+    if end_epoch is not None:
+        query = query.filter(HourlyFeature.epoch_hour <= end_epoch // 3600)
+        counts_query = counts_query.filter(HourlyCapabilityCount.epoch_hour <= end_epoch // 3600)
+
+    features = pd.DataFrame(query.order_by(HourlyFeature.epoch_hour).all(),
+                            columns=['epoch_hour'] + FEATURE_COLUMNS).set_index('epoch_hour')
+    counts = pd.DataFrame(counts_query.all(), columns=['epoch_hour', 'capability', 'events'])
+
+    # Keep the same event columns for every date range
+    capabilities = sorted(row.capability for row in
+                          db.session.query(HourlyCapabilityCount.capability).distinct())
+    events = counts.pivot(index='epoch_hour', columns='capability', values='events')
+    events = events.reindex(index=features.index, columns=capabilities).fillna(0)
+    features = features.join(events.add_prefix('events_'))
+    return features.astype(np.float32)
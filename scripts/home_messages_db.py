@@ -1,11 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Index
+import time
+from collections import Counter
+from sqlalchemy import create_engine, inspect, Column, Integer, String, Float, Boolean, ForeignKey, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
+from instrumentation import get_profiler
+from coverage_index import (ALL_DEVICES, find_gaps, load_coverage, MERGE_TOLERANCE, rebuild_coverage,
+                            record_coverage)
+from schema_version import record_schema_version, schema_is_current, STATS_TABLES
 
 Base = declarative_base()
 
-# PART-1 - Schema of All tables
+# PART-1 - Schema of All tables (bump SCHEMA_VERSION in schema_version.py when changing them)
 class Device(Base):
     """Table to store unique smart home devices."""
     __tablename__ = 'devices'
@@ -26,6 +32,24 @@ class SmartThingsMessage(Base):
     unit = Column(String)
     __table_args__ = (
         Index('idx_smartthings_unique', 'device_id', 'epoch', 'capability', 'attribute', unique=True),
+        # Never reuse ids of deleted rows: feature builds mark new rows by id (FeatureBuildMark)
+        {'sqlite_autoincrement': True},
+    )
+
+class SmartThingsRun(Base):
+    """Table to store compacted runs of identical SmartThings messages (see compaction.py)."""
+    __tablename__ = 'smartthings_runs'
+    run_id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey('devices.device_id'), nullable=False)
+    capability = Column(String, nullable=False)
+    attribute = Column(String, nullable=False)
+    value = Column(String)
+    unit = Column(String)
+    start_epoch = Column(Integer, nullable=False)  # first message of the run
+    end_epoch = Column(Integer, nullable=False)  # last message of the run
+    n_messages = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('idx_smartthings_runs_series', 'device_id', 'capability', 'attribute', 'start_epoch'),
     )
 
 class ElectricityUsage(Base):
@@ -35,6 +59,7 @@ class ElectricityUsage(Base):
     epoch = Column(Integer, nullable=False, unique=True)  
     t1_kwh = Column(Float)
     t2_kwh = Column(Float)
+    __table_args__ = {'sqlite_autoincrement': True}
 
 class GasUsage(Base):
     """Table to store gas usage from P1g source."""
@@ -42,6 +67,7 @@ class GasUsage(Base):
     reading_id = Column(Integer, primary_key=True)
     epoch = Column(Integer, nullable=False, unique=True)  
     gas_m3 = Column(Float)
+    __table_args__ = {'sqlite_autoincrement': True}
 
 class Weather(Base):
     """Table to store weather data from openweather (optional)."""
@@ -53,6 +79,126 @@ class Weather(Base):
     precipitation = Column(Float)
     wind_speed = Column(Float)
     pressure = Column(Float)
+    __table_args__ = {'sqlite_autoincrement': True}
+
+class HourlyFeature(Base):
+    """Table to store meter deltas and weather resampled onto a common hourly grid."""
+    __tablename__ = 'hourly_features'
+    epoch_hour = Column(Integer, primary_key=True, autoincrement=False)  # epoch // 3600
+    t1_kwh = Column(Float)
+    t2_kwh = Column(Float)
+    gas_m3 = Column(Float)
+    temperature = Column(Float)
+    humidity = Column(Float)
+    precipitation = Column(Float)
+    wind_speed = Column(Float)
+    pressure = Column(Float)
+
+class FeatureBuildMark(Base):
+    """Table to store the highest row id of each source table included in the last feature build."""
+    __tablename__ = 'feature_build_marks'
+    table_name = Column(String, primary_key=True)
+    max_row_id = Column(Integer, nullable=False)
+
+class HourlyCapabilityCount(Base):
+    """Table to store SmartThings event counts per hour and capability (sparse)."""
+    __tablename__ = 'hourly_capability_counts'
+    epoch_hour = Column(Integer, primary_key=True, autoincrement=False)
+    capability = Column(String, primary_key=True)
+    events = Column(Integer, nullable=False)
+
+class CalendarHour(Base):
+    """Table to store the Europe/Amsterdam calendar for every UTC epoch hour."""
+    __tablename__ = 'calendar_hours'
+    epoch_hour = Column(Integer, primary_key=True, autoincrement=False)  # epoch // 3600
+    local_date = Column(String, nullable=False)  # YYYY-MM-DD in local time
+    local_hour = Column(Integer, nullable=False)
+    weekday = Column(Integer, nullable=False)  # 0 = Monday
+    iso_year = Column(Integer, nullable=False)
+    iso_week = Column(Integer, nullable=False)
+    is_dst = Column(Boolean, nullable=False)
+    is_holiday = Column(Boolean, nullable=False)
+    tariff = Column(String, nullable=False)  # 'T1' (low) or 'T2' (normal)
+
+class StatsResult(Base):
+    """Table to store per-group hypothesis test results from the stats runner."""
+    __tablename__ = 'stats_results'
+    result_id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False, index=True)
+    dataset = Column(String, nullable=False)
+    test = Column(String, nullable=False)
+    inputs = Column(String)  # comma-separated test input columns
+    group_by = Column(String)  # comma-separated grouping columns
+    group_key = Column(String)  # e.g. "month=2023-01"
+    n = Column(Integer)
+    statistic = Column(Float)
+    p_value = Column(Float)
+    effect = Column(Float)
+    ci_low = Column(Float)
+    ci_high = Column(Float)
+    created_epoch = Column(Integer)
+
+class TableStat(Base):
+    """Table to store row counts and time coverage per data table, updated by the loaders."""
+    __tablename__ = 'table_stats'
+    table_name = Column(String, primary_key=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    min_epoch = Column(Integer)
+    max_epoch = Column(Integer)
+    last_ingest_epoch = Column(Integer)
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # bumped by every write to the table
+    changed_version = Column(Integer, nullable=False, default=0,
+                             server_default='0')  # version of the last in-place change or delete
+
+class MessageCount(Base):
+    """Table to store SmartThings message counts per device and capability."""
+    __tablename__ = 'smartthings_message_counts'
+    device_id = Column(Integer, primary_key=True, autoincrement=False)
+    capability = Column(String, primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+
+class CoverageInterval(Base):
+    """Table to store merged epoch intervals where a source has data (see coverage_index.py)."""
+    __tablename__ = 'coverage_intervals'
+    interval_id = Column(Integer, primary_key=True, autoincrement=True)
+    source = Column(String, nullable=False)  # data table name
+    device_id = Column(Integer, nullable=False, default=0)  # 0 = whole source
+    start_epoch = Column(Integer, nullable=False)
+    end_epoch = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('idx_coverage_source_device_start', 'source', 'device_id', 'start_epoch'),
+    )
+
+class IngestCheckpoint(Base):
+    """Table to store how far watch.py has read each growing export file."""
+    __tablename__ = 'ingest_checkpoints'
+    path = Column(String, primary_key=True)
+    inode = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False)  # bytes read, always at a line boundary
+    header = Column(String)  # first line of the file, to parse later chunks
+    fingerprint = Column(String)  # hash of the first bytes read; inode numbers are reused
+    updated_epoch = Column(Integer)
+
+class SchemaVersion(Base):
+    """Table to store the schema versions applied to this database (see schema_version.py)."""
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_epoch = Column(Integer)
+
+# Columns added to existing tables after they were first created: create_all does not add them
+ADDED_COLUMNS = [('ingest_checkpoints', 'fingerprint', 'VARCHAR'),
+                 ('table_stats', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+                 ('table_stats', 'changed_version', 'INTEGER NOT NULL DEFAULT 0')]
+
+
+def add_missing_columns(engine):
+    """Add the ADDED_COLUMNS that a database created by an older version does not have yet."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, column_type in ADDED_COLUMNS:
+            if column not in {col['name'] for col in inspector.get_columns(table)}:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
 
 class HomeMessagesDB:
     """Class to manage the smart home messages database."""
@@ -62,15 +208,25 @@ class HomeMessagesDB:
         self.engine = None
         self.Session = None
         self.session = None
+        self.profiler = get_profiler()
         self.connect()
 
     def connect(self):
         """Establish connection to the database."""
         try:
-            self.engine = create_engine(self.db_url)
-            Base.metadata.create_all(self.engine)
-            self.Session = sessionmaker(bind=self.engine)
-            self.session = self.Session()
+            with self.profiler.stage('connect'):
+                self.engine = create_engine(self.db_url)
+                self.profiler.attach_engine(self.engine)
+                # Creating the tables inspects every one of them; skip it when the schema is current
+                with self.engine.connect() as conn:
+                    current = schema_is_current(conn.exec_driver_sql)
+                if not current:
+                    Base.metadata.create_all(self.engine)
+                    add_missing_columns(self.engine)
+                    with self.engine.begin() as conn:
+                        record_schema_version(conn.exec_driver_sql)
+                self.Session = sessionmaker(bind=self.engine)
+                self.session = self.Session()
         except SQLAlchemyError as e:
             raise Exception(f"Failed to connect to database: {e}")
 
@@ -83,30 +239,119 @@ class HomeMessagesDB:
             self.engine.dispose()
             self.engine = None
 
-    def insert_device(self, name, loc, level):
-        """Insert a device if it doesn't exist and return its ID."""
+    def _execute(self, sql, params):
+        return self.session.execute(text(sql), params)
+
+    def record_ingest(self, table, count, epochs=None, device_capabilities=None):
+        """Add newly inserted rows to the table_stats catalog and the coverage index; the caller commits.
+
+        epochs may also hold rows of the batch that already existed (they are covered too);
+        device_capabilities is a list with a (device_id, capability) pair per SmartThings message.
+        """
+        if epochs:
+            device_ids = [device_id for device_id, _ in device_capabilities] if device_capabilities else None
+            record_coverage(self._execute, table, epochs, device_ids)
+        if not count:
+            return
+        stat = self.session.get(TableStat, table)
+        if stat is None:
+            stat = TableStat(table_name=table, row_count=0)
+            self.session.add(stat)
+        stat.row_count += int(count)
+        stat.version = (stat.version or 0) + 1
+        min_epoch = min(epochs) if epochs else None
+        max_epoch = max(epochs) if epochs else None
+        if min_epoch is not None:
+            stat.min_epoch = int(min_epoch) if stat.min_epoch is None else min(stat.min_epoch, int(min_epoch))
+        if max_epoch is not None:
+            stat.max_epoch = int(max_epoch) if stat.max_epoch is None else max(stat.max_epoch, int(max_epoch))
+        stat.last_ingest_epoch = int(time.time())
+
+        for (device_id, capability), n in Counter(device_capabilities or []).items():
+            counter = self.session.get(MessageCount, (int(device_id), capability))
+            if counter is None:
+                counter = MessageCount(device_id=int(device_id), capability=capability, message_count=0)
+                self.session.add(counter)
+            counter.message_count += n
+
+    def coverage(self, source, start_epoch=None, end_epoch=None, device_id=None):
+        """Return the (start, end) intervals where a source has data, overlapping the given range.
+
+        source is a data table name; device_id selects one SmartThings device.
+        """
+        with self.profiler.stage('coverage') as stage:
+            intervals = load_coverage(self._execute, source, start_epoch, end_epoch,
+                                      ALL_DEVICES if device_id is None else device_id)
+            stage.add_rows(len(intervals))
+        return intervals
+
+    def ensure_coverage(self, source):
+        """Build the coverage index of a source from its table when it has rows but no intervals yet
+        (databases filled before the index); returns whether it was built."""
+        indexed = self.session.execute(text(
+            "SELECT 1 FROM coverage_intervals WHERE source = :source LIMIT 1"), {'source': source}).first()
+        if indexed or not self.session.execute(text(f"SELECT 1 FROM {source} LIMIT 1")).first():
+            return False
+        try:
+            with self.profiler.stage('rebuild_coverage'):
+                rebuild_coverage(self._execute, source)
+            self.session.commit()
+        except SQLAlchemyError as e:
+            self.session.rollback()
+            raise Exception(f"Failed to build the coverage index of {source}: {e}")
+        return True
+
+    def coverage_gaps(self, source, start_epoch=None, end_epoch=None, min_gap=None, device_id=None):
+        """Return (last_epoch_before, first_epoch_after) gaps longer than min_gap seconds.
+
+        min_gap defaults to the merge tolerance of the source; shorter gaps are not indexed.
+        """
+        if min_gap is None:
+            min_gap = MERGE_TOLERANCE[source]
+        return find_gaps(self.coverage(source, start_epoch, end_epoch, device_id),
+                         start_epoch, end_epoch, min_gap)
+
+    def insert_device(self, name, loc, level, commit=True):
+        """Insert a device if it doesn't exist and return its ID.
+
+        With commit=False the device is only flushed, so it commits with the caller's rows.
+        """
         device = self.session.query(Device).filter_by(name=name).first()
         if not device:
             device = Device(name=name, loc=loc, level=level)
             self.session.add(device)
-            self.session.commit()
+            self.record_ingest('devices', 1)
+            if commit:
+                self.session.commit()
+            else:
+                self.session.flush()
         return device.device_id
 
     def insert_smartthings(self, loc, level, name, epoch, capability, attribute, value, unit):
         """Insert a SmartThings message."""
         try:
-            device_id = self.insert_device(name, loc, level)
+            device_id = self.insert_device(name, loc, level, commit=False)
             # Check for duplicate message (same device, epoch, capability, attribute)
             existing = self.session.query(SmartThingsMessage).filter_by(
                 device_id=device_id, epoch=epoch, capability=capability, attribute=attribute
             ).first()
-            if not existing:
+            # Messages inside a compacted run are already part of the history
+            compacted = self.session.query(SmartThingsRun.run_id).filter(
+                SmartThingsRun.device_id == device_id, SmartThingsRun.capability == capability,
+                SmartThingsRun.attribute == attribute,
+                # IS, as in db_manager and compaction: a NULL value matches runs of NULL
+                SmartThingsRun.value.is_not_distinct_from(value),
+                SmartThingsRun.start_epoch <= epoch, SmartThingsRun.end_epoch >= epoch
+            ).first()
+            if not existing and not compacted:
                 message = SmartThingsMessage(
                     device_id=device_id, epoch=epoch, capability=capability,
                     attribute=attribute, value=value, unit=unit
                 )
                 self.session.add(message)
-                self.session.commit()
+                self.record_ingest('smartthings_messages', 1, [epoch], [(device_id, capability)])
+            # Commits a new device together with its message
+            self.session.commit()
         except SQLAlchemyError as e:
             self.session.rollback()
             raise Exception(f"Failed to insert SmartThings message: {e}")
@@ -118,6 +363,7 @@ class HomeMessagesDB:
             if not existing:
                 record = ElectricityUsage(epoch=epoch, t1_kwh=t1_kwh, t2_kwh=t2_kwh)
                 self.session.add(record)
+                self.record_ingest('electricity_usage', 1, [epoch])
                 self.session.commit()
         except SQLAlchemyError as e:
             self.session.rollback()
@@ -130,6 +376,7 @@ class HomeMessagesDB:
             if not existing:
                 record = GasUsage(epoch=epoch, gas_m3=gas_m3)
                 self.session.add(record)
+                self.record_ingest('gas_usage', 1, [epoch])
                 self.session.commit()
         except SQLAlchemyError as e:
             self.session.rollback()
@@ -143,16 +390,27 @@ class HomeMessagesDB:
                 record = Weather(epoch=epoch, temperature=temperature, humidity=humidity,
                                 precipitation=precipitation, wind_speed=wind_speed, pressure=pressure)
                 self.session.add(record)
+                self.record_ingest('weather', 1, [epoch])
                 self.session.commit()
         except SQLAlchemyError as e:
             self.session.rollback()
             raise Exception(f"Failed to insert weather data: {e}")
 
-    def bulk_insert_weather(self, weather_data):
-        """Bulk insert multiple weather records."""
+    def bulk_insert_weather(self, weather_data, covered_epochs=()):
+        """Bulk insert multiple weather records.
+
+        covered_epochs are hours without data that still count as covered in the coverage index
+        (hours the archive will never publish), so they are not requested again.
+        """
         try:
-            # Fetch existing epochs to avoid duplicates
-            existing_epochs = {row.epoch for row in self.session.query(Weather.epoch).all()}
+            if not weather_data and not covered_epochs:
+                return 0
+
+            # Fetch existing epochs in the batch's time range to avoid duplicates
+            with self.profiler.stage('weather_existing_keys'):
+                epochs = [data['epoch'] for data in weather_data]
+                existing_epochs = {row.epoch for row in self.session.query(Weather.epoch).filter(
+                    Weather.epoch >= min(epochs), Weather.epoch <= max(epochs))} if epochs else set()
             
             # Prepare new rows, excluding duplicates
             new_rows = [
@@ -168,52 +426,190 @@ class HomeMessagesDB:
                 if data['epoch'] not in existing_epochs
             ]
             
-            # Bulk insert
-            if new_rows:
-                self.session.bulk_insert_mappings(Weather, new_rows)
+            # Bulk insert; the whole batch counts as covered, so gaps close even when all rows existed
+            with self.profiler.stage('weather_bulk_insert') as stage:
+                if new_rows:
+                    self.session.bulk_insert_mappings(Weather, new_rows)
+                self.record_ingest('weather', len(new_rows), epochs)
+                if covered_epochs:
+                    record_coverage(self._execute, 'weather', [int(epoch) for epoch in covered_epochs])
+                stage.add_rows(len(new_rows))
+            with self.profiler.stage('weather_commit'):
                 self.session.commit()
-                return len(new_rows)
-            return 0
+            return len(new_rows)
         except SQLAlchemyError as e:
             self.session.rollback()
             raise Exception(f"Failed to bulk insert weather data: {e}")
 
-    def query_smartthings(self, capability=None, attribute=None, start_epoch=None, end_epoch=None):
-        """Query SmartThings messages with optional filters."""
+    def query_smartthings(self, capability=None, attribute=None, start_epoch=None, end_epoch=None,
+                          expand_runs=True):
+        """Query SmartThings messages with optional filters.
+
+        Compacted runs are returned as their first and last message (unsaved SmartThingsMessage
+        objects) unless expand_runs is False. Message counts of compacted history are not exact
+        here; use query_smartthings_runs for the n_messages of every run.
+        """
         query = self.session.query(SmartThingsMessage)
         if capability:
             query = query.filter_by(capability=capability)
         if attribute:
             query = query.filter_by(attribute=attribute)
-        if start_epoch:
+        if start_epoch is not None:
             query = query.filter(SmartThingsMessage.epoch >= start_epoch)
-        if end_epoch:
+        if end_epoch is not None:
             query = query.filter(SmartThingsMessage.epoch <= end_epoch)
-        return query.all()
+        with self.profiler.stage('query_smartthings') as stage:
+            rows = query.all()
+            if expand_runs:
+                for run in self.query_smartthings_runs(capability, attribute, start_epoch, end_epoch):
+                    epochs = [run.start_epoch]
+                    if run.n_messages > 1 and run.end_epoch > run.start_epoch:
+                        epochs.append(run.end_epoch)
+                    rows.extend(
+                        SmartThingsMessage(device_id=run.device_id, epoch=epoch, capability=run.capability,
+                                           attribute=run.attribute, value=run.value, unit=run.unit)
+                        for epoch in epochs
+                        if (start_epoch is None or epoch >= start_epoch) and (end_epoch is None or epoch <= end_epoch)
+                    )
+            stage.add_rows(len(rows))
+        return rows
+
+    def query_smartthings_runs(self, capability=None, attribute=None, start_epoch=None, end_epoch=None):
+        """Query compacted SmartThings runs (value held from start_epoch to end_epoch) overlapping a range."""
+        query = self.session.query(SmartThingsRun)
+        if capability:
+            query = query.filter_by(capability=capability)
+        if attribute:
+            query = query.filter_by(attribute=attribute)
+        if start_epoch is not None:
+            query = query.filter(SmartThingsRun.end_epoch >= start_epoch)
+        if end_epoch is not None:
+            query = query.filter(SmartThingsRun.start_epoch <= end_epoch)
+        with self.profiler.stage('query_smartthings_runs') as stage:
+            rows = query.order_by(SmartThingsRun.start_epoch).all()
+            stage.add_rows(len(rows))
+        return rows
 
     def query_electricity(self, start_epoch=None, end_epoch=None):
         """Query electricity usage with optional time range."""
         query = self.session.query(ElectricityUsage)
-        if start_epoch:
+        if start_epoch is not None:
             query = query.filter(ElectricityUsage.epoch >= start_epoch)
-        if end_epoch:
+        if end_epoch is not None:
             query = query.filter(ElectricityUsage.epoch <= end_epoch)
-        return query.all()
+        with self.profiler.stage('query_electricity') as stage:
+            rows = query.all()
+            stage.add_rows(len(rows))
+        return rows
 
     def query_gas(self, start_epoch=None, end_epoch=None):
         """Query gas usage with optional time range."""
         query = self.session.query(GasUsage)
-        if start_epoch:
+        if start_epoch is not None:
             query = query.filter(GasUsage.epoch >= start_epoch)
-        if end_epoch:
+        if end_epoch is not None:
             query = query.filter(GasUsage.epoch <= end_epoch)
-        return query.all()
+        with self.profiler.stage('query_gas') as stage:
+            rows = query.all()
+            stage.add_rows(len(rows))
+        return rows
 
     def query_weather(self, start_epoch=None, end_epoch=None):
         """Query weather data with optional time range."""
         query = self.session.query(Weather)
-        if start_epoch:
+        if start_epoch is not None:
             query = query.filter(Weather.epoch >= start_epoch)
-        if end_epoch:
+        if end_epoch is not None:
             query = query.filter(Weather.epoch <= end_epoch)
-        return query.all()
\ No newline at end of file
+        with self.profiler.stage('query_weather') as stage:
+            rows = query.all()
+            stage.add_rows(len(rows))
+        return rows
+
+    def build_hourly_features(self, since_epoch=None):
+        """Incrementally build the hourly feature grid; returns the number of hours written."""
+        from feature_matrix import build_hourly_features
+        with self.profiler.stage('build_hourly_features') as stage:
+            written = build_hourly_features(self, since_epoch=since_epoch)
+            stage.add_rows(written)
+        return written
+
+    def feature_matrix(self, start_epoch=None, end_epoch=None, refresh=False):
+        """Return the hourly feature matrix (float32 DataFrame indexed by epoch hour).
+
+        Reads the stored grid as is; with refresh set, new readings are built into it first.
+        """
+        from feature_matrix import load_feature_matrix
+        if refresh:
+            self.build_hourly_features()
+        with self.profiler.stage('load_feature_matrix') as stage:
+            matrix = load_feature_matrix(self, start_epoch=start_epoch, end_epoch=end_epoch)
+            stage.add_rows(len(matrix))
+        return matrix
+
+    def usage_profile(self, source, bucket='local_hour', agg='mean', start_epoch=None, end_epoch=None,
+                      backend='sql'):
+        """Return the aggregated usage deltas of a meter ('electricity' or 'gas') per bucket.
+
+        bucket is a calendar column (local_hour, weekday, local_date, tariff) or utc_hour/utc_date;
+        agg is mean, sum or count. See usage_aggregates.py for the sql, pandas and store backends.
+        """
+        from usage_aggregates import usage_profile_pandas, usage_profile_sql, usage_profile_store
+        compute = {'sql': usage_profile_sql, 'pandas': usage_profile_pandas, 'store': usage_profile_store}[backend]
+        with self.profiler.stage(f'usage_profile_{backend}') as stage:
+            profile = compute(self, source, bucket, agg, start_epoch, end_epoch)
+            stage.add_rows(len(profile))
+        return profile
+
+    def _store_path(self):
+        """Return the database file of a SQLite engine (None otherwise), where the time-series store lives."""
+        if self.engine.url.get_backend_name() != 'sqlite':
+            return None
+        return self.engine.url.database
+
+    def _read_committed(self, compute):
+        # Stores only hold committed rows: read on a connection of its own, not the session
+        with self.engine.connect() as conn:
+            return compute(lambda sql, params: conn.execute(text(sql), params))
+
+    def timeseries(self, source, start_epoch=None, end_epoch=None, refresh=True):
+        """Return the memory-mapped TimeSeries of a meter ('electricity' or 'gas') for the range.
+
+        The store is built on first use and brought up to date when refresh is set: opening
+        compares the table's version in table_stats with the one the store was written at.
+        """
+        from timeseries_store import open_store
+        with self.profiler.stage('timeseries') as stage:
+            series = self._read_committed(
+                lambda execute: open_store(execute, self._store_path(), source, refresh))
+            series = series.slice(start_epoch, end_epoch)
+            stage.add_rows(len(series))
+        return series
+
+    def refresh_timeseries(self, source, rebuild=False):
+        """Append the new readings of a meter to its store, if it was built before; returns the rows written."""
+        from timeseries_store import refresh_store
+        with self.profiler.stage('timeseries_refresh') as stage:
+            written = self._read_committed(
+                lambda execute: refresh_store(execute, self._store_path(), source, rebuild, create=False))
+            stage.add_rows(written or 0)
+        return written
+
+    def compact_smartthings(self, before_epoch):
+        """Fold SmartThings messages older than before_epoch into runs; returns (removed, runs added)."""
+        from compaction import compact_smartthings
+        try:
+            with self.profiler.stage('compact_smartthings') as stage:
+                removed, added = compact_smartthings(self, before_epoch)
+                stage.add_rows(removed)
+            self.session.commit()
+        except SQLAlchemyError as e:
+            self.session.rollback()
+            raise Exception(f"Failed to compact SmartThings messages: {e}")
+        return removed, added
+
+    def calendar(self, start_epoch, end_epoch):
+        """Return a CalendarLookup (local hour, date, weekday, tariff...) covering the epoch range."""
+        from calendar_dim import load_calendar
+        with self.profiler.stage('calendar'):
+            return load_calendar(self, start_epoch, end_epoch)
@@ -0,0 +1,198 @@
+import cProfile
+import functools
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import click
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+class Stage:
+    """Metrics of one named stage, accumulated over repeated runs (e.g. once per file)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = None
+        self.statements = 0
+        self.peak_rss_mb = None
+
+    def add_rows(self, rows):
+        self.rows = (self.rows or 0) + int(rows)
+
+    @property
+    def rows_per_sec(self):
+        if not self.rows or not self.seconds:
+            return None
+        return self.rows / self.seconds
+
+    def as_dict(self):
+        return {'stage': self.name, 'calls': self.calls, 'seconds': round(self.seconds, 6),
+                'rows': self.rows, 'rows_per_sec': self.rows_per_sec,
+                'sql_statements': self.statements, 'peak_rss_mb': self.peak_rss_mb}
+
+
+class Profiler:
+    """Collects per-stage wall time, rows, SQL statement counts and peak RSS.
+
+    Recording is always on (it is a perf_counter call per stage); the summary is only
+    printed with --profile. With cprofile_dir set, every outermost stage run is also profiled
+    with cProfile and dumped to <cprofile_dir>/<command>.<stage>.<n>.prof. Stages nest, and only
+    one cProfile can run at a time, so nested stages show up inside the file of the outer one.
+    """
+
+    def __init__(self, command=None, cprofile_dir=None):
+        self.command = command
+        self.cprofile_dir = cprofile_dir
+        self.stages = {}
+        self.statements = 0
+        self.started = time.perf_counter()
+        self._engines = set()
+        self._depth = 0
+
+    def _count_statement(self, *args, **kwargs):
+        self.statements += 1
+
+    def attach_engine(self, engine):
+        """Count the SQL statements executed through a SQLAlchemy engine."""
+        from sqlalchemy import event
+        if id(engine) not in self._engines:
+            event.listen(engine, 'before_cursor_execute', self._count_statement)
+            self._engines.add(id(engine))
+
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; set rows on the yielded Stage with add_rows()."""
+        stage = self.stages.setdefault(name, Stage(name))
+        statements = self.statements
+        profile = cProfile.Profile() if self.cprofile_dir and not self._depth else None
+        started = time.perf_counter()
+        if profile:
+            profile.enable()
+        self._depth += 1
+        try:
+            yield stage
+        finally:
+            self._depth -= 1
+            if profile:
+                profile.disable()
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(
+                    self.cprofile_dir, f"{self.command or 'smarthome'}.{name}.{stage.calls}.prof"))
+            stage.seconds += time.perf_counter() - started
+            stage.calls += 1
+            stage.statements += self.statements - statements
+            stage.peak_rss_mb = peak_rss_mb()
+
+    def summary(self):
+        """Return the stage table as printable lines."""
+        lines = [f"{'stage':<28}{'calls':>6}{'seconds':>10}{'rows':>11}{'rows/s':>11}{'SQL':>8}{'peak MB':>9}"]
+        for s in self.stages.values():
+            rows = '' if s.rows is None else s.rows
+            rate = '' if s.rows_per_sec is None else f"{s.rows_per_sec:.0f}"
+            rss = '' if s.peak_rss_mb is None else f"{s.peak_rss_mb:.1f}"
+            lines.append(f"{s.name:<28}{s.calls:>6}{s.seconds:>10.3f}{rows:>11}{rate:>11}{s.statements:>8}{rss:>9}")
+        total_rss = peak_rss_mb()
+        lines.append(f"{'total':<28}{'':>6}{time.perf_counter() - self.started:>10.3f}{'':>11}{'':>11}"
+                     f"{self.statements:>8}{'' if total_rss is None else f'{total_rss:.1f}':>9}")
+        return lines
+
+    def append_jsonl(self, path, argv=None):
+        """Append this run's metrics as one JSON line."""
+        record = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'command': self.command, 'argv': argv,
+            'seconds': round(time.perf_counter() - self.started, 6),
+            'sql_statements': self.statements, 'peak_rss_mb': peak_rss_mb(),
+            'stages': [s.as_dict() for s in self.stages.values()],
+        }
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+# The profiler of the running command; HomeMessagesDB reports into it
+_current = Profiler()
+
+
+# Raw sqlite3 connections count like the SQLAlchemy listener: one statement per execute or
+# executemany call, whatever the number of rows. (A trace callback would run Python per row.)
+class CountingCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        _current.statements += 1
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        _current.statements += 1
+        return super().executemany(*args)
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+    # Connection.execute runs on a new cursor without calling its execute method
+    def execute(self, *args):
+        _current.statements += 1
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        _current.statements += 1
+        return super().executemany(*args)
+
+
+def connect_sqlite(path):
+    """Open a sqlite3 connection whose statements are counted by the running command's profiler."""
+    return sqlite3.connect(path, factory=CountingConnection)
+
+
+def get_profiler():
+    return _current
+
+
+def profile_options(func):
+    """Add --profile, --profile-log and --profile-dir to a click command or group.
+
+    Place it directly above the function, below the click decorators.
+    """
+    @click.option('--profile', is_flag=True, help='Print per-stage timings, rows/s, SQL counts and peak RSS.')
+    @click.option('--profile-log', type=click.Path(dir_okay=False), default=None,
+                  help='Append the stage metrics to this JSONL file.')
+    @click.option('--profile-dir', type=click.Path(file_okay=False), default=None,
+                  help='Dump a cProfile file per stage into this directory.')
+    @functools.wraps(func)
+    def wrapper(*args, profile, profile_log, profile_dir, **kwargs):
+        global _current
+        _current = Profiler(command=func.__name__, cprofile_dir=profile_dir)
+        profiler = _current
+
+        def finish():
+            if profile:
+                click.echo(f"\nProfile of {profiler.command}:", err=True)
+                for line in profiler.summary():
+                    click.echo(line, err=True)
+            if profile_log:
+                profiler.append_jsonl(profile_log, argv=sys.argv[1:])
+
+        # Report when the context closes, so groups include their subcommand
+        click.get_current_context().call_on_close(finish)
+        return func(*args, **kwargs)
+    return wrapper
@@ -1,106 +1,247 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
 import click
 import requests
 import pandas as pd
-from datetime import datetime, timedelta
-from home_messages_db import HomeMessagesDB, Weather
+from home_messages_db import HomeMessagesDB
 from sqlalchemy.exc import SQLAlchemyError
+from instrumentation import profile_options
+
+DEFAULT_BASE_URL = "https://archive-api.open-meteo.com/v1/archive"
+HOURLY_FIELDS = 'temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,surface_pressure'
+
+# Coordinates for Nordwijk, NL
+LATITUDE = 52.2387
+LONGITUDE = 4.4425
+
+# The archive API publishes with a delay; only days older than this are cached, and their nulls are final
+CACHE_AFTER_DAYS = 7
+
+
+def missing_day_ranges(db, start_date, end_date, chunk_days):
+    """Return (first_day, last_day) request chunks covering the hours missing from weather."""
+    start_epoch = int(datetime(start_date.year, start_date.month, start_date.day, tzinfo=timezone.utc).timestamp())
+    end_epoch = int(datetime(end_date.year, end_date.month, end_date.day, 23, tzinfo=timezone.utc).timestamp())
+
+    # Gaps in the coverage index; bounds one hour outside the range so its edges can be missing.
+    # Weather loaded before the index existed is indexed first, or all of it would look missing.
+    if db.ensure_coverage('weather'):
+        click.echo("Built the weather coverage index from the weather table.")
+    missing_hours = []
+    for gap_start, gap_end in db.coverage_gaps('weather', start_epoch - 3600, end_epoch + 3600, min_gap=3600):
+        first_hour = max(-(-(gap_start + 1) // 3600) * 3600, start_epoch)
+        missing_hours.extend(range(first_hour, min(gap_end - 1, end_epoch) + 1, 3600))
+
+    # Days with at least one missing hour, merged into consecutive runs
+    missing_days = sorted({datetime.fromtimestamp(epoch, tz=timezone.utc).date() for epoch in missing_hours})
+    ranges = []
+    for day in missing_days:
+        if ranges and day == ranges[-1][1] + timedelta(days=1) \
+                and (day - ranges[-1][0]).days < chunk_days:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+def _request(base_url, params, retries, backoff, timeout):
+    """GET the archive API, retrying rate limits, server errors and connection errors with backoff."""
+    for attempt in range(retries + 1):
+        try:
+            response = requests.get(base_url, params=params, timeout=timeout)
+            if response.status_code == 200:
+                return response.json()
+            # Retry rate limits and server errors, fail fast on other client errors
+            if response.status_code != 429 and response.status_code < 500:
+                raise click.ClickException(
+                    f"Failed to fetch weather data: {response.status_code} - {response.text}")
+            error = f"{response.status_code} - {response.text}"
+        except requests.RequestException as e:
+            error = str(e)
+        if attempt == retries:
+            raise click.ClickException(
+                f"Failed to fetch weather data for {params['start_date']} to {params['end_date']} "
+                f"after {retries + 1} attempts: {error}")
+        time.sleep(backoff * 2 ** attempt)
+
+
+def _day_cache_path(cache_dir, base_url, day):
+    # One file per UTC day, so a day is reused whatever range it was fetched in
+    key = hashlib.sha1(json.dumps([base_url, LATITUDE, LONGITUDE, HOURLY_FIELDS]).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{day}_{key[:12]}.json")
+
+
+def _split_days(hourly):
+    """Split the hourly arrays of a response into {day: hourly arrays of that day}."""
+    days = {}
+    for i, timestamp in enumerate(hourly.get('time', [])):
+        day = days.setdefault(date.fromisoformat(timestamp[:10]), {field: [] for field in hourly})
+        for field, values in hourly.items():
+            day[field].append(values[i])
+    return days
+
+
+def fetch_chunk(base_url, first_day, last_day, cache_dir=None, retries=3, backoff=1.0, timeout=60):
+    """Fetch one date range from the archive API; returns (response, whether it all came from the cache).
+
+    Responses are cached per day, and days already in the cache are not requested again: each
+    run of consecutive missing days is requested on its own.
+    """
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    by_day = {}
+    if cache_dir:
+        for day in days:
+            path = _day_cache_path(cache_dir, base_url, day)
+            if os.path.exists(path):
+                with open(path) as f:
+                    by_day[day] = json.load(f)
+
+    missing = [day for day in days if day not in by_day]
+    # One request per run of consecutive missing days, so cached days in between are not fetched again
+    runs = []
+    for day in missing:
+        if runs and day == runs[-1][-1] + timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    for run in runs:
+        params = {
+            'latitude': LATITUDE,
+            'longitude': LONGITUDE,
+            'start_date': run[0].isoformat(),
+            'end_date': run[-1].isoformat(),
+            'hourly': HOURLY_FIELDS,
+            'timezone': 'UTC'
+        }
+        fetched = _split_days(_request(base_url, params, retries, backoff, timeout).get('hourly', {}))
+        by_day.update(fetched)
+        # The archive API publishes with a delay; only days older than CACHE_AFTER_DAYS are final
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            for day, hourly in fetched.items():
+                if (date.today() - day).days > CACHE_AFTER_DAYS:
+                    path = _day_cache_path(cache_dir, base_url, day)
+                    with open(path + '.tmp', 'w') as f:
+                        json.dump(hourly, f)
+                    os.replace(path + '.tmp', path)
+
+    hourly = {}
+    for day in days:
+        for field, values in by_day.get(day, {}).items():
+            hourly.setdefault(field, []).extend(values)
+    return {'hourly': hourly}, not missing
+
+
+def parse_hourly(data):
+    """Convert an API response into weather rows for bulk_insert_weather."""
+    hourly = data.get('hourly', {})
+
+    # Check if required fields are present
+    required_fields = ['time', 'temperature_2m', 'relative_humidity_2m', 'precipitation', 'wind_speed_10m', 'surface_pressure']
+    if not all(field in hourly for field in required_fields):
+        raise click.ClickException(f"Missing required fields in API response: {hourly.keys()}")
+
+    # Convert to DataFrame for easier processing
+    df = pd.DataFrame({
+        'time': hourly['time'],
+        'temperature': hourly['temperature_2m'],
+        'humidity': hourly['relative_humidity_2m'],
+        'precipitation': hourly['precipitation'],
+        'wind_speed': hourly['wind_speed_10m'],
+        'pressure': hourly['surface_pressure']
+    })
+
+    # Convert time to epoch (Unix timestamp in seconds)
+    df['epoch'] = pd.to_datetime(df['time'], utc=True).astype('int64') // 10**9
+
+    # Convert wind speed from km/h to m/s (1 km/h = 1/3.6 m/s)
+    df['wind_speed'] = df['wind_speed'] / 3.6
+
+    # Hours the archive has not published yet come back as nulls
+    df = df.dropna(subset=['temperature', 'humidity', 'precipitation', 'wind_speed', 'pressure'])
+    return df[['epoch', 'temperature', 'humidity', 'precipitation', 'wind_speed', 'pressure']].to_dict('records')
+
+
+def null_hours(data, before_day):
+    """Return the epochs of hours before before_day that the archive returned without (all) values.
+
+    The archive fills recent hours in later, but older nulls are final: they are recorded as
+    covered, so they are not requested again on every run.
+    """
+    hourly = data.get('hourly', {})
+    values = [hourly.get(field, []) for field in HOURLY_FIELDS.split(',')]
+    return [int(datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp())
+            for timestamp, *row in zip(hourly.get('time', []), *values)
+            if date.fromisoformat(timestamp[:10]) < before_day and any(v is None for v in row)]
+
 
 @click.command()
 @click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
-def openweather(dburl):
+@click.option('--start', 'start_date', type=click.DateTime(['%Y-%m-%d']), default='2022-06-01',
+              show_default=True, help='First day (UTC).')
+@click.option('--end', 'end_date', type=click.DateTime(['%Y-%m-%d']), default='2025-01-31',
+              show_default=True, help='Last day (UTC).')
+@click.option('--base-url', envvar='OPENMETEO_BASE_URL', default=DEFAULT_BASE_URL, show_default=True,
+              help='Archive API URL (e.g. a local stub server for tests); env OPENMETEO_BASE_URL.')
+@click.option('--workers', type=int, default=4, show_default=True, help='Concurrent requests.')
+@click.option('--chunk-days', type=int, default=90, show_default=True, help='Days per request.')
+@click.option('--retries', type=int, default=3, show_default=True, help='Retries per request (exponential backoff).')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default='.weather_cache', show_default=True,
+              help='Directory for raw API responses.')
+@click.option('--no-cache', is_flag=True, help='Neither read nor write the response cache.')
+@profile_options
+def openweather(dburl, start_date, end_date, base_url, workers, chunk_days, retries, cache_dir, no_cache):
     """
     Fetch historical weather data from Open-Meteo API and insert into the database in bulk.
 
+    Only the hours missing from the weather table are requested, in chunks of at most
+    --chunk-days days fetched concurrently.
+
     Usage:
         openweather.py [OPTIONS]
 
     Output options:
         -d DBURL insert into the project database (DBURL is a SQLAlchemy database URL)
     """
-    # Coordinates for Nordwijk, NL
-    lat = 52.2387  # Latitude
-    lon = 4.4425   # Longitude
-
-    # Date range: 32 months from June 2022 to January 2025 (as per assignment context)
-    start_date = datetime(2022, 6, 1)  # Start date
-    end_date = datetime(2025, 1, 31)  # End date (covers 32 months)
-
     # Initialize database connection
     db = HomeMessagesDB(dburl)
     total_inserted = 0
 
     try:
-        # Break the date range into 3-month chunks to avoid API overload
-        current_start = start_date
-        while current_start < end_date:
-            current_end = min(current_start + timedelta(days=90), end_date)
-            click.echo(f"Fetching weather data from {current_start.date()} to {current_end.date()}...")
-
-            # Construct Open-Meteo API URL
-            base_url = "https://archive-api.open-meteo.com/v1/archive"
-            params = {
-                'latitude': lat,
-                'longitude': lon,
-                'start_date': current_start.date().isoformat(),
-                'end_date': current_end.date().isoformat(),
-                'hourly': 'temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,surface_pressure',
-                'timezone': 'UTC'
+        with db.profiler.stage('missing_ranges'):
+            chunks = missing_day_ranges(db, start_date.date(), end_date.date(), chunk_days)
+        if not chunks:
+            click.echo(f"Weather is complete from {start_date.date()} to {end_date.date()}, nothing to fetch.")
+            return
+        click.echo(f"Fetching {len(chunks)} missing range(s) with {workers} worker(s)...")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(fetch_chunk, base_url, first, last, None if no_cache else cache_dir, retries): (first, last)
+                for first, last in chunks
             }
-
-            # Fetch data
-            response = requests.get(base_url, params=params)
-            if response.status_code != 200:
-                raise click.ClickException(f"Failed to fetch weather data: {response.status_code} - {response.text}")
-            else:
-                click.echo(f"API response: {response.status_code}")
-
-            data = response.json()
-            hourly = data.get('hourly', {})
-
-            # Check if required fields are present
-            required_fields = ['time', 'temperature_2m', 'relative_humidity_2m', 'precipitation', 'wind_speed_10m', 'surface_pressure']
-            if not all(field in hourly for field in required_fields):
-                raise click.ClickException(f"Missing required fields in API response: {hourly.keys()}")
-
-            # Convert to DataFrame for easier processing
-            df = pd.DataFrame({
-                'time': hourly['time'],
-                'temperature': hourly['temperature_2m'],
-                'humidity': hourly['relative_humidity_2m'],
-                'precipitation': hourly['precipitation'],
-                'wind_speed': hourly['wind_speed_10m'],
-                'pressure': hourly['surface_pressure']
-            })
-
-            # Convert time to epoch (Unix timestamp in seconds)
-            df['epoch'] = pd.to_datetime(df['time'], utc=True).astype('int64') // 10**9
-
-            # Convert wind speed from km/h to m/s (1 km/h = 1/3.6 m/s)
-            df['wind_speed'] = df['wind_speed'] / 3.6
-
-            # Prepare data for bulk insertion
-            weather_data = [
-                {
-                    'epoch': row['epoch'],
-                    'temperature': row['temperature'],
-                    'humidity': row['humidity'],
-                    'precipitation': row['precipitation'],
-                    'wind_speed': row['wind_speed'],
-                    'pressure': row['pressure']
-                }
-                for _, row in df.iterrows()
-                if all(row[field] is not None for field in ['temperature', 'humidity', 'precipitation', 'wind_speed', 'pressure'])
-            ]
-
-            # Bulk insert into database
-            inserted = db.bulk_insert_weather(weather_data)
-            total_inserted += inserted
-            click.echo(f"Inserted {inserted} new weather records for {current_start.date()} to {current_end.date()}")
-
-            # Move to the next chunk
-            current_start = current_end + timedelta(days=1)
+            # Insert on the main thread as chunks arrive; the session is not thread-safe
+            for future in as_completed(futures):
+                first, last = futures[future]
+                with db.profiler.stage('fetch_wait'):
+                    data, cached = future.result()
+                with db.profiler.stage('parse') as stage:
+                    weather_data = parse_hourly(data)
+                    final_nulls = null_hours(data, date.today() - timedelta(days=CACHE_AFTER_DAYS))
+                    stage.add_rows(len(weather_data))
+                inserted = db.bulk_insert_weather(weather_data, covered_epochs=final_nulls)
+                total_inserted += inserted
+                source = 'cache' if cached else 'API'
+                click.echo(f"Inserted {inserted} new weather records for {first} to {last} (from {source})")
 
         click.echo(f"Total new weather records inserted: {total_inserted}")
+    except SQLAlchemyError as e:
+        click.echo(f"Database error: {e}", err=True)
+        raise
     except Exception as e:
         click.echo(f"Error: {e}", err=True)
         raise
@@ -108,4 +249,4 @@ def openweather(dburl):
         db.close()
 
 if __name__ == "__main__":
-    openweather()
\ No newline at end of file
+    openweather()
@@ -2,10 +2,78 @@ import click
 import pandas as pd
 from home_messages_db import HomeMessagesDB, ElectricityUsage
 from sqlalchemy.exc import SQLAlchemyError
+from instrumentation import get_profiler, profile_options
+
+def normalize_p1e(df, file):
+    """Return the epoch/t1_kwh/t2_kwh rows of a P1e export frame, without duplicate epochs."""
+    # Check for time column
+    if 'time' not in df.columns:
+        raise click.UsageError(f"Missing 'time' column in {file}")
+
+    # Determine column names for t1_kwh and t2_kwh
+    if 'Import T1 kWh' in df.columns and 'Import T2 kWh' in df.columns:
+        df = df.rename(columns={
+            'Import T1 kWh': 't1_kwh',
+            'Import T2 kWh': 't2_kwh'
+        })
+    elif 'Electricity imported T1' in df.columns and 'Electricity imported T2' in df.columns:
+        df = df.rename(columns={
+            'Electricity imported T1': 't1_kwh',
+            'Electricity imported T2': 't2_kwh'
+        })
+    else:
+        raise click.UsageError(f"Missing electricity import columns in {file}. Expected 'Import T1 kWh'/'Import T2 kWh' or 'Electricity imported T1'/'Electricity imported T2'")
+
+    # Convert time to Unix timestamp (seconds)
+    with get_profiler().stage('to_datetime') as stage:
+        df['epoch'] = pd.to_datetime(df['time'], utc=True).astype('int64') // 10**9
+        stage.add_rows(len(df))
+
+    # Ensure required columns after renaming
+    required_columns = ['epoch', 't1_kwh', 't2_kwh']
+    if not all(col in df.columns for col in required_columns):
+        missing = [col for col in required_columns if col not in df.columns]
+        raise click.UsageError(f"Missing columns in {file} after processing: {missing}")
+
+    # Remove duplicates within the file based on epoch
+    return df.drop_duplicates(subset=['epoch'])
+
+def insert_p1e(db, df):
+    """Insert the rows of a normalized frame that are not in the database yet; the caller commits.
+
+    Returns the number of rows inserted.
+    """
+    if df.empty:
+        return 0
+    profiler = db.profiler
+    # Check for existing epochs in the frame's time range to avoid duplicates
+    with profiler.stage('existing_keys') as stage:
+        existing_epochs = {row.epoch for row in db.session.query(ElectricityUsage.epoch).filter(
+            ElectricityUsage.epoch >= int(df['epoch'].min()), ElectricityUsage.epoch <= int(df['epoch'].max()))}
+        stage.add_rows(len(existing_epochs))
+
+    # Filter out rows with existing epochs
+    with profiler.stage('build_rows') as stage:
+        new_rows = [
+            {'epoch': row['epoch'], 't1_kwh': row['t1_kwh'], 't2_kwh': row['t2_kwh']}
+            for _, row in df.iterrows()
+            if row['epoch'] not in existing_epochs
+        ]
+        stage.add_rows(len(df))
+
+    # Bulk insert new rows
+    if new_rows:
+        with profiler.stage('bulk_insert') as stage:
+            db.session.bulk_insert_mappings(ElectricityUsage, new_rows)
+            stage.add_rows(len(new_rows))
+        with profiler.stage('table_stats'):
+            db.record_ingest('electricity_usage', len(new_rows), [r['epoch'] for r in new_rows])
+    return len(new_rows)
 
 @click.command()
 @click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
+@profile_options
 def p1e(dburl, files):
     """
     Insert electricity usage data from P1e CSV files into the database in bulk.
@@ -20,66 +88,34 @@ def p1e(dburl, files):
         raise click.UsageError("At least one input file must be provided.")
 
     db = HomeMessagesDB(dburl)
+    profiler = db.profiler
     try:
         for file in files:
             click.echo(f"Processing {file}...")
             # Read CSV file
-            df = pd.read_csv(file)
-
-            # Check for time column
-            if 'time' not in df.columns:
-                raise click.UsageError(f"Missing 'time' column in {file}")
-
-            # Determine column names for t1_kwh and t2_kwh
-            if 'Import T1 kWh' in df.columns and 'Import T2 kWh' in df.columns:
-                df = df.rename(columns={
-                    'Import T1 kWh': 't1_kwh',
-                    'Import T2 kWh': 't2_kwh'
-                })
-            elif 'Electricity imported T1' in df.columns and 'Electricity imported T2' in df.columns:
-                df = df.rename(columns={
-                    'Electricity imported T1': 't1_kwh',
-                    'Electricity imported T2': 't2_kwh'
-                })
-            else:
-                raise click.UsageError(f"Missing electricity import columns in {file}. Expected 'Import T1 kWh'/'Import T2 kWh' or 'Electricity imported T1'/'Electricity imported T2'")
-
-            # Convert time to Unix timestamp (seconds)
-            df['epoch'] = pd.to_datetime(df['time'], utc=True).astype('int64') // 10**9
-
-            # Ensure required columns after renaming
-            required_columns = ['epoch', 't1_kwh', 't2_kwh']
-            if not all(col in df.columns for col in required_columns):
-                missing = [col for col in required_columns if col not in df.columns]
-                raise click.UsageError(f"Missing columns in {file} after processing: {missing}")
-
-            # Remove duplicates within the file based on epoch
-            df = df.drop_duplicates(subset=['epoch'])
-
-            # Check for existing epochs to avoid duplicates
-            existing_epochs = {row.epoch for row in db.session.query(ElectricityUsage.epoch).all()}
-
-            # Filter out rows with existing epochs
-            new_rows = [
-                {'epoch': row['epoch'], 't1_kwh': row['t1_kwh'], 't2_kwh': row['t2_kwh']}
-                for _, row in df.iterrows()
-                if row['epoch'] not in existing_epochs
-            ]
-
-            # Bulk insert new rows
-            if new_rows:
-                try:
-                    db.session.bulk_insert_mappings(ElectricityUsage, new_rows)
-                    db.session.commit()
-                    click.echo(f"Inserted {len(new_rows)} new rows from {file}.")
-                except SQLAlchemyError as e:
-                    db.session.rollback()
-                    click.echo(f"Database error (possible duplicate): {e}", err=True)
-                    raise
-            else:
-                click.echo(f"No new rows to insert from {file} (all duplicates).")
+            with profiler.stage('read_csv') as stage:
+                df = pd.read_csv(file)
+                stage.add_rows(len(df))
+
+            df = normalize_p1e(df, file)
+
+            try:
+                inserted = insert_p1e(db, df)
+                if inserted:
+                    with profiler.stage('commit'):
+                        db.session.commit()
+                    click.echo(f"Inserted {inserted} new rows from {file}.")
+                else:
+                    click.echo(f"No new rows to insert from {file} (all duplicates).")
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                click.echo(f"Database error (possible duplicate): {e}", err=True)
+                raise
 
             click.echo(f"Finished processing {file}. Total rows processed: {len(df)}")
+
+        # Append the new readings to the memory-mapped store, if one was built
+        db.refresh_timeseries('electricity')
     except SQLAlchemyError as e:
         db.session.rollback()
         click.echo(f"Database error: {e}", err=True)
@@ -2,10 +2,67 @@ import click
 import pandas as pd
 from home_messages_db import HomeMessagesDB, GasUsage
 from sqlalchemy.exc import SQLAlchemyError
+from instrumentation import get_profiler, profile_options
+
+def normalize_p1g(df, file):
+    """Return the epoch/gas_m3 rows of a P1g export frame, without duplicate epochs."""
+    # Check for required columns
+    if 'time' not in df.columns or 'Total gas used' not in df.columns:
+        raise click.UsageError(f"Missing required columns in {file}. Expected 'time' and 'Total gas used'")
+
+    # Rename column to match database schema
+    df = df.rename(columns={'Total gas used': 'gas_m3'})
+
+    # Convert time to Unix timestamp (seconds)
+    with get_profiler().stage('to_datetime') as stage:
+        df['epoch'] = pd.to_datetime(df['time'], format='%Y-%m-%d %H:%M', utc=True).astype('int64') // 10**9
+        stage.add_rows(len(df))
+
+    # Ensure required columns after renaming
+    required_columns = ['epoch', 'gas_m3']
+    if not all(col in df.columns for col in required_columns):
+        missing = [col for col in required_columns if col not in df.columns]
+        raise click.UsageError(f"Missing columns in {file} after processing: {missing}")
+
+    # Remove duplicates within the file based on epoch
+    return df.drop_duplicates(subset=['epoch'])
+
+def insert_p1g(db, df):
+    """Insert the rows of a normalized frame that are not in the database yet; the caller commits.
+
+    Returns the number of rows inserted.
+    """
+    if df.empty:
+        return 0
+    profiler = db.profiler
+    # Check for existing epochs in the frame's time range to avoid duplicates
+    with profiler.stage('existing_keys') as stage:
+        existing_epochs = {row.epoch for row in db.session.query(GasUsage.epoch).filter(
+            GasUsage.epoch >= int(df['epoch'].min()), GasUsage.epoch <= int(df['epoch'].max()))}
+        stage.add_rows(len(existing_epochs))
+
+    # Filter out rows with existing epochs
+    with profiler.stage('build_rows') as stage:
+        new_rows = [
+            {'epoch': row['epoch'], 'gas_m3': row['gas_m3']}
+            for _, row in df.iterrows()
+            if row['epoch'] not in existing_epochs
+        ]
+        stage.add_rows(len(df))
+
+    # Bulk insert new rows
+    if new_rows:
+        with profiler.stage('bulk_insert') as stage:
+            db.session.bulk_insert_mappings(GasUsage, new_rows)
+            stage.add_rows(len(new_rows))
+        with profiler.stage('table_stats'):
+            db.record_ingest('gas_usage', len(new_rows), [r['epoch'] for r in new_rows])
+    return len(new_rows)
 
 @click.command()
 @click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
+@profile_options
 def p1g(dburl, files):
     """
     Insert gas usage data from P1g CSV files into the database in bulk.
@@ -20,55 +77,34 @@ def p1g(dburl, files):
         raise click.UsageError("At least one input file must be provided.")
 
     db = HomeMessagesDB(dburl)
+    profiler = db.profiler
     try:
         for file in files:
             click.echo(f"Processing {file}...")
             # Read CSV file
-            df = pd.read_csv(file)
-
-            # Check for required columns
-            if 'time' not in df.columns or 'Total gas used' not in df.columns:
-                raise click.UsageError(f"Missing required columns in {file}. Expected 'time' and 'Total gas used'")
-
-            # Rename column to match database schema
-            df = df.rename(columns={'Total gas used': 'gas_m3'})
-
-            # Convert time to Unix timestamp (seconds)
-            df['epoch'] = pd.to_datetime(df['time'], format='%Y-%m-%d %H:%M', utc=True).astype('int64') // 10**9
-
-            # Ensure required columns after renaming
-            required_columns = ['epoch', 'gas_m3']
-            if not all(col in df.columns for col in required_columns):
-                missing = [col for col in required_columns if col not in df.columns]
-                raise click.UsageError(f"Missing columns in {file} after processing: {missing}")
-
-            # Remove duplicates within the file based on epoch
-            df = df.drop_duplicates(subset=['epoch'])
-
-            # Check for existing epochs to avoid duplicates
-            existing_epochs = {row.epoch for row in db.session.query(GasUsage.epoch).all()}
-
-            # Filter out rows with existing epochs
-            new_rows = [
-                {'epoch': row['epoch'], 'gas_m3': row['gas_m3']}
-                for _, row in df.iterrows()
-                if row['epoch'] not in existing_epochs
-            ]
-
-            # Bulk insert new rows
-            if new_rows:
-                try:
-                    db.session.bulk_insert_mappings(GasUsage, new_rows)
-                    db.session.commit()
-                    click.echo(f"Inserted {len(new_rows)} new rows from {file}.")
-                except SQLAlchemyError as e:
-                    db.session.rollback()
-                    click.echo(f"Database error (possible duplicate): {e}", err=True)
-                    raise
-            else:
-                click.echo(f"No new rows to insert from {file} (all duplicates).")
+            with profiler.stage('read_csv') as stage:
+                df = pd.read_csv(file)
+                stage.add_rows(len(df))
+
+            df = normalize_p1g(df, file)
+
+            try:
+                inserted = insert_p1g(db, df)
+                if inserted:
+                    with profiler.stage('commit'):
+                        db.session.commit()
+                    click.echo(f"Inserted {inserted} new rows from {file}.")
+                else:
+                    click.echo(f"No new rows to insert from {file} (all duplicates).")
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                click.echo(f"Database error (possible duplicate): {e}", err=True)
+                raise
 
             click.echo(f"Finished processing {file}. Total rows processed: {len(df)}")
+
+        # Append the new readings to the memory-mapped store, if one was built
+        db.refresh_timeseries('gas')
     except SQLAlchemyError as e:
         db.session.rollback()
         click.echo(f"Database error: {e}", err=True)
@@ -0,0 +1,221 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import click
+from sqlalchemy import text
+from home_messages_db import HomeMessagesDB
+from instrumentation import profile_options
+from report_graph import DATASETS, FIGURES, DOCUMENTS, text_page
+
+# PART-1 - Cache keys
+# Every node of the graph gets a key from its code, the versions of the tables it reads and the
+# keys of its inputs. An output is rebuilt only when its key differs from the one in the manifest.
+# Only the code of the node function itself is hashed: after changing a helper, use --force.
+
+def table_versions(db, tables):
+    """Return {table: version} from the table_stats catalog; any load, upsert or compaction changes it."""
+    versions = {row[0]: f'{row[1]}:{row[2]}:{row[3]}:{row[4]}:{row[5]}' for row in db.session.execute(text(
+        "SELECT table_name, row_count, min_epoch, max_epoch, last_ingest_epoch, version FROM table_stats")).all()}
+    for table in tables:
+        # Tables missing from the catalog (filled outside the loaders) fall back to their row count
+        if table not in versions:
+            versions[table] = f"count:{db.session.execute(text(f'SELECT COUNT(*) FROM {table}')).scalar()}"
+    return {table: versions[table] for table in tables}
+
+
+def _digest(*parts):
+    return hashlib.sha1('\x00'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def node_keys(versions):
+    """Return the keys of all datasets, figures and documents for the given table versions."""
+    keys = {}
+    for name, (tables, upstream, func) in DATASETS.items():
+        keys[name] = _digest(name, inspect.getsource(func), *[versions[t] for t in tables],
+                             *[keys[u] for u in upstream])
+    figure_keys = {name: _digest(name, inspect.getsource(draw), keys[dataset])
+                   for name, (dataset, draw) in FIGURES.items()}
+    document_keys = {name: _digest(name, title, inspect.getsource(text_fn), inspect.getsource(text_page),
+                                   *[figure_keys[f] for f in figures], *[keys[d] for d in datasets])
+                     for name, (title, figures, datasets, text_fn) in DOCUMENTS.items()}
+    return keys, figure_keys, document_keys
+
+
+def _document_datasets(name):
+    _, figures, datasets, _ = DOCUMENTS[name]
+    return list(dict.fromkeys(list(datasets) + [FIGURES[f][0] for f in figures]))
+
+
+def _with_upstream(names):
+    """Return the given datasets and everything they depend on, in graph order."""
+    needed, pending = set(), list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(DATASETS[name][1])
+    return [name for name in DATASETS if name in needed]
+
+
+# PART-2 - Rendering (worker processes)
+def _load(paths):
+    datasets = {}
+    for name, path in paths.items():
+        with open(path, 'rb') as f:
+            datasets[name] = pickle.load(f)
+    return datasets
+
+
+def _render(kind, name, path, dataset_paths):
+    """Draw one figure or document from the pickled datasets; write it next to path, then replace."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    inputs = _load(dataset_paths)
+    tmp_path = f'{path}.tmp'
+    if kind == 'figure':
+        dataset, draw = FIGURES[name]
+        fig = draw(inputs[dataset])
+        fig.savefig(tmp_path, format='png')
+        plt.close(fig)
+    else:
+        title, figures, _, text_fn = DOCUMENTS[name]
+        with PdfPages(tmp_path) as pdf:
+            for fig in [text_page(title, text_fn(inputs))] + [FIGURES[f][1](inputs[FIGURES[f][0]]) for f in figures]:
+                pdf.savefig(fig)
+                plt.close(fig)
+    os.replace(tmp_path, path)
+    return path
+
+
+# PART-3 - Command
+@click.command()
+@click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@click.option('--images-dir', default='images', show_default=True, help='Directory for the figures (PNG).')
+@click.option('--results-dir', default='analysis_results', show_default=True, help='Directory for the reports (PDF).')
+@click.option('--cache-dir', default='.report_cache', show_default=True,
+              help='Directory for the cached datasets and the manifest of built outputs.')
+@click.option('--workers', type=int, default=None, help='Worker processes for rendering (default: CPU count).')
+@click.option('--force', is_flag=True, help='Rebuild every dataset and output.')
+@click.option('--dry-run', is_flag=True, help='Only list the outputs that would be rebuilt.')
+@profile_options
+def report(dburl, images_dir, results_dir, cache_dir, workers, force, dry_run):
+    """Build the notebook figures and PDF reports headless, rebuilding only what changed.
+
+    Usage:
+        report.py -d sqlite:///smarthome.db
+        report.py -d sqlite:///smarthome.db --dry-run
+    """
+    db = HomeMessagesDB(dburl)
+
+    try:
+        with db.profiler.stage('table_versions'):
+            tables = sorted({t for tables, _, _ in DATASETS.values() for t in tables})
+            keys, figure_keys, document_keys = node_keys(table_versions(db, tables))
+
+        # Outputs whose key changed or whose file is missing
+        manifest_path = os.path.join(cache_dir, 'manifest.json')
+        manifest = {}
+        if os.path.exists(manifest_path) and not force:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        outputs = [('figure', name, os.path.join(images_dir, f'{name}.png'), figure_keys[name], [dataset])
+                   for name, (dataset, _) in FIGURES.items()]
+        outputs += [('document', name, os.path.join(results_dir, f'{name}.pdf'), document_keys[name],
+                     _document_datasets(name)) for name in DOCUMENTS]
+        stale = [output for output in outputs
+                 if manifest.get(output[2]) != output[3] or not os.path.exists(output[2])]
+        needed = _with_upstream({d for output in stale for d in output[4]})
+        cache_paths = {name: os.path.join(cache_dir, f'{name}-{keys[name][:16]}.pkl') for name in DATASETS}
+
+        if dry_run:
+            for _, _, path, _, _ in stale:
+                click.echo(f"Would rebuild {path}")
+            to_build = [name for name in needed if force or not os.path.exists(cache_paths[name])]
+            click.echo(f"{len(stale)} of {len(outputs)} outputs out of date; "
+                       f"datasets to build: {', '.join(to_build) or 'none'}")
+            return
+
+        # Build the datasets the stale outputs need, reusing cached ones (graph order). A failing
+        # dataset only fails the datasets and outputs that depend on it
+        os.makedirs(cache_dir, exist_ok=True)
+        loaded, built, failed, errors = {}, 0, set(), []
+        for name in needed:
+            if not force and os.path.exists(cache_paths[name]):
+                continue
+            tables, upstream, func = DATASETS[name]
+            if failed.intersection(upstream):
+                failed.add(name)
+                continue
+            for u in upstream:
+                if u not in loaded:
+                    loaded.update(_load({u: cache_paths[u]}))
+            try:
+                with db.profiler.stage(f'dataset_{name}') as stage:
+                    loaded[name] = func(db, {u: loaded[u] for u in upstream})
+                    if not isinstance(loaded[name], dict):
+                        stage.add_rows(len(loaded[name]))
+            except Exception as e:
+                db.session.rollback()
+                failed.add(name)
+                errors.append(f"dataset {name}: {type(e).__name__}: {e}")
+                continue
+            with open(f'{cache_paths[name]}.tmp', 'wb') as f:
+                pickle.dump(loaded[name], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f'{cache_paths[name]}.tmp', cache_paths[name])
+            built += 1
+        loaded.clear()
+        renderable = []
+        for output in stale:
+            missing = failed.intersection(output[4])
+            if missing:
+                errors.append(f"{output[2]}: dataset {', '.join(sorted(missing))} failed")
+            else:
+                renderable.append(output)
+
+        # Render the stale outputs in parallel; the manifest keeps every output that succeeded
+        for directory in (images_dir, results_dir):
+            os.makedirs(directory, exist_ok=True)
+        rendered = 0
+        try:
+            with db.profiler.stage('render') as stage, ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+                futures = {pool.submit(_render, kind, name, path, {d: cache_paths[d] for d in datasets}): (path, key)
+                           for kind, name, path, key, datasets in renderable}
+                for future in as_completed(futures):
+                    path, key = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(f"{path}: {e}")
+                        continue
+                    manifest[path] = key
+                    rendered += 1
+                    click.echo(f"Rendered {path}")
+                stage.add_rows(rendered)
+        finally:
+            with open(f'{manifest_path}.tmp', 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(f'{manifest_path}.tmp', manifest_path)
+
+        # Drop cached datasets of older table versions
+        current = {os.path.basename(path) for path in cache_paths.values()}
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.pkl') and filename not in current:
+                os.remove(os.path.join(cache_dir, filename))
+
+        click.echo(f"{rendered} outputs rendered, {len(outputs) - len(stale)} up to date; "
+                   f"{built} datasets built, {len(needed) - built - len(failed)} from cache.")
+        if errors:
+            raise click.ClickException("Failed to build:\n" + '\n'.join(errors))
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,389 @@
+"""The analysis report as a dependency graph: datasets, figures and documents (see report.py).
+
+These are the analyses of the notebooks in notebooks/, run headless:
+- DATASETS: name -> (tables read, upstream datasets, function(db, inputs) -> data). Only
+  datasets that read tables touch the database; the others combine upstream datasets.
+- FIGURES: name -> (dataset, function(data) -> matplotlib Figure), saved as images/<name>.png.
+- DOCUMENTS: name -> (title, figures, datasets, function(inputs) -> text lines), saved as
+  analysis_results/<name>.pdf: a page of findings followed by the figures.
+
+Figures and documents only get their input datasets, so they can be drawn in worker
+processes. matplotlib is imported there, with the Agg backend.
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from compaction import RUN_EVENTS_SQL
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Gaps in switch/motion activity longer than this (seconds) count as nobody at home
+UNOCCUPIED_GAP = 3600
+
+
+# PART-1 - Datasets
+def _meter_deltas(db, source):
+    """Usage deltas of a meter (<register>_diff columns) from the time-series store, without resets."""
+    series = db.timeseries(source)
+    df = pd.DataFrame({'epoch': np.asarray(series.epochs),
+                       **{f'{col}_diff': series.delta(col) for col in series.columns}})
+    return df[(df.drop(columns='epoch') >= 0).all(axis=1)].reset_index(drop=True)
+
+
+def electricity_deltas(db, inputs):
+    return _meter_deltas(db, 'electricity')
+
+
+def gas_deltas(db, inputs):
+    return _meter_deltas(db, 'gas')
+
+
+def weather(db, inputs):
+    rows = db.session.execute(text("SELECT epoch, temperature FROM weather ORDER BY epoch")).all()
+    # Explicit dtypes: an empty table would give object columns, which merge_asof rejects
+    return pd.DataFrame(rows, columns=['epoch', 'temperature']).astype({'epoch': 'int64', 'temperature': 'float64'})
+
+
+def smartthings_events(db, inputs):
+    """SmartThings messages plus the first/last message of compacted runs, by epoch.
+
+    n_messages is 1 for stored messages; the two rows of a run share its message count, so
+    sums of n_messages per hour are exact. Epochs between them are not known.
+    """
+    rows = db.session.execute(text(
+        "SELECT epoch, device_id, capability, value, n_messages FROM ("
+        " SELECT epoch, device_id, capability, value, 1 AS n_messages FROM smartthings_messages"
+        f" UNION ALL SELECT epoch, device_id, capability, value, n_messages FROM ({RUN_EVENTS_SQL})"
+        ") ORDER BY epoch"
+    )).all()
+    return pd.DataFrame(rows, columns=['epoch', 'device_id', 'capability', 'value', 'n_messages']).astype(
+        {'epoch': 'int64', 'device_id': 'int64', 'capability': object, 'value': object, 'n_messages': 'int64'})
+
+
+def hourly_usage(db, inputs):
+    from analyze_usage import hourly_usage as usage_per_hour
+    return usage_per_hour(db, 'sql')
+
+
+def unoccupied_intervals(db, inputs):
+    """Gaps longer than UNOCCUPIED_GAP between switch/motion events (analyze_occupancy.py)."""
+    events = inputs['smartthings_events']
+    activity = events[events['capability'].isin(['switch', 'motionSensor'])].sort_values('epoch')
+    gaps = pd.DataFrame({'start_epoch': activity['epoch'].to_numpy(),
+                         'end_epoch': activity['epoch'].shift(-1).to_numpy()})
+    gaps['gap'] = gaps['end_epoch'] - gaps['start_epoch']
+    return gaps[gaps['gap'] > UNOCCUPIED_GAP].reset_index(drop=True)
+
+
+def weekly_usage(db, inputs):
+    """Mean usage per reading by UTC day of the week, and an ANOVA of T1 across the days."""
+    from scipy import stats
+    electricity, gas = inputs['electricity_deltas'].copy(), inputs['gas_deltas'].copy()
+    for df in (electricity, gas):
+        df['day_of_week'] = pd.to_datetime(df['epoch'], unit='s', utc=True).dt.day_name()
+    weekly = pd.concat([electricity.groupby('day_of_week')[['t1_kwh_diff', 't2_kwh_diff']].mean(),
+                        gas.groupby('day_of_week')[['gas_m3_diff']].mean()], axis=1).reindex(DAYS)
+    samples = [electricity.loc[electricity['day_of_week'] == day, 't1_kwh_diff'].to_numpy() for day in DAYS]
+    samples = [s for s in samples if len(s)]
+    anova = tuple(stats.f_oneway(*samples)) if len(samples) > 1 else (np.nan, np.nan)
+    return {'weekly': weekly, 'anova': anova}
+
+
+def daily_weather_usage(db, inputs):
+    """Mean daily temperature next to the daily electricity and gas usage (UTC days)."""
+    def by_date(df, agg):
+        dates = pd.to_datetime(df['epoch'], unit='s', utc=True).dt.date
+        return df.drop(columns='epoch').groupby(dates.rename('date')).agg(agg)
+
+    daily = by_date(inputs['weather'], {'temperature': 'mean'}).join(
+        by_date(inputs['electricity_deltas'], {'t1_kwh_diff': 'sum', 't2_kwh_diff': 'sum'}), how='inner').join(
+        by_date(inputs['gas_deltas'], {'gas_m3_diff': 'sum'}), how='inner').reset_index()
+    correlation = daily['temperature'].corr(daily['gas_m3_diff']) if len(daily) > 1 else np.nan
+    return {'daily': daily, 'correlation': correlation}
+
+
+def temperature_drop(db, inputs):
+    """Temperature drop rate while no gas is used, regressed on the previous temperature."""
+    from scipy.stats import linregress
+    gas = inputs['gas_deltas']
+    df = pd.merge_asof(inputs['weather'].rename(columns={'temperature': 'indoor_temp'}),
+                       gas[['epoch', 'gas_m3_diff']], on='epoch', direction='nearest')
+    df['heating_off'] = df['gas_m3_diff'] == 0
+    df['temp_diff'] = df['indoor_temp'].diff().fillna(0)
+    df['time_diff'] = df['epoch'].diff().fillna(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['drop_rate'] = df['temp_diff'] / (df['time_diff'] / 3600)  # degrees per hour
+    drops = df[df['heating_off'] & (df['time_diff'] > 0) & (df['drop_rate'] < 0)].copy()
+    # The notebook approximates the outside temperature by the previous reading
+    drops['outside_temp'] = drops['indoor_temp'].shift(1)
+    drops = drops.dropna(subset=['outside_temp'])
+    regression = None
+    if len(drops) > 2 and drops['outside_temp'].nunique() > 1:
+        fit = linregress(drops['outside_temp'], drops['drop_rate'])
+        regression = (fit.slope, fit.intercept, fit.rvalue, fit.pvalue)
+    return {'drops': drops[['epoch', 'outside_temp', 'drop_rate']], 'regression': regression}
+
+
+def light_usage(db, inputs):
+    """Hours per day that switches are on, against an approximate day length for Noordwijk."""
+    from scipy.stats import pearsonr
+    events = inputs['smartthings_events']
+    light = events[events['capability'] == 'switch'][['epoch', 'value']].sort_values('epoch').copy()
+    light['date'] = pd.to_datetime(light['epoch'], unit='s', utc=True).dt.date
+    light['state'] = light['value'].map({'on': 1, 'off': 0}).fillna(0)
+    light['duration'] = (light['epoch'].shift(-1) - light['epoch']).fillna(0) / 3600
+    daily = light[light['state'] == 1].groupby('date')['duration'].sum().reset_index()
+
+    # Day length approximation (latitude ~52.2 N)
+    day_of_year = pd.to_datetime(daily['date']).dt.dayofyear
+    daily['day_length'] = 12 + 2.4 * np.sin(2 * np.pi * (day_of_year - 81) / 365)
+    pearson = tuple(pearsonr(daily['day_length'], daily['duration'])) if len(daily) > 2 else None
+    return {'daily': daily, 'pearson': pearson}
+
+
+def device_anomalies(db, inputs):
+    """Numeric SmartThings readings after an unusual gap (z-score > 3 or over 2 hours).
+
+    Reads compacted history as first/last messages, so gaps inside a run can be reported.
+    """
+    df = inputs['smartthings_events'].copy()
+    df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    df = df.dropna(subset=['value']).sort_values('epoch')
+    groups = df.groupby(['device_id', 'capability'])
+    df['time_diff'] = groups['epoch'].diff().fillna(0)
+    z_score = groups['time_diff'].transform(lambda x: (x - x.mean()) / x.std()).fillna(0)
+    return df[(z_score.abs() > 3) | (df['time_diff'] > 7200)].reset_index(drop=True)
+
+
+def temperature_comparison(db, inputs):
+    """Measured against 'predicted' temperature; the notebook's proxy is the previous reading."""
+    from scipy.stats import ttest_rel
+    df = inputs['weather'].dropna(subset=['temperature']).rename(columns={'temperature': 'measured_temp'})
+    df['predicted_temp'] = df['measured_temp'].shift(1).bfill()
+    ttest = tuple(ttest_rel(df['measured_temp'], df['predicted_temp'])) if len(df) > 1 else (np.nan, np.nan)
+    return {'temperatures': df, 'ttest': ttest,
+            'mean_difference': (df['measured_temp'] - df['predicted_temp']).mean()}
+
+
+# Upstream datasets are listed before the datasets that use them
+DATASETS = {
+    'electricity_deltas': (['electricity_usage'], [], electricity_deltas),
+    'gas_deltas': (['gas_usage'], [], gas_deltas),
+    'weather': (['weather'], [], weather),
+    'smartthings_events': (['smartthings_messages', 'smartthings_runs'], [], smartthings_events),
+    'hourly_usage': (['electricity_usage', 'gas_usage'], [], hourly_usage),
+    'unoccupied_intervals': ([], ['smartthings_events'], unoccupied_intervals),
+    'weekly_usage': ([], ['electricity_deltas', 'gas_deltas'], weekly_usage),
+    'daily_weather_usage': ([], ['weather', 'electricity_deltas', 'gas_deltas'], daily_weather_usage),
+    'temperature_drop': ([], ['weather', 'gas_deltas'], temperature_drop),
+    'light_usage': ([], ['smartthings_events'], light_usage),
+    'device_anomalies': ([], ['smartthings_events'], device_anomalies),
+    'temperature_comparison': ([], ['weather'], temperature_comparison),
+}
+
+
+# PART-2 - Figures
+def _figure(size=(10, 6)):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=size)
+    ax.grid(True)
+    return fig, ax
+
+
+def _no_data(ax):
+    ax.text(0.5, 0.5, 'No data available', ha='center', va='center', transform=ax.transAxes)
+
+
+def plot_hourly_usage(df):
+    fig, ax = _figure()
+    for col, label in [('t1_kwh', 'T1 Electricity (kWh)'), ('t2_kwh', 'T2 Electricity (kWh)'), ('gas_m3', 'Gas (m³)')]:
+        if col in df:
+            ax.plot(df['hour'], df[col], label=label, marker='o')
+    ax.set(xlabel='Hour of Day', ylabel='Average Usage', title='Hourly Usage Distribution (Electricity and Gas)')
+    ax.legend()
+    return fig
+
+
+def plot_weekly_usage(data):
+    fig, ax = _figure()
+    weekly = data['weekly']
+    for col, label in [('t1_kwh_diff', 'T1 Electricity (kWh)'), ('t2_kwh_diff', 'T2 Electricity (kWh)'),
+                       ('gas_m3_diff', 'Gas (m³)')]:
+        ax.plot(weekly.index, weekly[col], label=label, marker='o')
+    ax.set(xlabel='Day of Week', ylabel='Average Usage per Reading', title='Weekly Patterns in Energy and Gas Usage')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def plot_temperature_gas(data):
+    fig, ax = _figure()
+    daily = data['daily']
+    ax.scatter(daily['temperature'], daily['gas_m3_diff'], alpha=0.5)
+    ax.set(xlabel='Average Daily Temperature (°C)', ylabel='Daily Gas Usage (m³)',
+           title='Correlation Between Temperature and Gas Usage')
+    return fig
+
+
+def plot_temperature_drop(data):
+    fig, ax = _figure()
+    drops = data['drops']
+    ax.scatter(drops['outside_temp'], drops['drop_rate'], alpha=0.5)
+    ax.set(xlabel='Outside Temperature (°C)', ylabel='Temperature Drop Rate (°C/hour)',
+           title='Temperature Drop Rate vs. Outside Temperature')
+    return fig
+
+
+def plot_temperature_drop_regression(data):
+    fig = plot_temperature_drop(data)
+    ax = fig.axes[0]
+    if data['regression'] is not None:
+        slope, intercept = data['regression'][:2]
+        x = np.sort(data['drops']['outside_temp'].to_numpy())
+        ax.plot(x, intercept + slope * x, color='red', label='Regression Line')
+        ax.legend()
+    ax.set_title('Temperature Drop Rate vs. Outside Temperature with Regression Line')
+    return fig
+
+
+def plot_light_usage(data):
+    fig, ax = _figure()
+    daily = data['daily']
+    ax.scatter(daily['day_length'], daily['duration'], alpha=0.5)
+    if daily.empty:
+        _no_data(ax)
+    ax.set(xlabel='Day Length (Hours)', ylabel='Daily Light On-Time (Hours)', title='Light On-Time vs. Day Length')
+    return fig
+
+
+def plot_device_anomalies(anomalies):
+    fig, ax = _figure()
+    if anomalies.empty:
+        _no_data(ax)
+        ax.set_title('No Data to Plot')
+        return fig
+    device_id = anomalies['device_id'].iloc[0]
+    sample = anomalies[anomalies['device_id'] == device_id]
+    ax.scatter(pd.to_datetime(sample['epoch'], unit='s', utc=True), sample['value'], c='red', label='Anomaly')
+    ax.set(xlabel='Time', ylabel='Value', title=f'Anomalies for Device {device_id}')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def plot_temperature_comparison(data):
+    fig, ax = _figure(size=(12, 6))
+    df = data['temperatures']
+    times = pd.to_datetime(df['epoch'], unit='s', utc=True)
+    ax.plot(times, df['measured_temp'], label='Measured Temp (°C)', alpha=0.5)
+    ax.plot(times, df['predicted_temp'], label='Predicted Temp (°C)', alpha=0.5)
+    ax.set(xlabel='Time', ylabel='Temperature (°C)', title='Measured vs. Predicted Temperature')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def plot_unoccupied_intervals(gaps):
+    fig, ax = _figure()
+    ax.hist(gaps['gap'] / 3600, bins=50, edgecolor='black')
+    ax.set(xlabel='Gap Duration (Hours)', ylabel='Frequency', title='Distribution of Unoccupied Intervals')
+    return fig
+
+
+FIGURES = {
+    'hourly_usage_plot': ('hourly_usage', plot_hourly_usage),
+    'weekly_usage_patterns': ('weekly_usage', plot_weekly_usage),
+    'temperature_gas_correlation': ('daily_weather_usage', plot_temperature_gas),
+    'temperature_drop_rate': ('temperature_drop', plot_temperature_drop),
+    'temperature_drop_rate_with_regression': ('temperature_drop', plot_temperature_drop_regression),
+    'light_on_time_vs_day_length': ('light_usage', plot_light_usage),
+    'device_anomalies': ('device_anomalies', plot_device_anomalies),
+    'measured_vs_predicted_temp': ('temperature_comparison', plot_temperature_comparison),
+    'unoccupied_intervals_histogram': ('unoccupied_intervals', plot_unoccupied_intervals),
+}
+
+
+# PART-3 - Documents
+def occupancy_text(inputs):
+    gaps = inputs['unoccupied_intervals']['gap']
+    if gaps.empty:
+        return ["No gaps in switch/motion activity longer than one hour."]
+    return [f"Intervals without switch/motion activity for over one hour: {len(gaps)}",
+            f"Shortest {gaps.min() / 3600:.2f} h, median {gaps.median() / 3600:.2f} h, "
+            f"longest {gaps.max() / 3600:.2f} h."]
+
+
+def usage_distribution_text(inputs):
+    df = inputs['hourly_usage']
+    lines = []
+    for col, label in [('t1_kwh', 'T1 electricity'), ('t2_kwh', 'T2 electricity'), ('gas_m3', 'Gas')]:
+        if col in df and df[col].notna().any():
+            peak, low = df.loc[df[col].idxmax()], df.loc[df[col].idxmin()]
+            lines.append(f"{label}: peak at hour {int(peak['hour'])} ({peak[col]:.4f}), "
+                         f"lowest at hour {int(low['hour'])} ({low[col]:.4f}).")
+    return lines or ["No meter readings."]
+
+
+def weekly_patterns_text(inputs):
+    f_statistic, p_value = inputs['weekly_usage']['anova']
+    return [f"ANOVA test for T1 electricity across days: F-statistic = {f_statistic:.2f}, p-value = {p_value:.4f}",
+            ("Significant differences between the days of the week (p < 0.05)." if p_value < 0.05
+             else "No significant differences between the days of the week.")]
+
+
+def weather_correlation_text(inputs):
+    data = inputs['daily_weather_usage']
+    return [f"Days with weather and usage: {len(data['daily'])}",
+            f"Correlation between daily temperature and gas usage: {data['correlation']:.2f}"]
+
+
+def summary_text(inputs):
+    drop, light = inputs['temperature_drop']['regression'], inputs['light_usage']['pearson']
+    comparison = inputs['temperature_comparison']
+    lines = ["1. Unoccupied intervals"] + occupancy_text(inputs)
+    lines += ["", "2. Daily usage distribution"] + usage_distribution_text(inputs)
+    lines += ["", "3. Weekly patterns"] + weekly_patterns_text(inputs)
+    lines += ["", "4. Temperature drop with the heating off",
+              (f"Drop rate = {drop[0]:.4f} * outside temp + {drop[1]:.4f}, R-squared {drop[2] ** 2:.4f}, "
+               f"p-value {drop[3]:.4f}" if drop is not None else "Not enough data for a regression.")]
+    lines += ["", "5. Light on-time and day length",
+              (f"Pearson correlation {light[0]:.4f}, p-value {light[1]:.4f}" if light is not None
+               else "Not enough switch data for a correlation.")]
+    lines += ["", "6. Device anomalies", f"Readings after an unusual gap: {len(inputs['device_anomalies'])}"]
+    lines += ["", "7. Measured vs. predicted temperature",
+              f"Mean difference {comparison['mean_difference']:.2f} °C, paired t-test "
+              f"t = {comparison['ttest'][0]:.4f}, p-value = {comparison['ttest'][1]:.4f}"]
+    lines += ["", "Weather and gas"] + weather_correlation_text(inputs)
+    return lines
+
+
+DOCUMENTS = {
+    'occupancy_analysis': ('Occupancy Analysis Report', ['unoccupied_intervals_histogram'],
+                           ['unoccupied_intervals'], occupancy_text),
+    'usage_distribution': ('Hourly Usage Distribution Report', ['hourly_usage_plot'],
+                           ['hourly_usage'], usage_distribution_text),
+    'weekly_patterns': ('Weekly Patterns in Energy and Gas Usage Report', ['weekly_usage_patterns'],
+                        ['weekly_usage'], weekly_patterns_text),
+    'weather_correlation': ('Weather and Energy Usage Correlation Report', ['temperature_gas_correlation'],
+                            ['daily_weather_usage'], weather_correlation_text),
+    'summary': ('Smart Home Energy Analysis Summary Report',
+                ['unoccupied_intervals_histogram', 'hourly_usage_plot', 'weekly_usage_patterns',
+                 'temperature_drop_rate_with_regression', 'light_on_time_vs_day_length', 'device_anomalies',
+                 'measured_vs_predicted_temp', 'temperature_gas_correlation'],
+                ['unoccupied_intervals', 'hourly_usage', 'weekly_usage', 'temperature_drop', 'light_usage',
+                 'device_anomalies', 'temperature_comparison', 'daily_weather_usage'], summary_text),
+}
+
+
+def text_page(title, lines):
+    """Return an A4 figure with a title and lines of text."""
+    fig, ax = _figure(size=(8.27, 11.69))
+    ax.axis('off')
+    fig.text(0.08, 0.95, title, fontsize=16, weight='bold', va='top')
+    fig.text(0.08, 0.90, '\n'.join(lines), fontsize=10, va='top', wrap=True)
+    return fig
@@ -0,0 +1,37 @@
+"""Schema version of the project database.
+
+HomeMessagesDB and db_manager.py only run create_all when the version stored in the
+schema_version table is older than SCHEMA_VERSION, so opening a current database costs one
+small query. This module has no heavy imports, so the check is cheap for every command
+(db_manager.py reads it without loading SQLAlchemy).
+"""
+import time
+
+# Bump whenever a model in home_messages_db.py is added or changed (new columns also go in ADDED_COLUMNS)
+SCHEMA_VERSION = 6
+
+# Data tables tracked in table_stats
+STATS_TABLES = ['electricity_usage', 'gas_usage', 'weather', 'smartthings_messages', 'smartthings_runs', 'devices']
+
+
+def read_schema_version(execute):
+    """Return the schema version stored in the database, or None (new or pre-versioning database).
+
+    execute(sql) runs a statement on a DB-API or SQLAlchemy connection.
+    """
+    try:
+        return execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    except Exception:  # no schema_version table yet; the error type depends on the driver
+        return None
+
+
+def schema_is_current(execute):
+    version = read_schema_version(execute)
+    return version is not None and version >= SCHEMA_VERSION
+
+
+def record_schema_version(execute):
+    """Mark the database as created with SCHEMA_VERSION; the caller commits."""
+    execute(f"INSERT INTO schema_version (version, applied_epoch) "
+            f"SELECT {SCHEMA_VERSION}, {int(time.time())} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM schema_version WHERE version = {SCHEMA_VERSION})")
@@ -0,0 +1,60 @@
+import importlib
+import click
+
+# Subcommands: name -> (module, click command, short help). A module is imported only when its
+# subcommand runs, so e.g. `smarthome db list-tables` never loads pandas or the analyses.
+SUBCOMMANDS = {
+    'create-db': ('create_db', 'create_db', 'Create the database with all tables.'),
+    'p1e': ('p1e', 'p1e', 'Load P1e electricity CSVs.'),
+    'p1g': ('p1g', 'p1g', 'Load P1g gas CSVs.'),
+    'smartthings': ('smartthings', 'smartthings', 'Load SmartThings TSVs.'),
+    'openweather': ('openweather', 'openweather', 'Fetch the missing hourly weather.'),
+    'watch': ('watch', 'watch', 'Follow growing exports and ingest appended lines.'),
+    'compact': ('compact', 'compact', 'Fold old SmartThings messages into runs.'),
+    'db': ('db_manager', 'cli', 'Bulk insert, tables, statistics and gaps (db_manager).'),
+    'build-features': ('build_features', 'build_features', 'Build the hourly feature tables.'),
+    'analyze-usage': ('analyze_usage', 'analyze_usage', 'Usage per local hour of the day.'),
+    'analyze-occupancy': ('analyze_occupancy', 'analyze_occupancy', 'Find periods when nobody is at home.'),
+    'report': ('report', 'report', 'Build the figures and PDF reports that changed.'),
+    'stats': ('stats_runner', 'stats_runner', 'Run hypothesis tests per group.'),
+    'synthetic-data': ('synthetic_data', 'synthetic_data', 'Generate synthetic exports.'),
+    'benchmark': ('benchmark', 'benchmark', 'Time ingestion, queries, analyses and startup.'),
+}
+
+
+class LazyGroup(click.Group):
+    """Click group that imports the module of a subcommand only when it is invoked."""
+
+    def list_commands(self, ctx):
+        return list(SUBCOMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in SUBCOMMANDS:
+            return None
+        module_name, command_name, _ = SUBCOMMANDS[name]
+        command = getattr(importlib.import_module(module_name), command_name)
+        # Usage lines show the subcommand name, not the function name of the script
+        command.name = name
+        return command
+
+    def format_commands(self, ctx, formatter):
+        # The short help comes from SUBCOMMANDS, so --help imports nothing
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, short_help) for name, (_, _, short_help) in SUBCOMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+def smarthome():
+    """Smart home energy analytics: loaders, analyses and database tools in one CLI.
+
+    Every subcommand takes the same options as its script, e.g.
+
+    \b
+        smarthome.py p1e -d sqlite:///smarthome.db data/P1e/*.csv
+        smarthome.py db --db smarthome.db list-tables
+        smarthome.py analyze-usage -d sqlite:///smarthome.db
+    """
+
+
+if __name__ == "__main__":
+    smarthome()
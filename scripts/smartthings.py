@@ -1,11 +1,103 @@
 import click
 import pandas as pd
-from home_messages_db import HomeMessagesDB, Device, SmartThingsMessage
+from home_messages_db import HomeMessagesDB, SmartThingsMessage
 from sqlalchemy.exc import SQLAlchemyError
+from compaction import inside_runs
+from instrumentation import get_profiler, profile_options
+
+def normalize_smartthings(df, file):
+    """Return the messages of a SmartThings export frame with integer epochs, without duplicates."""
+    # Ensure required columns
+    required_columns = ['loc', 'level', 'name', 'epoch', 'capability', 'attribute', 'value', 'unit']
+    if not all(col in df.columns for col in required_columns):
+        missing = [col for col in required_columns if col not in df.columns]
+        raise click.UsageError(f"Missing columns in {file}: {missing}")
+
+    # Convert epoch (ISO 8601) to Unix timestamp (seconds)
+    with get_profiler().stage('to_datetime') as stage:
+        df['epoch'] = pd.to_datetime(df['epoch'], utc=True).astype('int64') // 10**9
+        stage.add_rows(len(df))
+
+    # Remove duplicates within the file
+    return df.drop_duplicates(subset=['name', 'epoch', 'capability', 'attribute'])
+
+def insert_smartthings(db, df):
+    """Insert the devices and the new messages of a normalized frame; the caller commits.
+
+    Returns the number of messages inserted.
+    """
+    if df.empty:
+        return 0
+    profiler = db.profiler
+    # Insert or get devices
+    devices = df[['name', 'loc', 'level']].drop_duplicates()
+    device_map = {}
+    with profiler.stage('devices') as stage:
+        for _, device in devices.iterrows():
+            device_id = db.insert_device(device['name'], device['loc'], device['level'], commit=False)
+            device_map[device['name']] = device_id
+        stage.add_rows(len(devices))
+
+    # Prepare messages
+    messages = df.merge(
+        pd.Series(device_map, name='device_id'),
+        left_on='name',
+        right_index=True
+    )
+
+    # Skip messages that are already part of compacted history (values compare as stored)
+    messages['value'] = messages['value'].astype(str)
+    with profiler.stage('compacted_runs') as stage:
+        compacted = inside_runs(db, messages)
+        messages = messages[~compacted]
+        stage.add_rows(int(compacted.sum()))
+
+    # Check for existing messages of these devices in the frame's time range to avoid duplicates
+    with profiler.stage('existing_keys') as stage:
+        existing = db.session.query(
+            SmartThingsMessage.device_id,
+            SmartThingsMessage.epoch,
+            SmartThingsMessage.capability,
+            SmartThingsMessage.attribute
+        ).filter(
+            SmartThingsMessage.device_id.in_(list(device_map.values())),
+            SmartThingsMessage.epoch >= int(df['epoch'].min()),
+            SmartThingsMessage.epoch <= int(df['epoch'].max())
+        ).all()
+        existing_set = set((row.device_id, row.epoch, row.capability, row.attribute) for row in existing)
+        stage.add_rows(len(existing_set))
+
+    # Filter out duplicates
+    with profiler.stage('build_rows') as stage:
+        new_messages = [
+            {
+                'device_id': row['device_id'],
+                'epoch': row['epoch'],
+                'capability': row['capability'],
+                'attribute': row['attribute'],
+                'value': str(row['value']),
+                'unit': str(row['unit'])
+            }
+            for _, row in messages.iterrows()
+            if (row['device_id'], row['epoch'], row['capability'], row['attribute']) not in existing_set
+        ]
+        stage.add_rows(len(messages))
+
+    # Bulk insert new messages
+    if new_messages:
+        with profiler.stage('bulk_insert') as stage:
+            db.session.bulk_insert_mappings(SmartThingsMessage, new_messages)
+            stage.add_rows(len(new_messages))
+        with profiler.stage('table_stats'):
+            db.record_ingest('smartthings_messages', len(new_messages),
+                             [r['epoch'] for r in new_messages],
+                             [(r['device_id'], r['capability']) for r in new_messages])
+    return len(new_messages)
 
 @click.command()
 @click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
+@profile_options
 def smartthings(dburl, files):
     """
     Insert SmartThings data into the database in bulk.
@@ -20,73 +112,29 @@ def smartthings(dburl, files):
         raise click.UsageError("At least one input file must be provided.")
 
     db = HomeMessagesDB(dburl)
+    profiler = db.profiler
     try:
         for file in files:
             click.echo(f"Processing {file}...")
             # Read TSV file
-            df = pd.read_csv(file, sep='\t')
-
-            # Ensure required columns
-            required_columns = ['loc', 'level', 'name', 'epoch', 'capability', 'attribute', 'value', 'unit']
-            if not all(col in df.columns for col in required_columns):
-                missing = [col for col in required_columns if col not in df.columns]
-                raise click.UsageError(f"Missing columns in {file}: {missing}")
-
-            # Convert epoch (ISO 8601) to Unix timestamp (seconds)
-            df['epoch'] = pd.to_datetime(df['epoch'], utc=True).astype('int64') // 10**9
-
-            # Remove duplicates within the file
-            df = df.drop_duplicates(subset=['name', 'epoch', 'capability', 'attribute'])
-
-            # Insert or get devices
-            devices = df[['name', 'loc', 'level']].drop_duplicates()
-            device_map = {}
-            for _, device in devices.iterrows():
-                device_id = db.insert_device(device['name'], device['loc'], device['level'])
-                device_map[device['name']] = device_id
-
-            # Prepare messages
-            messages = df.merge(
-                pd.Series(device_map, name='device_id'),
-                left_on='name',
-                right_index=True
-            )
-
-            # Check for existing messages to avoid duplicates
-            existing = db.session.query(
-                SmartThingsMessage.device_id,
-                SmartThingsMessage.epoch,
-                SmartThingsMessage.capability,
-                SmartThingsMessage.attribute
-            ).all()
-            existing_set = set((row.device_id, row.epoch, row.capability, row.attribute) for row in existing)
-
-            # Filter out duplicates
-            new_messages = [
-                {
-                    'device_id': row['device_id'],
-                    'epoch': row['epoch'],
-                    'capability': row['capability'],
-                    'attribute': row['attribute'],
-                    'value': str(row['value']),
-                    'unit': str(row['unit'])
-                }
-                for _, row in messages.iterrows()
-                if (row['device_id'], row['epoch'], row['capability'], row['attribute']) not in existing_set
-            ]
-
-            # Bulk insert new messages
-            if new_messages:
-                try:
-                    db.session.bulk_insert_mappings(SmartThingsMessage, new_messages)
-                    db.session.commit()
-                    click.echo(f"Inserted {len(new_messages)} new rows from {file}.")
-                except SQLAlchemyError as e:
-                    db.session.rollback()
-                    click.echo(f"Database error (possible duplicate): {e}", err=True)
-                    raise
-            else:
-                click.echo(f"No new rows to insert from {file} (all duplicates).")
+            with profiler.stage('read_csv') as stage:
+                df = pd.read_csv(file, sep='\t')
+                stage.add_rows(len(df))
+
+            df = normalize_smartthings(df, file)
+
+            try:
+                inserted = insert_smartthings(db, df)
+                if inserted:
+                    with profiler.stage('commit'):
+                        db.session.commit()
+                    click.echo(f"Inserted {inserted} new rows from {file}.")
+                else:
+                    click.echo(f"No new rows to insert from {file} (all duplicates).")
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                click.echo(f"Database error (possible duplicate): {e}", err=True)
+                raise
 
             click.echo(f"Finished processing {file}. Total rows processed: {len(df)}")
     except SQLAlchemyError as e:
@@ -0,0 +1,274 @@
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from compaction import RUN_EVENTS_SQL
+from home_messages_db import HomeMessagesDB, StatsResult
+from instrumentation import profile_options
+
+# PART-1 - Test specs
+# Every test gets the rows of one group as a 2D float64 array (columns as in the spec) and
+# returns (statistic, p_value, effect). The effect is what the bootstrap CI is computed for.
+# scipy is imported inside the tests, so the CLI starts without it.
+
+def _anova(data):
+    """One-way ANOVA of column 0 across the levels of column 1; effect is eta squared."""
+    from scipy import stats
+    values, factor = data[:, 0], data[:, 1]
+    samples = [values[factor == level] for level in np.unique(factor)]
+    samples = [s for s in samples if len(s) > 0]
+    f_stat, p_value = stats.f_oneway(*samples)
+    total = ((values - values.mean()) ** 2).sum()
+    between = sum(len(s) * (s.mean() - values.mean()) ** 2 for s in samples)
+    return f_stat, p_value, (between / total if total > 0 else np.nan)
+
+
+def _pearson(data):
+    """Pearson correlation of column 0 and column 1; effect is r."""
+    from scipy import stats
+    r, p_value = stats.pearsonr(data[:, 0], data[:, 1])
+    return r, p_value, r
+
+
+def _ttest_rel(data):
+    """Paired t-test of column 0 against column 1; effect is the mean difference."""
+    from scipy import stats
+    t_stat, p_value = stats.ttest_rel(data[:, 0], data[:, 1])
+    return t_stat, p_value, (data[:, 0] - data[:, 1]).mean()
+
+
+# name -> (test, number of input columns, minimum rows)
+TESTS = {
+    'anova': (_anova, 2, 3),
+    'pearson': (_pearson, 2, 3),
+    'ttest_rel': (_ttest_rel, 2, 2),
+}
+
+# PART-2 - Worker side
+# Workers attach to the shared input array once, then only receive (start, stop) slices.
+_shared = {}
+
+
+def _attach(shm_name):
+    """Attach to the parent's shared memory without registering it with the resource tracker.
+
+    Before Python 3.13 attaching registers the segment again, so the tracker warns about a
+    leak or unlinks it early. Unregistering afterwards is no fix: the tracker is shared with
+    the parent, which would lose its own registration.
+    """
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:  # Python < 3.13
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=shm_name)
+    finally:
+        resource_tracker.register = register
+
+
+def _init_worker(shm_name, shape, test, n_boot, alpha):
+    shm = _attach(shm_name)
+    _shared['shm'] = shm
+    _shared['data'] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _shared['spec'] = (test, n_boot, alpha)
+
+
+def _run_group(task):
+    """Run the configured test (and bootstrap) on one group's rows."""
+    key, start, stop, seed = task
+    test, n_boot, alpha = _shared['spec']
+    func, _, min_rows = TESTS[test]
+    data = _shared['data'][start:stop]
+    data = data[~np.isnan(data).any(axis=1)]
+    result = {'group_key': key, 'n': len(data), 'statistic': np.nan, 'p_value': np.nan,
+              'effect': np.nan, 'ci_low': np.nan, 'ci_high': np.nan}
+    if len(data) < min_rows:
+        return result
+
+    try:
+        with np.errstate(all='ignore'):
+            result['statistic'], result['p_value'], result['effect'] = func(data)
+            if n_boot:
+                rng = np.random.default_rng(seed)
+                effects = np.array([func(data[rng.integers(0, len(data), len(data))])[2]
+                                    for _ in range(n_boot)])
+                effects = effects[~np.isnan(effects)]
+                if len(effects):
+                    result['ci_low'], result['ci_high'] = np.quantile(
+                        effects, [alpha / 2, 1 - alpha / 2])
+    except (ValueError, ZeroDivisionError):
+        # Degenerate group (e.g. constant input or a single factor level)
+        pass
+    return {k: (float(v) if k not in ('group_key', 'n') else v) for k, v in result.items()}
+
+
+# PART-3 - Runner
+def run_grouped_test(df, test, columns, by, n_boot=1000, alpha=0.05, workers=None, seed=0):
+    """Run a test for every group of df in a process pool and return the results.
+
+    columns are the test inputs in spec order (anova: value, factor; pearson and
+    ttest_rel: x, y); by are the grouping columns. Factor columns may be non-numeric.
+    """
+    if test not in TESTS:
+        raise ValueError(f"Unknown test '{test}'. Expected one of {sorted(TESTS)}")
+    if len(columns) != TESTS[test][1]:
+        raise ValueError(f"{test} takes {TESTS[test][1]} input columns, got {len(columns)}")
+
+    # Sort so each group is a contiguous block of rows
+    df = df.sort_values(by, kind='stable').reset_index(drop=True) if by else df.reset_index(drop=True)
+    matrix = np.empty((len(df), len(columns)), dtype=np.float64)
+    for i, col in enumerate(columns):
+        series = df[col]
+        if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            series = pd.Series(pd.factorize(series)[0], index=series.index).replace(-1, np.nan)
+        matrix[:, i] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    if by:
+        sizes = df.groupby(by, sort=False).size()
+        bounds = np.concatenate([[0], np.cumsum(sizes.to_numpy())])
+        keys = [', '.join(f'{col}={val}' for col, val in
+                          zip(by, idx if isinstance(idx, tuple) else (idx,)))
+                for idx in sizes.index]
+    else:
+        bounds, keys = np.array([0, len(df)]), ['all']
+    tasks = [(key, int(bounds[i]), int(bounds[i + 1]), seed + i) for i, key in enumerate(keys)]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        shared = np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = matrix
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, matrix.shape, test, n_boot, alpha)) as pool:
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = list(pool.map(_run_group, tasks, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def save_results(db, results, run_id, dataset, test, columns, by):
+    """Store runner results in the stats_results table."""
+    created = int(time.time())
+    rows = [
+        {'run_id': run_id, 'dataset': dataset, 'test': test, 'inputs': ','.join(columns),
+         'group_by': ','.join(by), 'created_epoch': created,
+         **{k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in r.items()}}
+        for r in results
+    ]
+    try:
+        db.session.bulk_insert_mappings(StatsResult, rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+
+# PART-4 - Datasets
+SEASONS = {12: 'winter', 1: 'winter', 2: 'winter', 3: 'spring', 4: 'spring', 5: 'spring',
+           6: 'summer', 7: 'summer', 8: 'summer', 9: 'autumn', 10: 'autumn', 11: 'autumn'}
+
+
+def _add_calendar_columns(db, df):
+    """Add local calendar grouping columns (month, season, weekday, ...) by epoch."""
+    if df.empty:
+        return df
+    calendar = db.calendar(int(df['epoch'].min()), int(df['epoch'].max()))
+    df['local_date'] = calendar.local_date_of(df['epoch'])
+    df['local_hour'] = calendar.local_hour_of(df['epoch'])
+    df['weekday'] = calendar.weekday_of(df['epoch'])
+    df['tariff'] = calendar.tariff_of(df['epoch'])
+    df['month'] = df['local_date'].str[:7]
+    df['season'] = df['local_date'].str[5:7].astype(int).map(SEASONS)
+    return df
+
+
+def load_dataset(db, dataset, capability=None):
+    """Load a dataset for the runner: 'hourly' features or numeric 'smartthings' values."""
+    if dataset == 'hourly':
+        # The runner works on the latest data, so new readings are built into the grid first
+        df = db.feature_matrix(refresh=True).reset_index()
+        df['epoch'] = df['epoch_hour'].astype('int64') * 3600
+    elif dataset == 'smartthings':
+        # Messages plus the first/last message of compacted runs
+        rows = db.session.execute(text(
+            "SELECT epoch, device_id, capability, value, n_messages FROM ("
+            " SELECT epoch, device_id, capability, value, 1 AS n_messages FROM smartthings_messages"
+            f" UNION ALL SELECT epoch, device_id, capability, value, n_messages FROM ({RUN_EVENTS_SQL})"
+            ") WHERE :capability IS NULL OR capability = :capability"
+        ), {'capability': capability or None}).all()
+        df = pd.DataFrame(rows, columns=['epoch', 'device_id', 'capability', 'value', 'n_messages'])
+        # Compacted runs come back as one row per message they hold, all with the run's value
+        df = df.loc[df.index.repeat(df.pop('n_messages'))].reset_index(drop=True)
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        df = df.dropna(subset=['value'])
+    else:
+        raise click.BadParameter(f"Unknown dataset '{dataset}'")
+    return _add_calendar_columns(db, df)
+
+
+@click.command()
+@click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@click.option('--dataset', type=click.Choice(['hourly', 'smartthings']), default='hourly',
+              help='hourly: feature matrix; smartthings: numeric device values.')
+@click.option('--capability', default=None, help='SmartThings capability to load (smartthings dataset).')
+@click.option('--test', 'test', type=click.Choice(sorted(TESTS)), required=True)
+@click.option('-c', '--column', 'columns', multiple=True, required=True,
+              help='Test input columns in order (anova: value factor, pearson/ttest_rel: x y).')
+@click.option('--by', multiple=True, help='Grouping column(s), e.g. month, season, device_id.')
+@click.option('--bootstrap', 'n_boot', type=int, default=1000, show_default=True,
+              help='Bootstrap resamples per group (0 disables confidence intervals).')
+@click.option('--alpha', type=float, default=0.05, show_default=True)
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count).')
+@click.option('--seed', type=int, default=0, show_default=True)
+@profile_options
+def stats_runner(dburl, dataset, capability, test, columns, by, n_boot, alpha, workers, seed):
+    """Run a hypothesis test per group in parallel and store it in stats_results.
+
+    Usage:
+        stats_runner.py -d sqlite:///smarthome.db --test anova -c t1_kwh -c weekday --by month
+        stats_runner.py -d sqlite:///smarthome.db --test pearson -c temperature -c gas_m3 --by season
+        stats_runner.py -d sqlite:///smarthome.db --dataset smartthings --capability temperatureMeasurement \\
+            --test anova -c value -c local_hour --by device_id
+    """
+    # Check before loading anything; a wrong count would fail inside every worker
+    if len(columns) != TESTS[test][1]:
+        raise click.BadParameter(f"{test} takes {TESTS[test][1]} columns, got {len(columns)}.",
+                                 param_hint="'-c' / '--column'")
+    db = HomeMessagesDB(dburl)
+
+    try:
+        with db.profiler.stage('load_dataset') as stage:
+            df = load_dataset(db, dataset, capability)
+            stage.add_rows(len(df))
+        missing = [col for col in list(columns) + list(by) if col not in df.columns]
+        if missing:
+            raise click.UsageError(f"Unknown column(s) for dataset '{dataset}': {missing}")
+
+        started = time.perf_counter()
+        with db.profiler.stage('run_tests') as stage:
+            results = run_grouped_test(df, test, list(columns), list(by), n_boot=n_boot,
+                                       alpha=alpha, workers=workers, seed=seed)
+            stage.add_rows(len(results))
+        run_id = uuid.uuid4().hex[:12]
+        with db.profiler.stage('save_results'):
+            saved = save_results(db, results, run_id, dataset, test, list(columns), list(by))
+        click.echo(f"Run {run_id}: {saved} groups tested in {time.perf_counter() - started:.1f}s "
+                   f"(results in stats_results).")
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    stats_runner()
@@ -0,0 +1,229 @@
+import os
+import gzip
+import click
+import numpy as np
+import pandas as pd
+from instrumentation import get_profiler, profile_options
+
+LOCAL_TZ = 'Europe/Amsterdam'
+
+# Base sampling at scale 1; a scale factor divides the meter intervals and multiplies the
+# number of SmartThings devices. P1g timestamps have minute resolution, so gas readings
+# never get closer than 60 seconds.
+P1E_INTERVAL = 900
+P1G_INTERVAL = 3600
+MESSAGES_PER_DEVICE_DAY = 67  # ~2,000 messages a day for 30 devices
+FILE_DAYS = 10  # P1 exports cover 10 days and overlap the next file by one day
+
+# Column-name variants accepted by p1e.py (older and newer exports)
+P1E_VARIANTS = [
+    {'t1': 'Import T1 kWh', 't2': 'Import T2 kWh', 'e1': 'Export T1 kWh', 'e2': 'Export T2 kWh'},
+    {'t1': 'Electricity imported T1', 't2': 'Electricity imported T2',
+     'e1': 'Electricity exported T1', 'e2': 'Electricity exported T2'},
+]
+
+ROOMS = [('kitchen', 'ground'), ('living room', 'ground'), ('hall', 'ground'),
+         ('bedroom', 'first'), ('bathroom', 'first'), ('study', 'first'), ('attic', 'second')]
+
+# (kind, capability, attribute, unit)
+DEVICE_KINDS = [
+    ('lamp', 'switch', 'switch', ''),
+    ('motion', 'motionSensor', 'motion', ''),
+    ('thermometer', 'temperatureMeasurement', 'temperature', 'C'),
+    ('hygrometer', 'relativeHumidityMeasurement', 'humidity', '%'),
+    ('door', 'contactSensor', 'contact', ''),
+    ('plug', 'powerMeter', 'power', 'W'),
+]
+
+
+def _hour_profile(local_hours):
+    """Relative household activity per local hour (low at night, evening peak)."""
+    return 0.3 + 0.7 * np.exp(-(local_hours - 20) ** 2 / 8) + 0.4 * np.exp(-(local_hours - 8) ** 2 / 4)
+
+
+def _write(df, path, compress, sep=','):
+    if compress:
+        with gzip.open(path + '.gz', 'wt', newline='') as f:
+            df.to_csv(f, index=False, sep=sep)
+    else:
+        df.to_csv(path, index=False, sep=sep)
+
+
+def _file_windows(start, end):
+    """Yield (window_start, window_end) of the P1 export files, overlapping by one day."""
+    current = start
+    while current < end:
+        window_end = min(current + pd.Timedelta(days=FILE_DAYS), end)
+        yield current, min(window_end + pd.Timedelta(days=1), end)
+        current = window_end
+
+
+def generate_p1e(out_dir, start, end, scale, rng, compress=False):
+    """Write P1e CSVs (cumulative T1/T2 kWh) and return the number of rows written."""
+    interval = max(1, P1E_INTERVAL // scale)
+    epochs = np.arange(int(start.timestamp()), int(end.timestamp()), interval)
+    local = pd.to_datetime(epochs, unit='s', utc=True).tz_convert(LOCAL_TZ)
+    hours = local.hour.to_numpy()
+    low_tariff = (hours >= 23) | (hours < 7) | (local.weekday.to_numpy() >= 5)
+    usage = rng.gamma(2.0, 0.5, len(epochs)) * _hour_profile(hours) * interval / 3600 * 0.4
+    t1 = 7900 + np.cumsum(np.where(low_tariff, usage, 0))
+    t2 = 6200 + np.cumsum(np.where(low_tariff, 0, usage))
+
+    written = 0
+    for i, (lo, hi) in enumerate(_file_windows(start, end)):
+        mask = (epochs >= lo.timestamp()) & (epochs < hi.timestamp())
+        names = P1E_VARIANTS[i % len(P1E_VARIANTS)]
+        df = pd.DataFrame({
+            'time': local[mask].strftime('%Y-%m-%d %H:%M:%S%z'),
+            names['t1']: t1[mask].round(3),
+            names['t2']: t2[mask].round(3),
+            names['e1']: 0.0,
+            names['e2']: 0.0,
+        })
+        _write(df, os.path.join(out_dir, f"P1e-{lo.date()}-{hi.date()}.csv"), compress)
+        written += len(df)
+    return written
+
+
+def generate_p1g(out_dir, start, end, scale, rng, compress=False):
+    """Write P1g CSVs (cumulative m3, minute resolution) and return the number of rows written."""
+    interval = max(60, P1G_INTERVAL // scale)
+    epochs = np.arange(int(start.timestamp()), int(end.timestamp()), interval)
+    times = pd.to_datetime(epochs, unit='s', utc=True)
+    # More heating in winter, more in the morning and evening
+    season = 1 + np.cos((times.dayofyear.to_numpy() - 15) / 365 * 2 * np.pi)
+    usage = rng.gamma(1.5, 0.05, len(epochs)) * season * _hour_profile(times.hour.to_numpy()) \
+        * interval / 3600
+    gas = 3000 + np.cumsum(usage)
+
+    written = 0
+    for lo, hi in _file_windows(start, end):
+        mask = (epochs >= lo.timestamp()) & (epochs < hi.timestamp())
+        # p1g.py parses '%Y-%m-%d %H:%M' as UTC
+        df = pd.DataFrame({'time': times[mask].strftime('%Y-%m-%d %H:%M'),
+                           'Total gas used': gas[mask].round(3)})
+        _write(df, os.path.join(out_dir, f"P1g-{lo.date()}-{hi.date()}.csv"), compress)
+        written += len(df)
+    return written
+
+
+def _devices(n_devices):
+    """Return (loc, level, name, capability, attribute, unit) for n devices."""
+    devices = []
+    for i in range(n_devices):
+        loc, level = ROOMS[i % len(ROOMS)]
+        kind, capability, attribute, unit = DEVICE_KINDS[i % len(DEVICE_KINDS)]
+        devices.append((loc, level, f"{loc.title()} ({kind} {i + 1})", capability, attribute, unit))
+    return devices
+
+
+def _device_values(capability, n, local_hours, rng):
+    """Return n values for a capability as strings; state devices repeat their last state."""
+    if capability == 'switch':
+        return np.where(rng.random(n) < 0.5 * _hour_profile(local_hours) / 1.4, 'on', 'off')
+    if capability == 'motionSensor':
+        return np.where(rng.random(n) < 0.4, 'active', 'inactive')
+    if capability == 'contactSensor':
+        return np.where(rng.random(n) < 0.3, 'open', 'closed')
+    if capability == 'temperatureMeasurement':
+        return np.round(19 + 2 * np.sin((local_hours - 9) / 24 * 2 * np.pi)
+                        + rng.normal(0, 0.2, n), 1).astype(str)
+    if capability == 'relativeHumidityMeasurement':
+        return np.round(55 + rng.normal(0, 3, n)).astype(int).astype(str)
+    return np.round(rng.gamma(2.0, 30.0, n), 1).astype(str)  # powerMeter
+
+
+def generate_smartthings(out_dir, start, end, n_devices, rng, compress=False):
+    """Write one SmartThings TSV per day (ISO-offset epochs) and return the number of rows."""
+    devices = pd.DataFrame(_devices(n_devices),
+                           columns=['loc', 'level', 'name', 'capability', 'attribute', 'unit'])
+    written = 0
+    for day in pd.date_range(start, end, freq='D', inclusive='left'):
+        # All devices of the day at once, sorted by device and time
+        counts = rng.poisson(MESSAGES_PER_DEVICE_DAY, n_devices)
+        device_idx = np.repeat(np.arange(n_devices), counts)
+        epochs = int(day.timestamp()) + rng.integers(0, 86400, len(device_idx))
+        order = np.lexsort((epochs, device_idx))
+        device_idx, epochs = device_idx[order], epochs[order]
+        local = pd.to_datetime(epochs, unit='s', utc=True).tz_convert(LOCAL_TZ)
+
+        df = devices.iloc[device_idx].reset_index(drop=True)
+        values = np.empty(len(df), dtype=object)
+        local_hours = local.hour.to_numpy()
+        for capability in df['capability'].unique():
+            mask = (df['capability'] == capability).to_numpy()
+            values[mask] = _device_values(capability, int(mask.sum()), local_hours[mask], rng)
+        df['value'] = values
+        # e.g. 2023-01-07T12:00:03+01:00
+        df.insert(3, 'epoch', local.strftime('%Y-%m-%dT%H:%M:%S%z').str.replace(
+            r'(\d{2})(\d{2})$', r'\1:\2', regex=True))
+        df = df[['loc', 'level', 'name', 'epoch', 'capability', 'attribute', 'value', 'unit']]
+        _write(df, os.path.join(out_dir, f"smartthings.{day.strftime('%Y%m%d')}.tsv"), compress, sep='\t')
+        written += len(df)
+    return written
+
+
+def generate_weather_rows(start='2022-06-01', months=32, seed=0):
+    """Return hourly weather dicts in the format HomeMessagesDB.bulk_insert_weather expects."""
+    start = pd.Timestamp(start, tz='UTC')
+    end = start + pd.DateOffset(months=months)
+    rng = np.random.default_rng(seed + 1)
+    epochs = np.arange(int(start.timestamp()), int(end.timestamp()), 3600)
+    times = pd.to_datetime(epochs, unit='s', utc=True)
+    season = np.cos((times.dayofyear.to_numpy() - 200) / 365 * 2 * np.pi)
+    temperature = 11 + 7 * season + 3 * np.sin((times.hour.to_numpy() - 9) / 24 * 2 * np.pi) \
+        + rng.normal(0, 1.5, len(epochs))
+    return [
+        {'epoch': int(e), 'temperature': round(float(t), 1), 'humidity': float(rng.integers(60, 100)),
+         'precipitation': round(float(max(rng.normal(-0.5, 1.0), 0)), 1),
+         'wind_speed': round(float(rng.gamma(2.0, 2.5)), 1), 'pressure': round(float(rng.normal(1013, 8)), 1)}
+        for e, t in zip(epochs, temperature)
+    ]
+
+
+def generate_dataset(out_dir, start='2022-06-01', months=32, devices=30, scale=1, seed=0,
+                     compress=False):
+    """Generate P1e, P1g and SmartThings files under out_dir; returns rows written per source."""
+    start = pd.Timestamp(start, tz='UTC')
+    end = start + pd.DateOffset(months=months)
+    rng = np.random.default_rng(seed)
+    counts = {}
+    for source in ('P1e', 'P1g', 'smartthings'):
+        os.makedirs(os.path.join(out_dir, source), exist_ok=True)
+    profiler = get_profiler()
+    with profiler.stage('generate_p1e') as stage:
+        counts['p1e'] = generate_p1e(os.path.join(out_dir, 'P1e'), start, end, scale, rng, compress)
+        stage.add_rows(counts['p1e'])
+    with profiler.stage('generate_p1g') as stage:
+        counts['p1g'] = generate_p1g(os.path.join(out_dir, 'P1g'), start, end, scale, rng, compress)
+        stage.add_rows(counts['p1g'])
+    with profiler.stage('generate_smartthings') as stage:
+        counts['smartthings'] = generate_smartthings(os.path.join(out_dir, 'smartthings'), start, end,
+                                                     devices * scale, rng, compress)
+        stage.add_rows(counts['smartthings'])
+    return counts
+
+
+@click.command()
+@click.option('-o', '--out', 'out_dir', required=True, type=click.Path(file_okay=False),
+              help='Output directory (P1e/, P1g/ and smartthings/ are created inside).')
+@click.option('--start', default='2022-06-01', show_default=True, help='First day (UTC).')
+@click.option('--months', type=int, default=32, show_default=True)
+@click.option('--devices', type=int, default=30, show_default=True, help='SmartThings devices at scale 1.')
+@click.option('--scale', type=int, default=1, show_default=True,
+              help='Volume factor (e.g. 10 or 100): finer meter intervals, more devices.')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Write .gz files like the raw exports.')
+@profile_options
+def synthetic_data(out_dir, start, months, devices, scale, seed, compress):
+    """Generate realistic P1e/P1g CSVs and SmartThings TSVs for testing and benchmarks.
+
+    Usage:
+        synthetic_data.py -o data/synthetic --scale 10
+    """
+    counts = generate_dataset(out_dir, start, months, devices, scale, seed, compress)
+    for source, rows in counts.items():
+        click.echo(f"Generated {rows} {source} rows in {out_dir}")
+
+if __name__ == "__main__":
+    synthetic_data()
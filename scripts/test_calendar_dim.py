@@ -0,0 +1,46 @@
+from datetime import date
+import pandas as pd
+import pytest
+from calendar_dim import calendar_frame, CalendarLookup, dutch_holidays
+
+
+def _local_day(local_date):
+    """Calendar rows of one local date (the UTC hours around it, filtered)."""
+    start = int(pd.Timestamp(local_date, tz='UTC').timestamp()) // 3600 - 3
+    df = calendar_frame(start, start + 30)
+    return df[df['local_date'] == local_date]
+
+
+def test_dst_days_have_23_and_25_hours():
+    spring = _local_day('2023-03-26')
+    assert len(spring) == 23
+    assert 2 not in set(spring['local_hour'])  # 02:00 does not exist
+    assert not spring.iloc[0]['is_dst'] and spring.iloc[-1]['is_dst']
+
+    autumn = _local_day('2023-10-29')
+    assert len(autumn) == 25
+    assert list(autumn['local_hour']).count(2) == 2  # 02:00 happens twice
+    assert autumn.iloc[0]['is_dst'] and not autumn.iloc[-1]['is_dst']
+
+
+def test_easter_based_holidays():
+    holidays = dutch_holidays(2023)
+    assert {date(2023, 4, 9), date(2023, 4, 10), date(2023, 5, 18), date(2023, 5, 28),
+            date(2023, 5, 29)} <= holidays
+    assert {date(2024, 3, 31), date(2024, 4, 1), date(2024, 5, 9), date(2024, 5, 20)} <= dutch_holidays(2024)
+    assert date(2025, 4, 26) in dutch_holidays(2025)  # King's Day on a Sunday moves to Saturday
+    assert date(2025, 5, 5) in dutch_holidays(2025) and date(2024, 5, 5) not in dutch_holidays(2024)
+
+    # Low tariff all day on Easter Monday, normal tariff on the Tuesday after
+    easter_monday, tuesday = _local_day('2023-04-10'), _local_day('2023-04-11')
+    assert easter_monday['is_holiday'].all() and set(easter_monday['tariff']) == {'T1'}
+    assert tuesday[tuesday['local_hour'] == 12]['tariff'].item() == 'T2'
+
+
+def test_lookup_rejects_epochs_outside_the_calendar():
+    lookup = CalendarLookup(calendar_frame(460000, 460023))
+    assert list(lookup.local_hour_of([460000 * 3600, 460023 * 3600 + 3599])) == [18, 17]
+    with pytest.raises(ValueError, match='outside the calendar'):
+        lookup.local_hour_of([460000 * 3600 - 1])
+    with pytest.raises(ValueError, match='outside the calendar'):
+        lookup.local_hour_of([460024 * 3600])
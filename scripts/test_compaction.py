@@ -0,0 +1,103 @@
+import sqlite3
+import pandas as pd
+from click.testing import CliRunner
+from sqlalchemy import text
+from db_manager import cli
+from feature_matrix import _capability_counts
+from home_messages_db import HomeMessagesDB
+from smartthings import insert_smartthings
+from stats_runner import load_dataset
+
+BASE_HOUR = 460000  # 2022-06-23 16:00 UTC
+BASE = BASE_HOUR * 3600
+
+
+def _messages(rows):
+    return pd.DataFrame([{'loc': 'hall', 'level': 'ground', 'name': name, 'epoch': BASE + offset,
+                          'capability': capability, 'attribute': capability, 'value': value, 'unit': 'C'}
+                         for name, offset, capability, value in rows])
+
+
+def _load(db, rows):
+    inserted = insert_smartthings(db, _messages(rows))
+    db.session.commit()
+    return inserted
+
+
+def _counts(db):
+    hourly = _capability_counts(db, BASE_HOUR).sort_values(['epoch_hour', 'capability'])
+    values = load_dataset(db, 'smartthings')
+    return (hourly.to_dict('records'),
+            values.groupby(['device_id', 'local_hour']).size().to_dict(),
+            values.groupby('device_id')['value'].sum().to_dict())
+
+
+def test_counts_are_the_same_before_and_after_compaction(tmp_path):
+    db = HomeMessagesDB(f"sqlite:///{tmp_path / 'compaction.db'}")
+    try:
+        # Runs of equal values, some crossing an hour boundary, on two devices
+        rows = [('Thermostat', offset, 'temperatureMeasurement', value)
+                for offset, value in [(0, '20'), (600, '20'), (1200, '20'), (3000, '21'), (3500, '21'),
+                                      (3700, '21'), (4000, '21'), (8000, '20'), (8100, '20')]]
+        rows += [('Hall light', offset, 'switch', value)
+                 for offset, value in [(100, 'on'), (200, 'on'), (3590, 'on'), (3610, 'on'), (5000, 'off')]]
+        assert _load(db, rows) == 14
+        before = _counts(db)
+
+        removed, _ = db.compact_smartthings(BASE + 10000)
+        assert removed == 14
+        assert db.session.execute(text('SELECT COUNT(*) FROM smartthings_messages')).scalar() == 0
+        assert _counts(db) == before
+    finally:
+        db.close()
+
+
+def test_late_messages_inside_a_run_are_kept_unless_they_repeat_its_value(tmp_path):
+    path = tmp_path / 'compaction.db'
+    db = HomeMessagesDB(f"sqlite:///{path}")
+    try:
+        _load(db, [('Hall light', offset, 'switch', 'on') for offset in (0, 100, 200)])
+        db.compact_smartthings(BASE + 1000)
+        device_id = db.session.execute(text('SELECT device_id FROM devices')).scalar()
+
+        # The loaders: an 'on' inside the run is a duplicate, an 'off' is new history
+        assert _load(db, [('Hall light', 50, 'switch', 'on'), ('Hall light', 60, 'switch', 'off')]) == 1
+        db.insert_smartthings('hall', 'ground', 'Hall light', BASE + 150, 'switch', 'switch', 'on', 'C')
+        db.insert_smartthings('hall', 'ground', 'Hall light', BASE + 160, 'switch', 'switch', 'off', 'C')
+    finally:
+        db.close()
+
+    csv = tmp_path / 'messages.csv'
+    csv.write_text('device_id,epoch,capability,attribute,value\n'
+                   f'{device_id},{BASE + 110},switch,switch,on\n{device_id},{BASE + 120},switch,switch,off\n')
+    result = CliRunner().invoke(cli, ['--db', str(path), 'insert', str(csv)])
+    assert result.exit_code == 0, result.output
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT epoch - ?, value FROM smartthings_messages ORDER BY epoch', (BASE,)).fetchall() == [
+        (60, 'off'), (120, 'off'), (160, 'off')]
+
+
+def test_late_null_messages_inside_a_null_run_are_duplicates(tmp_path):
+    path = tmp_path / 'compaction.db'
+    db = HomeMessagesDB(f"sqlite:///{path}")
+    try:
+        for offset in (0, 100, 200):
+            db.insert_smartthings('hall', 'ground', 'Hall light', BASE + offset, 'switch', 'switch', None, None)
+        db.compact_smartthings(BASE + 1000)
+        assert db.session.execute(text('SELECT value, n_messages FROM smartthings_runs')).all() == [(None, 3)]
+        device_id = db.session.execute(text('SELECT device_id FROM devices')).scalar()
+
+        db.insert_smartthings('hall', 'ground', 'Hall light', BASE + 50, 'switch', 'switch', None, None)
+        db.insert_smartthings('hall', 'ground', 'Hall light', BASE + 60, 'switch', 'switch', 'on', None)
+    finally:
+        db.close()
+
+    csv = tmp_path / 'messages.csv'
+    csv.write_text(f'device_id,epoch,capability,attribute,value\n{device_id},{BASE + 150},switch,switch,\n')
+    result = CliRunner().invoke(cli, ['--db', str(path), 'insert', str(csv)])
+    assert result.exit_code == 0, result.output
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT epoch - ?, value FROM smartthings_messages ORDER BY epoch', (BASE,)).fetchall() == [
+        (60, 'on')]
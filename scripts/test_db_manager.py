@@ -0,0 +1,102 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+from sqlalchemy import text
+from db_manager import cli, typed_rows
+
+
+def _insert(tmp_path, name, content, *args):
+    path = tmp_path / name
+    path.write_text(content)
+    db_path = str(tmp_path / 'manager.db')
+    result = CliRunner().invoke(cli, ['--db', db_path, 'insert', str(path), *args])
+    return result, sqlite3.connect(db_path)
+
+
+def test_typed_rows_maps_missing_integers_to_none():
+    chunk = pd.DataFrame({'device_id': [1.0, np.nan], 'name': ['a', None]})
+    assert typed_rows(chunk, ['device_id', 'name'], {'device_id': int, 'name': str}) == [(1, 'a'), (None, None)]
+
+
+def test_failing_chunk_reports_the_rows_committed_before(tmp_path):
+    # The third row has no epoch; chunks of two rows commit the first two
+    result, conn = _insert(tmp_path, 'gas.csv', 'epoch,gas_m3\n1,1.0\n2,1.5\n,2.0\n4,2.5\n', '--chunksize', '2')
+    assert result.exit_code == 1
+    assert 'NOT NULL constraint failed' in result.output
+    assert '2 rows of' in result.output and 'committed before' in result.output
+    assert conn.execute('SELECT COUNT(*) FROM gas_usage').fetchone()[0] == 2
+
+
+def test_device_upsert_refuses_names_of_other_devices(tmp_path):
+    result, conn = _insert(tmp_path, 'devices.csv', 'device_id,name,loc\n1,Kitchen,kitchen\n2,Hall,hall\n')
+    assert result.exit_code == 0, result.output
+
+    result, conn = _insert(tmp_path, 'devices2.csv', 'device_id,name,loc\n1,Kitchen,pantry\n3,Hall,hall\n',
+                           '--on-conflict', 'upsert')
+    assert result.exit_code == 1
+    assert "(3, 'Hall', 2)" in result.output
+    assert conn.execute('SELECT device_id, loc FROM devices ORDER BY device_id').fetchall() == [
+        (1, 'kitchen'), (2, 'hall')]
+
+
+def test_reloading_the_same_file_leaves_the_catalog_alone(tmp_path):
+    content = 'epoch,gas_m3\n1,1.0\n2,1.5\n'
+    result, conn = _insert(tmp_path, 'gas.csv', content)
+    assert result.exit_code == 0, result.output
+    before = conn.execute("SELECT * FROM table_stats WHERE table_name = 'gas_usage'").fetchall()
+
+    result, conn = _insert(tmp_path, 'gas.csv', content)
+    assert result.exit_code == 0, result.output
+    assert 'skipped (existing): 2' in result.output
+    assert conn.execute("SELECT * FROM table_stats WHERE table_name = 'gas_usage'").fetchall() == before
+
+
+def test_catalog_matches_full_scans_after_every_write_path(tmp_path):
+    from home_messages_db import HomeMessagesDB
+    from smartthings import insert_smartthings
+
+    db_path = tmp_path / 'manager.db'
+    db = HomeMessagesDB(f"sqlite:///{db_path}")
+    try:
+        # Loaders
+        db.insert_electricity(epoch=1000, t1_kwh=1.0, t2_kwh=0.0)
+        insert_smartthings(db, pd.DataFrame([
+            {'loc': 'hall', 'level': 'ground', 'name': name, 'epoch': epoch, 'capability': 'switch',
+             'attribute': 'switch', 'value': value, 'unit': None}
+            for name, epoch, value in [('Hall', 1000, 'on'), ('Hall', 1100, 'on'), ('Hall', 1200, 'off'),
+                                       ('Desk', 1000, 'on'), ('Desk', 5000, 'on')]]))
+        db.session.commit()
+        device_id = db.session.execute(text("SELECT device_id FROM devices WHERE name = 'Hall'")).scalar()
+    finally:
+        db.close()
+
+    # db_manager, including a message inside a run that compaction creates next
+    result, conn = _insert(tmp_path, 'electricity.csv', 'epoch,t1_kwh,t2_kwh\n2000,2.0,0.0\n1000,1.0,0.0\n')
+    assert result.exit_code == 0, result.output
+    db = HomeMessagesDB(f"sqlite:///{db_path}")
+    try:
+        db.compact_smartthings(3000)
+    finally:
+        db.close()
+    result, conn = _insert(tmp_path, 'messages.csv', 'device_id,epoch,capability,attribute,value\n'
+                           f'{device_id},1050,switch,switch,on\n{device_id},6000,switch,switch,off\n')
+    assert result.exit_code == 0, result.output
+
+    result = CliRunner().invoke(cli, ['--db', str(db_path), 'stats', '--verify'])
+    assert result.exit_code == 0, result.output
+    assert 'Catalog matches the data tables.' in result.output
+    assert 'DRIFT' not in result.output
+    # Hall: 3 compacted messages plus the new one (the late 'on' is part of a run); Desk: 2
+    assert dict(conn.execute('SELECT d.name, SUM(c.message_count) FROM smartthings_message_counts c '
+                             'JOIN devices d USING (device_id) GROUP BY d.name')) == {'Hall': 4, 'Desk': 2}
+
+    # A drifted catalog is reported and repaired
+    conn.execute("UPDATE table_stats SET row_count = 99 WHERE table_name = 'electricity_usage'")
+    conn.commit()
+    result = CliRunner().invoke(cli, ['--db', str(db_path), 'stats', '--verify'])
+    assert 'DRIFT electricity_usage' in result.output
+    result = CliRunner().invoke(cli, ['--db', str(db_path), 'stats', '--repair'])
+    assert result.exit_code == 0, result.output
+    result = CliRunner().invoke(cli, ['--db', str(db_path), 'stats', '--verify'])
+    assert 'Catalog matches the data tables.' in result.output
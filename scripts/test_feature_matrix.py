@@ -0,0 +1,102 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from home_messages_db import HomeMessagesDB, HourlyCapabilityCount, HourlyFeature
+from smartthings import insert_smartthings
+
+BASE_HOUR = 460000  # 2022-06-23 16:00 UTC
+
+
+def _db(tmp_path):
+    return HomeMessagesDB(f"sqlite:///{tmp_path / 'features.db'}")
+
+
+def _t1(db):
+    """T1 deltas by hour offset from BASE_HOUR."""
+    matrix = db.feature_matrix()
+    return {int(hour) - BASE_HOUR: value for hour, value in matrix['t1_kwh'].items()}
+
+
+def test_deltas_anchor_on_the_previous_reading_and_resets_become_nan(tmp_path):
+    db = _db(tmp_path)
+    try:
+        # Hour 2 has no reading; the meter is reset in hour 4
+        for hour, t1 in [(0, 10.0), (1, 11.0), (3, 13.5), (4, 0.5), (5, 1.0)]:
+            db.insert_electricity(epoch=(BASE_HOUR + hour) * 3600 + 600, t1_kwh=t1, t2_kwh=0.0)
+        assert db.build_hourly_features() == 6
+
+        t1 = _t1(db)
+        assert np.isnan(t1[0])  # no earlier reading
+        assert t1[1] == 1.0
+        assert np.isnan(t1[2])
+        assert t1[3] == 2.5  # against hour 1, the last hour with data
+        assert np.isnan(t1[4])  # reset
+        assert t1[5] == 0.5
+
+        # A rebuild from hour 3 anchors on the reading of hour 1, before the build window
+        db.build_hourly_features(since_epoch=(BASE_HOUR + 3) * 3600)
+        assert _t1(db)[3] == 2.5
+    finally:
+        db.close()
+
+
+def test_late_readings_are_built_without_since(tmp_path):
+    db = _db(tmp_path)
+    try:
+        for hour, t1 in [(0, 10.0), (1, 11.0), (3, 14.0), (4, 15.0)]:
+            db.insert_electricity(epoch=(BASE_HOUR + hour) * 3600, t1_kwh=t1, t2_kwh=0.0)
+        db.build_hourly_features()
+        assert np.isnan(_t1(db)[2])
+
+        # A file with the missing hour arrives after the build
+        db.insert_electricity(epoch=(BASE_HOUR + 2) * 3600, t1_kwh=12.0, t2_kwh=0.0)
+        db.build_hourly_features()
+        t1 = _t1(db)
+        assert t1[2] == 1.0
+        assert t1[3] == 2.0
+        assert t1[4] == 1.0
+    finally:
+        db.close()
+
+
+def test_feature_matrix_does_not_write_by_default(tmp_path):
+    db = _db(tmp_path)
+    try:
+        db.insert_electricity(epoch=BASE_HOUR * 3600, t1_kwh=1.0, t2_kwh=0.0)
+        assert db.feature_matrix().empty
+        assert db.session.query(HourlyFeature).count() == 0
+        assert len(db.feature_matrix(refresh=True)) == 1
+    finally:
+        db.close()
+
+
+def _switch(db, hour):
+    insert_smartthings(db, pd.DataFrame([{'loc': 'hall', 'level': 'ground', 'name': 'Hall light',
+                                          'epoch': (BASE_HOUR + hour) * 3600, 'capability': 'switch',
+                                          'attribute': 'switch', 'value': 'on', 'unit': None}]))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('old_table', [False, True])
+def test_late_messages_after_compaction_are_built(tmp_path, old_table):
+    if old_table:
+        # As created before AUTOINCREMENT: SQLite reuses the ids of deleted rows
+        conn = sqlite3.connect(tmp_path / 'features.db')
+        conn.execute("CREATE TABLE smartthings_messages (message_id INTEGER PRIMARY KEY, device_id INTEGER, "
+                     "epoch INTEGER NOT NULL, capability VARCHAR, attribute VARCHAR, value VARCHAR, unit VARCHAR)")
+        conn.close()
+    db = _db(tmp_path)
+    try:
+        for hour in (0, 1, 5):
+            _switch(db, hour)
+        db.build_hourly_features()
+        # Compaction deletes every message, including the highest ids
+        db.compact_smartthings((BASE_HOUR + 6) * 3600)
+
+        _switch(db, 3)
+        db.build_hourly_features()
+        counts = {row.epoch_hour - BASE_HOUR: row.events for row in db.session.query(HourlyCapabilityCount)}
+        assert counts == {0: 1, 1: 1, 3: 1, 5: 1}
+    finally:
+        db.close()
@@ -0,0 +1,33 @@
+import pstats
+import click
+from click.testing import CliRunner
+from instrumentation import get_profiler, profile_options
+
+
+def work():
+    return sum(range(1000))
+
+
+def after():
+    return sum(range(1000))
+
+
+@click.command()
+@profile_options
+def nested():
+    profiler = get_profiler()
+    with profiler.stage('outer'):
+        work()
+        with profiler.stage('inner') as inner:
+            work()
+            inner.add_rows(1)
+        after()
+
+
+def test_nested_stages_keep_the_outer_profile_running(tmp_path):
+    result = CliRunner().invoke(nested, ['--profile-dir', str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['nested.outer.0.prof']
+    functions = {name for _, _, name in pstats.Stats(str(tmp_path / 'nested.outer.0.prof')).stats}
+    assert {'work', 'after'} <= functions
+    assert get_profiler().stages['inner'].calls == 1
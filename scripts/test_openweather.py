@@ -0,0 +1,137 @@
+import json
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import click
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import text
+from home_messages_db import HomeMessagesDB
+from openweather import fetch_chunk, openweather
+
+NULL_HOUR = 5  # the stub never has data for 05:00 UTC
+
+
+class StubArchive(BaseHTTPRequestHandler):
+    """Open-Meteo archive stand-in: answers with the queued statuses first, then with hourly data."""
+    statuses = []
+    requests = []
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        StubArchive.requests.append((params['start_date'], params['end_date']))
+        status = StubArchive.statuses.pop(0) if StubArchive.statuses else 200
+        body = {'reason': 'stub error'}
+        if status == 200:
+            first, last = date.fromisoformat(params['start_date']), date.fromisoformat(params['end_date'])
+            hours = [datetime(first.year, first.month, first.day) + timedelta(hours=h)
+                     for h in range(((last - first).days + 1) * 24)]
+            values = [None if t.hour == NULL_HOUR else float(t.hour) for t in hours]
+            body = {'hourly': {'time': [t.strftime('%Y-%m-%dT%H:%M') for t in hours],
+                               **{field: values for field in params['hourly'].split(',')}}}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubArchive.statuses, StubArchive.requests = [], []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubArchive)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/archive"
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_rate_limits_and_server_errors(stub_url):
+    StubArchive.statuses = [429, 503]
+    data, cached = fetch_chunk(stub_url, date(2023, 1, 1), date(2023, 1, 2), backoff=0.01)
+    assert len(StubArchive.requests) == 3
+    assert len(data['hourly']['time']) == 48 and not cached
+
+
+def test_client_errors_fail_without_retrying(stub_url):
+    StubArchive.statuses = [400]
+    with pytest.raises(click.ClickException, match='400'):
+        fetch_chunk(stub_url, date(2023, 1, 1), date(2023, 1, 1), backoff=0.01)
+    assert len(StubArchive.requests) == 1
+
+    StubArchive.statuses = [500, 500]
+    with pytest.raises(click.ClickException, match='after 2 attempts'):
+        fetch_chunk(stub_url, date(2023, 1, 1), date(2023, 1, 1), retries=1, backoff=0.01)
+
+
+def test_cached_days_are_reused_across_ranges(stub_url, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    fetch_chunk(stub_url, date(2023, 1, 1), date(2023, 1, 10), cache_dir)
+    data, cached = fetch_chunk(stub_url, date(2023, 1, 3), date(2023, 1, 8), cache_dir)
+    assert cached and len(data['hourly']['time']) == 6 * 24
+    assert data['hourly']['time'][0] == '2023-01-03T00:00'
+
+    # Only the days that are not cached yet are requested
+    fetch_chunk(stub_url, date(2023, 1, 5), date(2023, 1, 15), cache_dir)
+    assert StubArchive.requests == [('2023-01-01', '2023-01-10'), ('2023-01-11', '2023-01-15')]
+
+
+def test_openweather_fetches_once_and_records_final_nulls(stub_url, tmp_path):
+    dburl = f"sqlite:///{tmp_path / 'weather.db'}"
+    args = ['-d', dburl, '--start', '2023-01-01', '--end', '2023-01-04', '--base-url', stub_url,
+            '--cache-dir', str(tmp_path / 'cache'), '--workers', '1']
+    result = CliRunner().invoke(openweather, args)
+    assert result.exit_code == 0, result.output
+    assert 'Inserted 92 new weather records' in result.output  # 4 days minus the null hours
+
+    # The null hours are covered now, so a second run has nothing to fetch
+    result = CliRunner().invoke(openweather, args)
+    assert 'nothing to fetch' in result.output
+    assert len(StubArchive.requests) == 1
+
+    db = HomeMessagesDB(dburl)
+    try:
+        null_epoch = int(datetime(2023, 1, 2, NULL_HOUR, tzinfo=timezone.utc).timestamp())
+        assert db.session.execute(text("SELECT COUNT(*) FROM weather WHERE epoch = :e"),
+                                  {'e': null_epoch}).scalar() == 0
+        assert db.coverage_gaps('weather', null_epoch - 7200, null_epoch + 7200, min_gap=3600) == []
+    finally:
+        db.close()
+
+
+def test_weather_loaded_before_the_coverage_index_is_not_refetched(stub_url, tmp_path):
+    dburl = f"sqlite:///{tmp_path / 'weather.db'}"
+    db = HomeMessagesDB(dburl)
+    try:
+        # Rows written without the loaders, so the coverage index stays empty
+        first = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+        for epoch in range(first, first + 2 * 86400, 3600):
+            db.session.execute(text("INSERT INTO weather (epoch, temperature) VALUES (:e, 1.0)"), {'e': epoch})
+        db.session.commit()
+    finally:
+        db.close()
+
+    result = CliRunner().invoke(openweather, ['-d', dburl, '--start', '2023-01-01', '--end', '2023-01-03',
+                                              '--base-url', stub_url, '--no-cache'])
+    assert result.exit_code == 0, result.output
+    assert 'Built the weather coverage index' in result.output
+    assert StubArchive.requests == [('2023-01-03', '2023-01-03')]
+
+
+def test_cached_days_inside_a_range_are_not_requested_again(stub_url, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    fetch_chunk(stub_url, date(2023, 1, 4), date(2023, 1, 5), cache_dir)
+    fetch_chunk(stub_url, date(2023, 1, 8), date(2023, 1, 8), cache_dir)
+    StubArchive.requests = []
+
+    data, cached = fetch_chunk(stub_url, date(2023, 1, 1), date(2023, 1, 10), cache_dir)
+    assert StubArchive.requests == [('2023-01-01', '2023-01-03'), ('2023-01-06', '2023-01-07'),
+                                    ('2023-01-09', '2023-01-10')]
+    assert not cached and len(data['hourly']['time']) == 10 * 24
+    assert data['hourly']['time'] == sorted(data['hourly']['time'])
@@ -0,0 +1,44 @@
+import os
+from click.testing import CliRunner
+import report_graph
+from home_messages_db import HomeMessagesDB
+from report import _document_datasets, report
+
+
+def _run(tmp_path):
+    return CliRunner().invoke(report, ['-d', f"sqlite:///{tmp_path / 'report.db'}", '--workers', '2',
+                                       '--images-dir', str(tmp_path / 'images'),
+                                       '--results-dir', str(tmp_path / 'results'),
+                                       '--cache-dir', str(tmp_path / 'cache')])
+
+
+def _failing_dataset(db, inputs):
+    raise RuntimeError('no light today')
+
+
+def test_empty_tables_render_and_a_second_run_rebuilds_nothing(tmp_path):
+    HomeMessagesDB(f"sqlite:///{tmp_path / 'report.db'}").close()
+    result = _run(tmp_path)
+    assert result.exit_code == 0, result.output
+    outputs = len(report_graph.FIGURES) + len(report_graph.DOCUMENTS)
+    assert f"{outputs} outputs rendered, 0 up to date; {len(report_graph.DATASETS)} datasets built" in result.output
+
+    result = _run(tmp_path)
+    assert result.exit_code == 0, result.output
+    assert f"0 outputs rendered, {outputs} up to date; 0 datasets built, 0 from cache." in result.output
+
+
+def test_a_failing_dataset_only_fails_its_own_outputs(tmp_path, monkeypatch):
+    HomeMessagesDB(f"sqlite:///{tmp_path / 'report.db'}").close()
+    monkeypatch.setitem(report_graph.DATASETS, 'light_usage', ([], ['smartthings_events'], _failing_dataset))
+    result = _run(tmp_path)
+    assert result.exit_code == 1
+    assert 'dataset light_usage: RuntimeError: no light today' in result.output
+
+    failed_figures = {name for name, (dataset, _) in report_graph.FIGURES.items() if dataset == 'light_usage'}
+    failed_documents = {name for name in report_graph.DOCUMENTS if 'light_usage' in _document_datasets(name)}
+    assert failed_figures and failed_documents and len(failed_documents) < len(report_graph.DOCUMENTS)
+    for name in report_graph.FIGURES:
+        assert os.path.exists(tmp_path / 'images' / f'{name}.png') == (name not in failed_figures)
+    for name in report_graph.DOCUMENTS:
+        assert os.path.exists(tmp_path / 'results' / f'{name}.pdf') == (name not in failed_documents)
@@ -0,0 +1,53 @@
+import sqlite3
+import pytest
+from sqlalchemy import create_engine, inspect
+from db_manager import initialize_tables
+from home_messages_db import Base, HomeMessagesDB
+from schema_version import SCHEMA_VERSION
+
+# Tables as an older version created them: no version columns in table_stats, no fingerprint
+OLD_SCHEMA = """
+CREATE TABLE electricity_usage (reading_id INTEGER PRIMARY KEY, epoch INTEGER NOT NULL UNIQUE,
+                                t1_kwh FLOAT, t2_kwh FLOAT);
+CREATE TABLE table_stats (table_name VARCHAR PRIMARY KEY, row_count INTEGER NOT NULL, min_epoch INTEGER,
+                          max_epoch INTEGER, last_ingest_epoch INTEGER);
+CREATE TABLE ingest_checkpoints (path VARCHAR PRIMARY KEY, inode INTEGER NOT NULL, "offset" INTEGER NOT NULL,
+                                 header VARCHAR, updated_epoch INTEGER);
+CREATE TABLE schema_version (version INTEGER PRIMARY KEY, applied_epoch INTEGER);
+INSERT INTO electricity_usage VALUES (1, 1000, 1.0, 0.0);
+INSERT INTO table_stats VALUES ('electricity_usage', 1, 1000, 1000, 1000);
+INSERT INTO ingest_checkpoints VALUES ('usage.csv', 7, 42, 'time', 1000);
+"""
+
+
+def _open_with_home_messages_db(path):
+    HomeMessagesDB(f"sqlite:///{path}").close()
+
+
+@pytest.mark.parametrize('old_version', [1, 2, 3])
+@pytest.mark.parametrize('open_db', [_open_with_home_messages_db, initialize_tables])
+def test_old_databases_get_the_new_tables_and_columns(tmp_path, old_version, open_db):
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA + f"INSERT INTO schema_version VALUES ({old_version}, 0);")
+    conn.close()
+
+    open_db(path)
+
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        inspector = inspect(engine)
+        for table in Base.metadata.sorted_tables:
+            assert inspector.has_table(table.name), table.name
+            assert {col['name'] for col in inspector.get_columns(table.name)} == set(table.columns.keys()), table.name
+    finally:
+        engine.dispose()
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == SCHEMA_VERSION
+        # Existing rows are kept, with the defaults in the added columns
+        assert conn.execute('SELECT row_count, version, changed_version FROM table_stats').fetchall() == [(1, 0, 0)]
+        assert conn.execute('SELECT "offset", fingerprint FROM ingest_checkpoints').fetchall() == [(42, None)]
+        assert conn.execute('SELECT epoch FROM electricity_usage').fetchall() == [(1000,)]
+    finally:
+        conn.close()
@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+SMARTHOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'smarthome.py')
+
+# Runs the script as `smarthome.py <args>` and prints the heavy modules it imported
+PROBE = f"""
+import json, runpy, sys
+sys.argv = [{SMARTHOME!r}] + sys.argv[1:]
+try:
+    runpy.run_path({SMARTHOME!r}, run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps(sorted(m for m in ('pandas', 'sqlalchemy', 'numpy') if m in sys.modules)))
+"""
+
+
+@pytest.mark.parametrize('args', [['--help'], ['db', '--help']])
+def test_help_imports_neither_pandas_nor_sqlalchemy(args):
+    result = subprocess.run([sys.executable, '-c', PROBE, *args], capture_output=True, text=True, check=True)
+    assert 'Usage:' in result.stdout
+    assert json.loads(result.stdout.splitlines()[-1]) == []
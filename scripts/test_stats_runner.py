@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+from stats_runner import run_grouped_test, stats_runner
+
+
+def test_pearson_per_group_in_worker_processes():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=200)
+    df = pd.DataFrame({'x': x, 'y': 2 * x + rng.normal(scale=0.1, size=200), 'group': ['a', 'b'] * 100})
+    results = run_grouped_test(df, 'pearson', ['x', 'y'], ['group'], n_boot=20, workers=2)
+    assert [r['group_key'] for r in results] == ['group=a', 'group=b']
+    assert all(r['n'] == 100 and r['effect'] > 0.99 and r['ci_low'] <= r['ci_high'] for r in results)
+
+
+def test_wrong_number_of_columns_is_rejected_before_running():
+    df = pd.DataFrame({'x': [1.0, 2.0, 3.0]})
+    with pytest.raises(ValueError, match='pearson takes 2 input columns'):
+        run_grouped_test(df, 'pearson', ['x'], [])
+
+    result = CliRunner().invoke(stats_runner, ['-d', 'sqlite://', '--test', 'pearson', '-c', 'x'])
+    assert result.exit_code == 2
+    assert 'pearson takes 2 columns, got 1' in result.output
@@ -0,0 +1,85 @@
+import sqlite3
+from click.testing import CliRunner
+from db_manager import cli
+from home_messages_db import HomeMessagesDB
+from timeseries_store import _read_meta, refresh_store, store_dir
+
+START = 1679702400  # 2023-03-25 00:00 UTC
+
+
+def _db(tmp_path):
+    db = HomeMessagesDB(f"sqlite:///{tmp_path / 'store.db'}")
+    for i in range(10):
+        db.insert_electricity(epoch=START + i * 900, t1_kwh=float(i), t2_kwh=0.0)
+    return db
+
+
+def test_open_compares_versions_instead_of_counting(tmp_path):
+    db = _db(tmp_path)
+    try:
+        assert len(db.timeseries('electricity')) == 10
+    finally:
+        db.close()
+
+    conn = sqlite3.connect(tmp_path / 'store.db')
+    statements = []
+
+    def execute(sql, params):
+        statements.append(sql)
+        return conn.execute(sql, params)
+
+    assert refresh_store(execute, str(tmp_path / 'store.db'), 'electricity') == 0
+    assert len(statements) == 1 and 'COUNT' not in statements[0]
+
+
+def test_loads_append_and_upserts_rewrite_the_store(tmp_path):
+    db = _db(tmp_path)
+    directory = store_dir(str(tmp_path / 'store.db'))
+    try:
+        db.timeseries('electricity')
+        db.insert_electricity(epoch=START + 10 * 900, t1_kwh=10.0, t2_kwh=0.0)
+        assert list(db.timeseries('electricity')['t1_kwh'][-2:]) == [9.0, 10.0]
+        assert _read_meta(directory, 'electricity')['generation'] == 0
+
+        # Same row count and last epoch, one reading changed in place
+        csv = tmp_path / 'fix.csv'
+        csv.write_text(f'epoch,t1_kwh,t2_kwh\n{START + 900},1.5,0.0\n')
+        result = CliRunner().invoke(cli, ['--db', str(tmp_path / 'store.db'), 'insert', str(csv),
+                                          '--on-conflict', 'upsert'])
+        assert result.exit_code == 0, result.output
+        series = db.timeseries('electricity')
+        assert len(series) == 11 and series['t1_kwh'][1] == 1.5
+        assert _read_meta(directory, 'electricity')['generation'] == 1
+    finally:
+        db.close()
+
+
+def test_repair_rebuilds_stores_after_writes_outside_the_loaders(tmp_path):
+    db = _db(tmp_path)
+    try:
+        db.timeseries('electricity')
+        conn = sqlite3.connect(tmp_path / 'store.db')
+        conn.execute('UPDATE electricity_usage SET t1_kwh = 42.0 WHERE epoch = ?', (START,))
+        conn.commit()
+        conn.close()
+        assert db.timeseries('electricity')['t1_kwh'][0] == 0.0  # not seen without a version bump
+
+        result = CliRunner().invoke(cli, ['--db', str(tmp_path / 'store.db'), 'stats', '--repair'])
+        assert result.exit_code == 0, result.output
+        assert 'Rebuilt the time-series stores: electricity.' in result.output
+        assert db.timeseries('electricity', refresh=False)['t1_kwh'][0] == 42.0
+    finally:
+        db.close()
+
+
+def test_repair_adds_missing_catalog_rows(tmp_path):
+    db = _db(tmp_path)
+    db.close()
+    conn = sqlite3.connect(tmp_path / 'store.db')
+    conn.execute("DELETE FROM table_stats")
+    conn.commit()
+    result = CliRunner().invoke(cli, ['--db', str(tmp_path / 'store.db'), 'stats', '--repair'])
+    assert result.exit_code == 0, result.output
+    assert 'Database error' not in result.output
+    assert conn.execute("SELECT row_count, version FROM table_stats WHERE table_name = 'electricity_usage'"
+                        ).fetchone() == (10, 2)
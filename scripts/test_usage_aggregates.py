@@ -0,0 +1,40 @@
+import pytest
+from home_messages_db import HomeMessagesDB
+from usage_aggregates import AGGREGATES, BUCKETS, compare_profiles, usage_profile_pandas, usage_profile_sql
+
+START = 1679702400  # 2023-03-25 00:00 UTC, the day before the switch to summer time
+
+
+@pytest.fixture(scope='module')
+def db(tmp_path_factory):
+    db = HomeMessagesDB(f"sqlite:///{tmp_path_factory.mktemp('usage') / 'usage.db'}")
+    t1 = t2 = gas = 0.0
+    for i in range(2 * 96):
+        epoch = START + i * 900
+        if 40 <= i < 60:
+            continue  # five hours without readings
+        if i == 100:
+            t1 = 0.0  # meter reset
+        t1, t2, gas = t1 + 0.1 + (i % 7) * 0.05, t2 + (i % 3) * 0.02, gas + (i % 5) * 0.01
+        db.insert_electricity(epoch=epoch, t1_kwh=round(t1, 3), t2_kwh=round(t2, 3))
+        if i % 4 == 0:
+            db.insert_gas(epoch=epoch, gas_m3=round(gas, 3))
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('source', ['electricity', 'gas'])
+@pytest.mark.parametrize('start_epoch, end_epoch', [
+    (None, None),
+    (START + 3600, START + 30 * 3600),
+    (START + 2 * 86400, START + 3 * 86400),  # no readings
+    (None, 0),  # epoch 0 is a bound, not "no bound"
+    (START, START),  # one reading per meter
+])
+def test_sql_and_pandas_profiles_match(db, source, start_epoch, end_epoch):
+    for bucket in BUCKETS:
+        for agg in AGGREGATES:
+            sql = usage_profile_sql(db, source, bucket, agg, start_epoch, end_epoch)
+            pandas = usage_profile_pandas(db, source, bucket, agg, start_epoch, end_epoch)
+            assert compare_profiles(sql, pandas) == [], (bucket, agg)
+            assert len(sql) == len(pandas)
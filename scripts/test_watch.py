@@ -0,0 +1,102 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from click.testing import CliRunner
+from watch import watch
+
+WATCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'watch.py')
+HEADER = 'time,Import T1 kWh,Import T2 kWh\n'
+START = 1679702400  # 2023-03-25 00:00 UTC
+
+
+def _lines(first, last):
+    return ''.join(f'{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(START + i * 60))},{i / 10},0.0\n'
+                   for i in range(first, last))
+
+
+def _epochs(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute('SELECT epoch FROM electricity_usage ORDER BY epoch')]
+    except sqlite3.OperationalError:  # tables not created yet
+        return []
+    finally:
+        conn.close()
+
+
+def test_restart_after_kill_loses_and_duplicates_nothing(tmp_path):
+    export_dir, db_path = tmp_path / 'p1e', tmp_path / 'watch.db'
+    export_dir.mkdir()
+    export = export_dir / 'usage.csv'
+    export.write_text(HEADER)
+
+    process = subprocess.Popen([sys.executable, WATCH, '-d', f'sqlite:///{db_path}', '--p1e', str(export_dir),
+                                '--poll', '--interval', '0.05', '--batch-seconds', '0.1'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Append while the watcher runs and kill it without warning once part of it is in
+        for first in range(0, 300, 20):
+            with open(export, 'a') as f:
+                f.write(_lines(first, first + 20))
+            time.sleep(0.02)
+        deadline = time.monotonic() + 30
+        while not _epochs(db_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert _epochs(db_path), "the watcher inserted nothing"
+    finally:
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+
+    with open(export, 'a') as f:
+        f.write(_lines(300, 400))
+    result = CliRunner().invoke(watch, ['-d', f'sqlite:///{db_path}', '--p1e', str(export_dir), '--once'])
+    assert result.exit_code == 0, result.output
+    assert _epochs(db_path) == [START + i * 60 for i in range(400)]
+
+
+def test_file_rewritten_in_place_is_read_from_the_top(tmp_path):
+    export_dir, db_path = tmp_path / 'p1e', tmp_path / 'watch.db'
+    export_dir.mkdir()
+    export = export_dir / 'usage.csv'
+    args = ['-d', f'sqlite:///{db_path}', '--p1e', str(export_dir), '--once']
+
+    export.write_text(HEADER + _lines(0, 10))
+    assert CliRunner().invoke(watch, args).exit_code == 0
+    # Same inode and a larger size, but other contents: the checkpoint offset does not apply
+    inode = os.stat(export).st_ino
+    export.write_text(HEADER + _lines(100, 130))
+    assert os.stat(export).st_ino == inode
+    result = CliRunner().invoke(watch, args)
+    assert result.exit_code == 0, result.output
+    assert _epochs(db_path) == [START + i * 60 for i in list(range(10)) + list(range(100, 130))]
+
+
+def test_malformed_line_skips_only_its_file(tmp_path):
+    export_dir, db_path = tmp_path / 'p1e', tmp_path / 'watch.db'
+    export_dir.mkdir()
+    good, bad = export_dir / 'good.csv', export_dir / 'bad.csv'
+    args = ['-d', f'sqlite:///{db_path}', '--p1e', str(export_dir), '--once']
+
+    good.write_text(HEADER + _lines(0, 5))
+    bad.write_text(HEADER + _lines(100, 105) + 'yesterday,1.0,0.0\n')
+    result = CliRunner().invoke(watch, args)
+    assert result.exit_code == 0, result.output
+    assert f'Skipping {bad}' in result.output
+    assert _epochs(db_path) == [START + i * 60 for i in range(5)]
+
+    # A restart does not crash on the same chunk, and the good file keeps going
+    with open(good, 'a') as f:
+        f.write(_lines(5, 8))
+    result = CliRunner().invoke(watch, args)
+    assert result.exit_code == 0, result.output
+    assert f'Skipping {bad}' in result.output
+    assert _epochs(db_path) == [START + i * 60 for i in range(8)]
+
+    # Once the line is fixed, the rest of the file is ingested
+    bad.write_text(HEADER + _lines(100, 106))
+    result = CliRunner().invoke(watch, args)
+    assert result.exit_code == 0, result.output
+    assert _epochs(db_path) == [START + i * 60 for i in list(range(8)) + list(range(100, 106))]
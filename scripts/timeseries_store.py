@@ -0,0 +1,303 @@
+"""Memory-mapped copies of the meter tables for fast, copy-free range access.
+
+Every meter (see METERS) is stored next to the database (smarthome.db -> smarthome.ts/) as
+a sorted int64 epoch file plus one float64 file per register, and a small JSON file with
+the row count. Opening maps the files read-only, so it is near-instant and processes that
+open the same store share the pages in the OS cache.
+
+The JSON file also keeps the version of the table (see TableStat) the store was written at.
+Every loader bumps it, so opening only compares two numbers when nothing was written. Otherwise
+refreshing appends the rows after the last stored epoch. When rows were added in the middle
+(backfills) or changed in place (db_manager.py insert --on-conflict upsert marks its writes as
+changes) the files are rewritten under a new generation; readers that still map the old files
+keep their snapshot. Tables missing from table_stats are compared by row count and last epoch,
+which does not see in-place changes; rebuild those stores after writing outside the loaders.
+The functions take an execute(sql, params) callable, so they work with a SQLAlchemy connection
+(HomeMessagesDB.timeseries) and with a plain sqlite3 connection (db_manager.py).
+"""
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from usage_aggregates import METERS
+
+try:
+    import fcntl
+except ImportError:  # not on Unix: refreshes are not serialized between processes
+    fcntl = None
+
+RESAMPLE_METHODS = ['first', 'last', 'mean', 'sum', 'min', 'max']
+FETCH_CHUNK_ROWS = 100000
+
+
+def store_dir(db_path):
+    """Return the store directory of a SQLite database file, or None for in-memory databases."""
+    if not db_path or db_path == ':memory:':
+        return None
+    return os.path.splitext(os.path.abspath(db_path))[0] + '.ts'
+
+
+def _meta_path(directory, source):
+    return os.path.join(directory, f'{source}.json')
+
+
+def _array_path(directory, source, generation, name):
+    return os.path.join(directory, f'{source}.{generation}.{name}')
+
+
+def _read_meta(directory, source):
+    try:
+        with open(_meta_path(directory, source)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_meta(directory, source, meta):
+    # Written to a temporary file and renamed, so readers see the old or the new version
+    tmp = _meta_path(directory, source) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, _meta_path(directory, source))
+
+
+@contextmanager
+def _locked(directory, source):
+    """Serialize refreshes of one source between processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, f'{source}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _fetch(execute, source, after_epoch=None, chunk_rows=FETCH_CHUNK_ROWS):
+    """Yield (epochs, {register: values}) chunks of a meter table in epoch order, after after_epoch if given."""
+    table, columns = METERS[source]
+    where = "" if after_epoch is None else " WHERE epoch > :after"
+    result = execute(f"SELECT epoch, {', '.join(columns)} FROM {table}{where} ORDER BY epoch",
+                     {'after': after_epoch})
+    while True:
+        rows = result.fetchmany(chunk_rows)
+        if not rows:
+            break
+        fields = list(zip(*rows))
+        # NULL registers become NaN
+        yield (np.array(fields[0], dtype='int64'),
+               {col: np.array(values, dtype='float64') for col, values in zip(columns, fields[1:])})
+
+
+def _table_state(execute, table):
+    """Return (rows, max_epoch, version, changed_version) of a meter table from table_stats.
+
+    Tables missing from the catalog (filled outside the loaders) are counted, without versions.
+    """
+    state = execute("SELECT row_count, max_epoch, version, changed_version FROM table_stats "
+                    "WHERE table_name = :table", {'table': table}).fetchone()
+    if state is None:
+        rows, max_epoch = execute(f"SELECT COUNT(*), MAX(epoch) FROM {table}", {}).fetchone()
+        return rows, max_epoch, None, None
+    return tuple(state)
+
+
+def _append(directory, source, meta, chunks):
+    """Append chunks to the files of the current generation; returns (row count, last epoch).
+
+    Anything past meta['rows'] (an interrupted append) was never published and is overwritten.
+    """
+    names = ['epoch'] + meta['columns']
+    files = {}
+    try:
+        for name in names:
+            path = _array_path(directory, source, meta['generation'], name)
+            files[name] = open(path, 'r+b' if os.path.exists(path) else 'wb')
+            files[name].truncate(meta['rows'] * 8)
+            files[name].seek(meta['rows'] * 8)
+        rows, last_epoch = meta['rows'], meta['max_epoch']
+        for epochs, values in chunks:
+            files['epoch'].write(epochs.tobytes())
+            for col in meta['columns']:
+                files[col].write(values[col].tobytes())
+            rows, last_epoch = rows + len(epochs), int(epochs[-1])
+        for f in files.values():
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        for f in files.values():
+            f.close()
+    return rows, last_epoch
+
+
+def refresh_store(execute, db_path, source, rebuild=False, create=True):
+    """Bring the store of a meter up to date with its table; returns the number of rows written.
+
+    Returns None when there is no store (in-memory database, or create=False and the store
+    was never built).
+    """
+    directory = store_dir(db_path)
+    if directory is None or (not create and _read_meta(directory, source) is None):
+        return None
+    table, columns = METERS[source]
+    os.makedirs(directory, exist_ok=True)
+    # Nothing written since the store was: no lock needed
+    meta = _read_meta(directory, source)
+    if (not rebuild and meta is not None and meta['columns'] == columns and meta.get('table_version') is not None
+            and _table_state(execute, table)[2] == meta['table_version']):
+        return 0
+    with _locked(directory, source):
+        meta = _read_meta(directory, source)
+        table_rows, max_epoch, version, changed_version = _table_state(execute, table)
+
+        # Step 1: nothing new, or only rows after the stored ones: append
+        stored_version = meta.get('table_version') if meta is not None else None
+        if meta is not None and meta['columns'] == columns and not rebuild and (
+                version is None or (stored_version is not None and stored_version >= changed_version)):
+            if stored_version is not None and stored_version == version:
+                return 0
+            if meta['rows'] == table_rows and meta['max_epoch'] == max_epoch:
+                if version is not None:
+                    meta['table_version'] = version
+                    _write_meta(directory, source, meta)
+                return 0
+            if 0 < meta['rows'] < table_rows:
+                # Every row we do not have yet must come after the last stored epoch
+                after_rows = execute(f"SELECT COUNT(*) FROM {table} WHERE epoch > :after",
+                                     {'after': meta['max_epoch']}).fetchone()[0]
+                if meta['rows'] + after_rows == table_rows:
+                    rows, last_epoch = _append(directory, source, meta, _fetch(execute, source, meta['max_epoch']))
+                    written = rows - meta['rows']
+                    meta.update(rows=rows, max_epoch=last_epoch, table_version=version)
+                    _write_meta(directory, source, meta)
+                    return written
+
+        # Step 2: otherwise rewrite everything under a new generation
+        old_generation = meta['generation'] if meta is not None else None
+        generation = 0 if old_generation is None else old_generation + 1
+        new_meta = {'generation': generation, 'columns': columns, 'rows': 0, 'max_epoch': None,
+                    'table_version': version}
+        new_meta['rows'], new_meta['max_epoch'] = _append(directory, source, new_meta, _fetch(execute, source))
+        _write_meta(directory, source, new_meta)
+        if old_generation is not None:
+            for name in ['epoch'] + meta['columns']:
+                path = _array_path(directory, source, old_generation, name)
+                if os.path.exists(path):
+                    os.remove(path)
+        return new_meta['rows']
+
+
+def _map(path, dtype, rows):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+
+
+def open_store(execute, db_path, source, refresh=True):
+    """Return the TimeSeries of a meter, memory-mapped from its store.
+
+    In-memory databases have no store; their series is read into memory instead.
+    """
+    directory = store_dir(db_path)
+    if directory is None:
+        table, columns = METERS[source]
+        chunks = list(_fetch(execute, source))
+        return TimeSeries(np.concatenate([np.empty(0, dtype='int64')] + [epochs for epochs, _ in chunks]),
+                          {col: np.concatenate([np.empty(0)] + [values[col] for _, values in chunks])
+                           for col in columns})
+    if refresh or _read_meta(directory, source) is None:
+        refresh_store(execute, db_path, source)
+    # A concurrent rebuild may remove the files of the generation we just read; retry once
+    for attempt in range(2):
+        meta = _read_meta(directory, source)
+        try:
+            epochs = _map(_array_path(directory, source, meta['generation'], 'epoch'), 'int64', meta['rows'])
+            values = {col: _map(_array_path(directory, source, meta['generation'], col), 'float64', meta['rows'])
+                      for col in meta['columns']}
+            return TimeSeries(epochs, values)
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+class TimeSeries:
+    """Sorted epochs (seconds) with a parallel float64 array per register.
+
+    Slicing returns views of the same arrays (no copies); resample() and delta() compute
+    new, smaller arrays with numpy.
+    """
+
+    def __init__(self, epochs, values):
+        self.epochs = epochs
+        self.values = values
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, column):
+        return self.values[column]
+
+    @property
+    def columns(self):
+        return list(self.values)
+
+    def slice(self, start_epoch=None, end_epoch=None):
+        """Return the readings with start_epoch <= epoch <= end_epoch (binary search, views)."""
+        lo = 0 if start_epoch is None else int(np.searchsorted(self.epochs, start_epoch, side='left'))
+        hi = len(self.epochs) if end_epoch is None else int(np.searchsorted(self.epochs, end_epoch, side='right'))
+        return TimeSeries(self.epochs[lo:hi], {col: array[lo:hi] for col, array in self.values.items()})
+
+    def delta(self, column):
+        """Differences between consecutive readings; the first one (and any around NaN) is 0.
+
+        The same as diff().fillna(0) on the raw series; negative values are meter resets.
+        """
+        values = self.values[column]
+        if len(values) == 0:
+            return np.empty(0, dtype='float64')
+        deltas = np.empty(len(values), dtype='float64')
+        deltas[0] = 0.0
+        np.subtract(values[1:], values[:-1], out=deltas[1:])
+        deltas[np.isnan(deltas)] = 0.0
+        return deltas
+
+    def resample(self, seconds, how='last'):
+        """Return one reading per bucket of `seconds` (epoch of the bucket start), for buckets with data.
+
+        how is first, last, mean, sum, min or max; mean and sum skip NaN registers.
+        """
+        if how not in RESAMPLE_METHODS:
+            raise ValueError(f"Unknown resample method {how!r}; use one of {', '.join(RESAMPLE_METHODS)}")
+        if len(self.epochs) == 0:
+            return TimeSeries(np.empty(0, dtype='int64'), {col: np.empty(0) for col in self.values})
+        buckets = self.epochs // seconds * seconds
+        # The data is sorted, so every bucket is one contiguous block
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+        resampled = {}
+        for col, values in self.values.items():
+            if how == 'first':
+                resampled[col] = values[starts]
+            elif how == 'last':
+                resampled[col] = values[ends]
+            elif how in ('min', 'max'):
+                reduce = np.minimum if how == 'min' else np.maximum
+                resampled[col] = reduce.reduceat(values, starts)
+            else:
+                present = ~np.isnan(values)
+                sums = np.add.reduceat(np.where(present, values, 0.0), starts)
+                if how == 'sum':
+                    resampled[col] = sums
+                else:
+                    counts = np.add.reduceat(present.astype('int64'), starts)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        resampled[col] = sums / counts
+        return TimeSeries(buckets[starts], resampled)
+
+    def to_frame(self):
+        """Return a DataFrame (epoch plus one column per register); this copies the data."""
+        return pd.DataFrame({'epoch': np.asarray(self.epochs), **{col: np.asarray(array)
+                                                                   for col, array in self.values.items()}})
@@ -0,0 +1,132 @@
+"""Usage profiles of the cumulative meters: delta per reading, reset filtering, bucketing, aggregate.
+
+Three backends with the same result:
+- sql: one statement per meter inside the database (LAG window for the deltas, a join on
+  calendar_hours for local-time buckets); only the aggregate rows come back.
+- pandas: the rows are pulled out and processed with diff()/groupby, as the analyses did.
+- store: the deltas come from the memory-mapped arrays of timeseries_store.py, no ORM rows.
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from calendar_dim import build_calendar, load_calendar
+
+# Meter sources: (table, cumulative columns)
+METERS = {
+    'electricity': ('electricity_usage', ['t1_kwh', 't2_kwh']),
+    'gas': ('gas_usage', ['gas_m3']),
+}
+
+# Buckets from calendar_hours (Europe/Amsterdam) and plain UTC buckets
+CALENDAR_BUCKETS = ['local_hour', 'weekday', 'local_date', 'tariff']
+UTC_BUCKETS = {
+    'utc_hour': "(d.epoch % 86400) / 3600",
+    'utc_date': "date(d.epoch, 'unixepoch')",
+}
+BUCKETS = CALENDAR_BUCKETS + list(UTC_BUCKETS)
+
+AGGREGATES = {'mean': 'AVG', 'sum': 'SUM', 'count': 'COUNT'}
+
+
+def _range_filter(start_epoch, end_epoch):
+    clauses = []
+    if start_epoch is not None:
+        clauses.append("epoch >= :start")
+    if end_epoch is not None:
+        clauses.append("epoch <= :end")
+    return (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+def usage_sql(source, bucket='local_hour', agg='mean', start_epoch=None, end_epoch=None):
+    """Compile the usage profile of a meter into one SQL statement (bucket, one column per register).
+
+    COALESCE(delta, 0) matches diff().fillna(0): the first reading of the range counts as 0.
+    """
+    table, columns = METERS[source]
+    deltas = ", ".join(f"COALESCE({col} - LAG({col}) OVER (ORDER BY epoch), 0) AS {col}" for col in columns)
+    if bucket in CALENDAR_BUCKETS:
+        bucket_expr, join = f"c.{bucket}", " JOIN calendar_hours c ON c.epoch_hour = d.epoch / 3600"
+    else:
+        bucket_expr, join = UTC_BUCKETS[bucket], ""
+    aggregates = ", ".join(f"{AGGREGATES[agg]}(d.{col}) AS {col}" for col in columns)
+    # Negative deltas are meter resets or bad readings
+    valid = " AND ".join(f"d.{col} >= 0" for col in columns)
+    return (f"WITH d AS (SELECT epoch, {deltas} FROM {table}{_range_filter(start_epoch, end_epoch)}) "
+            f"SELECT {bucket_expr} AS bucket, {aggregates} FROM d{join} "
+            f"WHERE {valid} GROUP BY bucket ORDER BY bucket")
+
+
+def _epoch_bounds(db, table, start_epoch, end_epoch):
+    return db.session.execute(text(
+        f"SELECT MIN(epoch), MAX(epoch) FROM {table}{_range_filter(start_epoch, end_epoch)}"
+    ), {'start': start_epoch, 'end': end_epoch}).one()
+
+
+def usage_profile_sql(db, source, bucket='local_hour', agg='mean', start_epoch=None, end_epoch=None):
+    """Return the usage profile computed inside the database."""
+    table, columns = METERS[source]
+    if bucket in CALENDAR_BUCKETS:
+        lo, hi = _epoch_bounds(db, table, start_epoch, end_epoch)
+        if lo is None:
+            return pd.DataFrame(columns=['bucket'] + columns)
+        build_calendar(db, lo, hi)
+    rows = db.session.execute(text(usage_sql(source, bucket, agg, start_epoch, end_epoch)),
+                              {'start': start_epoch, 'end': end_epoch}).all()
+    return pd.DataFrame(rows, columns=['bucket'] + columns)
+
+
+def _bucket_profile(db, df, columns, bucket, agg):
+    """Bucket and aggregate a frame of (epoch, delta per register) without resets."""
+    if bucket in CALENDAR_BUCKETS:
+        calendar = load_calendar(db, int(df['epoch'].min()), int(df['epoch'].max()))
+        df['bucket'] = calendar.lookup(df['epoch'], bucket)
+    elif bucket == 'utc_hour':
+        df['bucket'] = df['epoch'] % 86400 // 3600
+    else:
+        df['bucket'] = pd.to_datetime(df['epoch'], unit='s', utc=True).dt.strftime('%Y-%m-%d')
+    return df.groupby('bucket')[columns].agg(agg).reset_index()
+
+
+def usage_profile_pandas(db, source, bucket='local_hour', agg='mean', start_epoch=None, end_epoch=None):
+    """Return the usage profile computed in pandas from the raw readings."""
+    table, columns = METERS[source]
+    query = db.query_electricity if source == 'electricity' else db.query_gas
+    readings = query(start_epoch=start_epoch, end_epoch=end_epoch)
+    df = pd.DataFrame([[r.epoch] + [getattr(r, col) for col in columns] for r in readings],
+                      columns=['epoch'] + columns).sort_values('epoch')
+    if df.empty:
+        return pd.DataFrame(columns=['bucket'] + columns)
+
+    # Differences between consecutive readings; negative ones are resets
+    for col in columns:
+        df[col] = df[col].diff().fillna(0)
+    df = df[(df[columns] >= 0).all(axis=1)]
+    return _bucket_profile(db, df, columns, bucket, agg)
+
+
+def usage_profile_store(db, source, bucket='local_hour', agg='mean', start_epoch=None, end_epoch=None):
+    """Return the usage profile computed from the memory-mapped time-series store."""
+    table, columns = METERS[source]
+    series = db.timeseries(source, start_epoch, end_epoch)
+    if not len(series):
+        return pd.DataFrame(columns=['bucket'] + columns)
+
+    df = pd.DataFrame({'epoch': series.epochs, **{col: series.delta(col) for col in columns}})
+    df = df[(df[columns] >= 0).all(axis=1)]
+    return _bucket_profile(db, df, columns, bucket, agg)
+
+
+def compare_profiles(sql_df, pandas_df, rtol=1e-9, atol=1e-12):
+    """Return a list of differences between two usage profiles (empty when they match)."""
+    a = sql_df.set_index(sql_df['bucket'].astype(str)).drop(columns='bucket').sort_index()
+    b = pandas_df.set_index(pandas_df['bucket'].astype(str)).drop(columns='bucket').sort_index()
+    if list(a.index) != list(b.index):
+        return [f"buckets differ: {sorted(set(a.index) ^ set(b.index))[:10]}"]
+    differences = []
+    for col in a.columns:
+        x, y = a[col].to_numpy(dtype='float64'), b[col].to_numpy(dtype='float64')
+        mismatch = ~np.isclose(x, y, rtol=rtol, atol=atol, equal_nan=True)
+        if mismatch.any():
+            differences.append(f"{col}: {int(mismatch.sum())} bucket(s) differ, "
+                               f"max abs difference {np.nanmax(np.abs(x - y)):.3g}")
+    return differences
@@ -0,0 +1,229 @@
+import glob
+import hashlib
+import io
+import os
+import signal
+import time
+from datetime import datetime
+import click
+import pandas as pd
+from sqlalchemy.exc import OperationalError
+from home_messages_db import HomeMessagesDB, IngestCheckpoint
+from instrumentation import profile_options
+from p1e import normalize_p1e, insert_p1e
+from p1g import normalize_p1g, insert_p1g
+from smartthings import normalize_smartthings, insert_smartthings
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # not installed or not Linux: poll the directories
+    INotify = None
+
+# Bytes at the start of a file that identify it, with its inode
+FINGERPRINT_BYTES = 4096
+
+# Watched sources: (file pattern, separator, normalize, insert)
+SOURCES = {
+    'p1e': ('*.csv', ',', normalize_p1e, insert_p1e),
+    'p1g': ('*.csv', ',', normalize_p1g, insert_p1g),
+    'smartthings': ('*.tsv', '\t', normalize_smartthings, insert_smartthings),
+}
+
+
+class TailedFile:
+    """Read position of one growing export file; only complete lines are read."""
+
+    def __init__(self, path, kind, checkpoint=None):
+        self.path = path
+        self.kind = kind
+        self.inode = checkpoint.inode if checkpoint else None
+        self.offset = checkpoint.offset if checkpoint else 0
+        self.header = checkpoint.header if checkpoint else None
+        self.fingerprint = checkpoint.fingerprint if checkpoint else None
+        self.quarantined = False  # lines that failed: not read again until restart
+
+    def _fingerprint(self, f):
+        # Hash of the first bytes read so far: tells a new file apart from one with a reused inode
+        f.seek(0)
+        return hashlib.sha1(f.read(min(self.offset, FINGERPRINT_BYTES))).hexdigest()
+
+    def read_new_lines(self):
+        """Return (header, text) of the complete lines appended since the last read, or None."""
+        st = os.stat(self.path)
+        if st.st_ino == self.inode and st.st_size == self.offset:
+            return None
+        with open(self.path, 'rb') as f:
+            if (st.st_ino != self.inode or st.st_size < self.offset
+                    or self.fingerprint not in (None, self._fingerprint(f))):
+                # New, replaced or truncated file: start from the top
+                self.inode, self.offset, self.header = st.st_ino, 0, None
+            f.seek(self.offset)
+            data = f.read(st.st_size - self.offset)
+            # Leave a partly written last line for the next read
+            end = data.rfind(b'\n')
+            if end < 0:
+                return None
+            data = data[:end + 1]
+            self.offset += len(data)
+            self.fingerprint = self._fingerprint(f)
+        text = data.decode('utf-8')
+        if self.header is None:
+            self.header, _, text = text.partition('\n')
+        return self.header, text
+
+
+def flush(db, files, pending):
+    """Insert the pending lines and move the checkpoints of their files in one transaction.
+
+    A file whose lines fail to parse or insert is left out and the transaction is retried
+    without it; its checkpoint stays at the last good commit. Database errors are raised.
+    Returns (rows inserted per source, {path: error} of the files left out).
+    """
+    profiler = db.profiler
+    failed = {}
+    while True:
+        inserted = dict.fromkeys(SOURCES, 0)
+        path = None
+        try:
+            for path, chunks in pending.items():
+                if path in failed:
+                    continue
+                tailed = files[path]
+                _, sep, normalize, insert = SOURCES[tailed.kind]
+                for header, text in chunks:
+                    if not text:
+                        continue
+                    with profiler.stage('parse') as stage:
+                        df = pd.read_csv(io.StringIO(header + '\n' + text), sep=sep)
+                        stage.add_rows(len(df))
+                    inserted[tailed.kind] += insert(db, normalize(df, path))
+                db.session.merge(IngestCheckpoint(path=path, inode=tailed.inode, offset=tailed.offset,
+                                                  header=tailed.header, fingerprint=tailed.fingerprint,
+                                                  updated_epoch=int(time.time())))
+            path = None
+            with profiler.stage('commit'):
+                db.session.commit()
+            break
+        except OperationalError:
+            # Locked, full or unreachable database: not the fault of one file
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            if path is None:
+                raise
+            failed[path] = f"{type(e).__name__}: {e}"
+    for kind, source in (('p1e', 'electricity'), ('p1g', 'gas')):
+        if inserted[kind]:
+            db.refresh_timeseries(source)
+    return inserted, failed
+
+
+@click.command()
+@click.option('-d', '--dburl', required=True, help='SQLAlchemy database URL (e.g., sqlite:///smarthome.db)')
+@click.option('--p1e', 'p1e_dirs', multiple=True, type=click.Path(exists=True, file_okay=False),
+              help='Directory with growing P1e CSVs.')
+@click.option('--p1g', 'p1g_dirs', multiple=True, type=click.Path(exists=True, file_okay=False),
+              help='Directory with growing P1g CSVs.')
+@click.option('--smartthings', 'smartthings_dirs', multiple=True, type=click.Path(exists=True, file_okay=False),
+              help='Directory with growing SmartThings TSVs.')
+@click.option('--interval', type=float, default=1.0, show_default=True,
+              help='Seconds between directory scans (longest inotify wait).')
+@click.option('--batch-seconds', type=float, default=2.0, show_default=True,
+              help='Insert pending lines once the oldest is this old.')
+@click.option('--batch-rows', type=int, default=10000, show_default=True,
+              help='Insert pending lines once this many are waiting.')
+@click.option('--poll', is_flag=True, help='Poll even when inotify_simple is available.')
+@click.option('--once', is_flag=True, help='Ingest what is there now and exit.')
+@profile_options
+def watch(dburl, p1e_dirs, p1g_dirs, smartthings_dirs, interval, batch_seconds, batch_rows, poll, once):
+    """Follow P1e/P1g/SmartThings export directories and ingest appended lines continuously.
+
+    Only the bytes appended since the last read are parsed (complete lines only), in micro-batches
+    of at most --batch-seconds. The read offset of every file is stored in ingest_checkpoints in
+    the same transaction as its rows, so a restart continues where the last commit ended; lines
+    read twice after a crash are dropped by the loaders' duplicate checks. A file with lines that
+    fail to parse or insert is skipped until restart; the other files keep being ingested.
+    Compressed files are not followed; load them with p1e.py/p1g.py/smartthings.py.
+
+    Usage:
+        watch.py -d sqlite:///smarthome.db --p1e data/P1e --p1g data/P1g --smartthings data/smartthings
+    """
+    dirs = [('p1e', d) for d in p1e_dirs] + [('p1g', d) for d in p1g_dirs] \
+        + [('smartthings', d) for d in smartthings_dirs]
+    if not dirs:
+        raise click.UsageError("Give at least one of --p1e, --p1g or --smartthings.")
+
+    db = HomeMessagesDB(dburl)
+    profiler = db.profiler
+    inotify = None
+    stop = []
+    try:
+        checkpoints = {c.path: c for c in db.session.query(IngestCheckpoint)}
+        if INotify is not None and not poll and not once:
+            inotify = INotify()
+            for _, directory in dirs:
+                inotify.add_watch(directory, flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE | flags.MOVED_TO)
+        if not once:
+            click.echo(f"Watching {len(dirs)} director{'y' if len(dirs) == 1 else 'ies'} "
+                       f"({'inotify' if inotify else 'polling'}); Ctrl-C to stop.")
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: stop.append(True))
+
+        files = {}
+        pending = {}
+        pending_rows = 0
+        first_pending = None
+        while True:
+            # Step 1: read the lines appended to every watched file
+            with profiler.stage('tail_read') as stage:
+                for kind, directory in dirs:
+                    for path in sorted(glob.glob(os.path.join(directory, SOURCES[kind][0]))):
+                        path = os.path.abspath(path)
+                        if path not in files:
+                            files[path] = TailedFile(path, kind, checkpoints.get(path))
+                        if files[path].quarantined:
+                            continue
+                        chunk = files[path].read_new_lines()
+                        if chunk is None:
+                            continue
+                        pending.setdefault(path, []).append(chunk)
+                        lines = chunk[1].count('\n')
+                        pending_rows += lines
+                        stage.add_rows(lines)
+                        if first_pending is None:
+                            first_pending = time.monotonic()
+
+            # Step 2: insert a micro-batch when it is old or big enough
+            if pending and (stop or once or pending_rows >= batch_rows
+                            or time.monotonic() - first_pending >= batch_seconds):
+                with profiler.stage('flush') as stage:
+                    inserted, failed = flush(db, files, pending)
+                    stage.add_rows(pending_rows)
+                for path, error in failed.items():
+                    files[path].quarantined = True
+                    click.echo(f"Skipping {path} until restart: {error}. Its checkpoint stays at the last "
+                               "committed line; fix the file and restart to ingest the rest.", err=True)
+                latency = time.monotonic() - first_pending
+                counts = ', '.join(f"{kind} {n}" for kind, n in inserted.items() if n)
+                click.echo(f"{datetime.now():%H:%M:%S} {pending_rows} line(s) from {len(pending)} file(s), "
+                           f"inserted {counts or 'nothing new'} ({latency:.1f}s after read)")
+                pending, pending_rows, first_pending = {}, 0, None
+
+            if stop or once:
+                break
+            # Step 3: wait for a change (inotify) or the next scan
+            if inotify:
+                inotify.read(timeout=int(interval * 1000))
+            else:
+                time.sleep(interval)
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        raise
+    finally:
+        if inotify:
+            inotify.close()
+        db.close()
+
+if __name__ == "__main__":
+    watch()